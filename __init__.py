@@ -1,10 +1,16 @@
 # Copyright (c) 2013 Che-Liang Chiou
 
-'''Public API of scons_package.'''
+'''Public API of scons_package.
 
-from SCons.Script import Dir, Environment
+SCons and modules used by a single function are imported on first use so
+that tools reading labels, rules, and packages do not start up SCons.
+'''
+
+import os
+import sys
 
 from scons_package import builder_maker
+from scons_package import test_runner
 from scons_package.builder_maker_builder import BuilderMakerBuilder
 from scons_package.builder_maker_registry import BuilderMakerRegistry
 from scons_package.exec_build_makers import BuilderMakerOrder
@@ -13,8 +19,14 @@ from scons_package.exec_build_makers import exec_variant_builder_makers
 from scons_package.label import PackageName
 from scons_package.package_registry import PackageVariantRegistry
 from scons_package.package_registry import PackageEnvironmentRegistry
+from scons_package.resource_pool import ResourcePoolRegistry
 from scons_package.utils import glob
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
 __all__ = ['search_package_environment',
            'search_package_variant',
            'default_environment',
@@ -23,8 +35,19 @@ __all__ = ['search_package_environment',
            'package_variant',
            'library',
            'program',
+           'genrule',
+           'test',
+           'shared_libraries',
+           'resource_pool',
+           'remote_execution',
+           'stream_build_events',
+           'load_packages',
            'make_builders',
            'make_variant_builders',
+           'make_ninja',
+           'prefetch_signatures',
+           'report_graph',
+           'reload_package',
            'glob']
 
 
@@ -42,7 +65,7 @@ def search_package_variant(package=None):
 
 def default_environment(env):
     '''Set default environment.'''
-    assert isinstance(env, Environment)
+    assert _is_environment(env)
     PackageEnvironmentRegistry.get_instance().default = env
 
 
@@ -54,7 +77,7 @@ def default_variant(variant):
 
 def package_environment(env, package=None):
     '''Set package's environment.'''
-    assert isinstance(env, Environment)
+    assert _is_environment(env)
     assert package is None or isinstance(package, str)
     _package_set(PackageEnvironmentRegistry.get_instance(), package, env)
 
@@ -66,6 +89,11 @@ def package_variant(variant, package=None):
     _package_set(PackageVariantRegistry.get_instance(), package, variant)
 
 
+def _is_environment(env):
+    from SCons.Script import Environment
+    return isinstance(env, Environment)
+
+
 def _package_get(trie, package_str):
     pkg_name = PackageName.make_package_name(package_str)
     return trie.search(pkg_name)
@@ -73,46 +101,383 @@ def _package_get(trie, package_str):
 
 def _package_set(trie, package_str, value):
     pkg_name = PackageName.make_package_name(package_str)
-    trie.add(pkg_name, value)
+    trie.add(pkg_name, value, _get_owner())
 
 
-def program(name, srcs, deps=(), variant=None, env=None):
+def _get_owner():
+    '''Return package of the SConscript being read (which reload_package
+    re-evaluates), or None outside SConscripts.'''
+    sconscript = sys.modules.get('SCons.Script.SConscript')
+    if sconscript is None or not getattr(sconscript, 'call_stack', None):
+        return None
+    return PackageName.make_package_name()
+
+
+def program(name, srcs, deps=(), variant=None, env=None, pch=None,
+            pool=None):
     '''Declare a program.'''
     assert variant is None or isinstance(variant, str)
-    assert env is None or isinstance(env, Environment)
-    _builder_maker_builder(builder_maker.PROGRAM,
-                           name, srcs, deps, variant, env, None)
+    assert env is None or _is_environment(env)
+    assert pch is None or isinstance(pch, str)
+    assert pool is None or isinstance(pool, str)
+    _builder_maker_builder(builder_maker.PROGRAM, name, srcs, deps,
+                           variant=variant, env=env, pch=pch, pool=pool)
+
+
+def test(name, srcs, deps=(), variant=None, env=None, pch=None, pool=None,
+         data=(), shards=1, timeout=None, args=()):
+    '''Declare a test program and its executions.
+
+    The test is split into shards run in parallel (see TEST_SHARD_INDEX and
+    TEST_TOTAL_SHARDS), each killed after timeout seconds; a shard is run
+    again only when the program or its data change.  Build the 'test'
+    alias to run all tests.
+    '''
+    assert variant is None or isinstance(variant, str)
+    assert env is None or _is_environment(env)
+    assert pch is None or isinstance(pch, str)
+    assert pool is None or isinstance(pool, str)
+    test_options = test_runner.TestOptions(data, shards, timeout, args)
+    _builder_maker_builder(builder_maker.PROGRAM, name, srcs, deps,
+                           variant=variant, env=env, pch=pch, pool=pool,
+                           test_options=test_options)
+
 
+def library(name, srcs, deps=(), variant=None, env=None, export_env=None,
+            export_includes=(), export_libpath=(), hdrs=(), pch=None,
+            archive=None, pool=None):
+    '''Declare a library.
 
-def library(name, srcs, deps=(), variant=None, env=None, export_env=None):
-    '''Declare a library.'''
+    The archive contains only the objects of the library; programs link the
+    libraries of all their depends.  Libraries depending on the library are
+    rebuilt only when its interface (the contents of hdrs, its public
+    headers, and its exported symbols) changes.
+
+    export_includes and export_libpath are directories (relative to the
+    package unless they start with '#') added to CPPPATH and LIBPATH of the
+    library and of rules depending on it, directly or transitively.  Unlike
+    an export_env appending to the package environment, a rule only
+    searches the directories of its declared depends.
+
+    archive selects a thin archive ('thin'), which references the objects
+    instead of copying them, or an archive updated in place ('incremental').
+    The library is a shared library in variants of shared_libraries().
+    '''
     assert variant is None or isinstance(variant, str)
-    assert env is None or isinstance(env, Environment)
+    assert env is None or _is_environment(env)
     assert export_env is None or callable(export_env)
-    _builder_maker_builder(builder_maker.STATIC_LIBRARY,
-                           name, srcs, deps, variant, env, export_env)
+    assert pch is None or isinstance(pch, str)
+    assert archive is None or isinstance(archive, str)
+    assert pool is None or isinstance(pool, str)
+    _builder_maker_builder(builder_maker.STATIC_LIBRARY, name, srcs, deps,
+                           variant=variant, env=env, export_env=export_env,
+                           export_includes=export_includes,
+                           export_libpath=export_libpath, hdrs=hdrs,
+                           pch=pch, archive=archive, pool=pool)
 
 
-def _builder_maker_builder(builder_type,
-                           name, srcs, deps, variant, env, export_env):
+def _builder_maker_builder(builder_type, name, srcs, deps,
+                           variant=None, env=None, export_env=None,
+                           export_includes=(), export_libpath=(), hdrs=(),
+                           pch=None, archive=None, pool=None,
+                           test_options=None, outs=None, command=None):
     bmb = BuilderMakerBuilder()
     bmb.set_builder_type(builder_type)
-    bmb.set_name_srcs_deps(name, srcs, deps)
+    bmb.set_name_srcs_deps(name, srcs, deps, outs)
     if variant is not None:
         bmb.set_variant(variant)
     if env is not None:
         bmb.set_env(env)
     if export_env is not None:
         bmb.set_export_env(export_env)
+    if export_includes:
+        bmb.set_export_includes(export_includes)
+    if export_libpath:
+        bmb.set_export_libpath(export_libpath)
+    if hdrs:
+        bmb.set_hdrs(hdrs)
+    if pch is not None:
+        bmb.set_pch(pch)
+    if archive is not None:
+        bmb.set_archive(archive)
+    if pool is not None:
+        bmb.set_pool(pool)
+    if test_options is not None:
+        bmb.set_test_options(test_options)
+    if command is not None:
+        bmb.set_command(command)
     bmb.build(BuilderMakerRegistry.get_instance())
 
 
+def genrule(name, outs, cmd, srcs=(), tools=(), variant=None, env=None,
+            pool=None):
+    '''Declare files generated by a shell command.
+
+    cmd is substituted like a SCons command; $SOURCES are srcs, $TARGETS
+    are outs, and $TOOLS are outputs of the rules of tools (such as a
+    program built in the tree).  Outputs are cached by the command line,
+    the contents of srcs and tools, and the binary that cmd runs, and are
+    reused across clean builds and variants.  Rules depending on a
+    genrule compile its C and C++ outputs, and their objects depend on its
+    other outputs, such as headers.
+    '''
+    assert isinstance(cmd, str)
+    assert variant is None or isinstance(variant, str)
+    assert env is None or _is_environment(env)
+    assert pool is None or isinstance(pool, str)
+    _builder_maker_builder(builder_maker.GENRULE, name, srcs, tools,
+                           variant=variant, env=env, pool=pool, outs=outs,
+                           command=cmd)
+
+
+def shared_libraries(variant=None):
+    '''Build libraries of the variant (None if no variants) as shared ones.
+
+    Programs and shared libraries link the shared libraries by path and
+    find them through a run path relative to $ORIGIN.  They are linked
+    again only when the interface of a library changes, and tests run
+    again when a library changes.
+    '''
+    assert variant is None or isinstance(variant, str)
+    BuilderMakerRegistry.get_instance().shared_variants.add(variant)
+
+
+def resource_pool(name, size, builder_types=()):
+    '''Declare a pool that caps concurrent actions of its rules.
+
+    Rules join the pool through the pool argument of library/program, or
+    by their builder type (builder_maker.PROGRAM, STATIC_LIBRARY,
+    SHARED_LIBRARY, GENRULE).  Test executions join the pool named 'test'.
+    Targets waiting for a slot of their pool do not hold -j jobs.
+    '''
+    assert isinstance(name, str)
+    assert isinstance(size, int)
+    from scons_package.resource_pool import install_scheduler
+    rpreg = ResourcePoolRegistry.get_instance()
+    rpreg.add_pool(name, size)
+    install_scheduler(rpreg)
+    for builder_type in builder_types:
+        assert builder_type in builder_maker.BUILDER_TYPES
+        rpreg.set_builder_type_pool(builder_type, name)
+
+
+def remote_execution(address=None, authkey=None, root=None, jobs=None):
+    '''Dispatch compile and link actions to an execution service.
+
+    Connect to the service listening at address (see
+    tools/remote_exec_worker, which listens on ROOT/sock/worker.sock by
+    default), or run a local worker pool that keeps its action cache
+    under root when address is None.
+    '''
+    from scons_package import remote_exec
+    if address is not None:
+        executor = remote_exec.RemoteExecutor(address, authkey)
+    else:
+        assert root is not None
+        executor = remote_exec.LocalExecutor(root, jobs)
+    BuilderMakerRegistry.get_instance().executor = executor
+
+
+def stream_build_events(path=None, address=None):
+    '''Record every action of the rules as a line of JSON.
+
+    Events (see the build_events module for their fields) are written to
+    the file at path, or to the Unix domain socket listening at address,
+    by a background thread.  Call before making builders.
+    '''
+    import atexit
+    from scons_package import build_events
+    writer = build_events.open_event_writer(path, address)
+    BuilderMakerRegistry.get_instance().event_writer = writer
+    atexit.register(writer.close)
+
+
+def load_packages(build_file='SConscript', skip_dirs=(),
+                  cache_path='.scons_package/packages.json', jobs=None,
+                  build_root=None):
+    '''Discover packages under the top directory and load them.
+
+    Every subdirectory with a build file is a package, except build_root
+    (where variant directories have copies of build files) and directories
+    in skip_dirs.  Build files are loaded in path order.
+    '''
+    from SCons.Script import Dir, SConscript
+    from scons_package import discovery
+    top = Dir('#').abspath
+    skip_dirs = list(skip_dirs)
+    if build_root is not None:
+        skip_dirs.append(os.path.relpath(Dir(build_root).abspath, top))
+    if cache_path is not None:
+        cache_path = os.path.join(top, cache_path)
+    packages = discovery.discover_packages(top, build_file, skip_dirs,
+                                           cache_path, jobs)
+    for package in packages:
+        if package != os.curdir:  # The caller
+            SConscript('#' + os.path.join(package, build_file))
+
+
 def make_builders(sconscript=None, build_root=None, variants=(), duplicate=1):
     '''Generate SCons builders for all variants.'''
     exec_builder_makers(BuilderMakerOrder.get_instance(),
                         sconscript, build_root, variants, duplicate)
+    # List files of the graph for the build daemon running SCons
+    from scons_package import daemon
+    manifest_path = os.environ.get(daemon.MANIFEST_ENV)
+    if manifest_path:
+        build_roots = [build_root] if build_root is not None else []
+        daemon.write_manifest(manifest_path, build_roots)
 
 
 def make_variant_builders(variant=None):
     '''Generate SCons builders for the variant.'''
     exec_variant_builder_makers(BuilderMakerOrder.get_instance(), variant)
+
+
+def reload_package(package, sconscript='SConscript'):
+    '''Re-evaluate the SConscript of a changed package after sorting.
+
+    This updates the rule graph for analysis in a long-running process:
+    sort it with report_graph, reload changed packages, and call
+    report_graph again.  Builders are not updated, so reloading after
+    make_builders is an error; builds (and the daemon) re-read all
+    SConscripts instead.  The SConscript should declare rules of its own
+    package only.  If it fails (or declares missing dependencies or
+    cycles), the error is raised and the old rules of the package stay.
+    '''
+    assert isinstance(package, str)
+    from SCons.Script import SConscript
+    package_name = PackageName.make_package_name(package)
+    path = '#' + os.path.join(package_name.path, sconscript)
+    BuilderMakerOrder.get_instance().update_package(
+        package_name, lambda: SConscript(path))
+
+
+def prefetch_signatures(cache_path='.scons_package/signatures.json',
+                        jobs=None):
+    '''Compute content signatures of source files on a thread pool.
+
+    Call after making builders.  Sources of the rules, and files whose
+    signatures were recorded by earlier builds (such as scanned headers),
+    are hashed unless their size and mtime are unchanged since they were
+    hashed.  Copies of sources in variant directories (duplicate=1) get the
+    signatures of their sources.  Signatures that SCons computes during the
+    build are recorded when it exits.
+    '''
+    import atexit
+    import SCons.Node.FS
+    from SCons.Script import Dir, File
+    from scons_package import signature_cache
+    cache = signature_cache.SignatureCache(_get_hash_name(), jobs)
+    cache.load_cache(cache_path)
+    bmreg = BuilderMakerRegistry.get_instance()
+    paths = builder_maker.get_source_files(bmreg) + cache.get_paths()
+    digests = cache.prefetch(paths)
+    variant_dirs = [node for node in _walk_nodes(Dir('#').root)
+                    if isinstance(node, SCons.Node.FS.Dir) and node.srcdir]
+    for path, digest in digests.items():
+        if os.path.isabs(path):
+            nodes = [File(path)]
+        else:
+            nodes = [File('#' + path)]
+            for variant_dir in variant_dirs:
+                src_path = os.path.relpath(path, variant_dir.srcdir.path)
+                if src_path.split(os.sep)[0] != os.pardir:
+                    nodes.append(variant_dir.File(src_path))
+        for node in nodes:
+            if not node.has_builder():
+                node.get_ninfo().csig = digest
+    atexit.register(_save_signatures, cache, os.path.abspath(cache_path),
+                    digests)
+
+
+def _get_hash_name():
+    try:
+        from SCons.Util import get_current_hash_algorithm_used
+    except ImportError:
+        return 'md5'  # The only hash of SCons before 4.2
+    return get_current_hash_algorithm_used()
+
+
+def _save_signatures(cache, cache_path, prefetched):
+    import SCons.Node.FS
+    top = SCons.Node.FS.get_default_fs().Top
+    for node in _walk_nodes(top.root):
+        if not isinstance(node, SCons.Node.FS.File):
+            continue
+        src = node.srcnode()
+        if src.path in prefetched or node.has_builder():
+            continue
+        csig = getattr(getattr(node, 'ninfo', None), 'csig', None)
+        # SCons stats a file before reading it, so a file modified in the
+        # meantime is hashed again by the next build
+        node_stat = node.stat()
+        if not csig or node_stat is None:
+            continue
+        # A copy in a variant directory is recorded as its source, if it
+        # has the size and mtime of the source (i.e., it is up to date)
+        if src is not node and not _same_stat(node_stat, src.stat()):
+            continue
+        cache.update(src.path, node_stat.st_size, node_stat.st_mtime, csig)
+    cache.save_cache(cache_path)
+
+
+def _same_stat(stat1, stat2):
+    return (stat2 is not None and
+            (stat1.st_size, stat1.st_mtime) == (stat2.st_size, stat2.st_mtime))
+
+
+def _walk_nodes(root):
+    '''Yield nodes under a directory node.'''
+    import SCons.Node.FS
+    dirs = [root]
+    while dirs:
+        directory = dirs.pop()
+        for name, node in directory.entries.items():
+            if name in (os.curdir, os.pardir):
+                continue
+            yield node
+            if isinstance(node, SCons.Node.FS.Dir):
+                dirs.append(node)
+
+
+def make_ninja(path='build.ninja', build_root=None, variants=(),
+               regen_deps=()):
+    '''Write a Ninja build file of all variants instead of SCons builders.
+
+    The build file is regenerated by re-running this SCons command line
+    when the SConstruct or a SConscript that SCons read, or a file of
+    regen_deps, changes.
+    '''
+    from scons_package import ninja_backend
+    assert build_root is not None or not variants
+    build_order = BuilderMakerOrder.get_instance()
+    build_order.sort_by(variants=variants or None)
+    regen_command = ' '.join(quote(arg) for arg in sys.argv)
+    regen_deps = ninja_backend.get_regen_deps() + list(regen_deps)
+    with open(path, 'w') as output:
+        ninja_backend.generate_ninja(build_order, output, path, build_root,
+                                     regen_command, regen_deps)
+
+
+def report_graph(path=None, json_path=None, top=20, variants=()):
+    '''Write a summary of the rule graph to path (or stdout).
+
+    Rules are ranked by their transitive dependents, which are rebuilt
+    when the rule changes; json_path receives the stats of every rule.
+    Rules are sorted by variants unless builders were made already.
+    '''
+    from scons_package import graph_report
+    build_order = BuilderMakerOrder.get_instance()
+    if build_order.order is None:
+        build_order.sort_by(variants=variants or None)
+    report = graph_report.make_report(build_order.get_sorted_rules(),
+                                      build_order.get_variant,
+                                      build_order.bmreg.rules.get_depends)
+    if path is None:
+        report.write_summary(sys.stdout, top)
+    else:
+        with open(path, 'w') as output:
+            report.write_summary(output, top)
+    if json_path is not None:
+        with open(json_path, 'w') as output:
+            report.write_json(output)
@@ -0,0 +1,248 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Structured events of build actions.
+
+Every action spawned for a rule is recorded as a line of JSON with fields:
+
+    rule, variant, builder_type     the rule of the action
+    tool                            the program that the action runs
+    start, end                      seconds since the epoch
+    user_time, system_time          CPU seconds of the child process
+    max_rss                         its maximum resident set size (KiB)
+    cached                          whether the result was restored from a
+                                    cache (null if the action is uncached)
+    exit_status                     exit code, or minus the signal number
+
+The resource usage of a local child is collected by os.wait4 where SPAWN
+is the POSIX default of SCons; it is null where os.wait4 is unavailable,
+for actions run by an execution service or by a SPAWN of the user (which
+is kept, e.g., to run compilers under ccache), and for test shards and
+the nm run of interface signatures.  On Linux, max_rss is at least the
+resident set of SCons when the child is forked, so it is meaningful for
+large actions only.
+
+Rules of an environment share one SPAWN (SCons warns about a target built
+with different environments), whose recorder finds the rule of an action
+from its target.  An object compiled for several rules of an environment
+is built once; its event names the rule registered last.
+
+Events are queued and written by a background thread to a file or a Unix
+domain socket, so that recording an action never waits for I/O.
+
+This module does not depend on SCons; ActionRecorder.wrap() makes a
+function for the SPAWN construction variable of SCons, and a Python
+function action records itself with record() (from the ACTION_RECORDER
+construction variable).
+'''
+
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Construction variable of the recorder of a function action
+ACTION_RECORDER = 'ACTION_RECORDER'
+
+# Module of the default SPAWN functions of SCons on POSIX
+DEFAULT_SPAWN_MODULE = 'SCons.Platform.posix'
+
+
+class EventWriter(object):
+    '''Write events as lines of JSON on a background thread.'''
+
+    def __init__(self, output):
+        self.output = output
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write_events)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, event):
+        self.queue.put(event)
+
+    def close(self):
+        '''Write the queued events and close the output.'''
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            self.output.close()
+        except (IOError, OSError):
+            pass
+
+    def _write_events(self):
+        closed = False
+        while not closed:
+            events = [self.queue.get()]
+            # Write a burst of events at once
+            while True:
+                try:
+                    events.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in events:
+                closed = True
+                events = events[:events.index(None)]
+            lines = ''.join(json.dumps(event, sort_keys=True) + '\n'
+                            for event in events)
+            try:
+                self.output.write(lines)
+                self.output.flush()
+            except (IOError, OSError):
+                pass  # A reader going away must not fail the build
+
+
+def open_event_writer(path=None, address=None):
+    '''Return a writer to the file at path or the socket at address.'''
+    assert (path is None) != (address is None)
+    if path is not None:
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        return EventWriter(open(path, 'w'))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+        output = sock.makefile('w')
+    finally:
+        sock.close()  # The file keeps the connection open
+    return EventWriter(output)
+
+
+def get_exit_status(status):
+    '''Return exit status of a status returned by os.wait().'''
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class ActionRecorder(object):
+    '''Record actions of a rule; fields are common to its events.
+
+    A recorder of the SPAWN of an environment shared by rules finds the
+    fields of an action from the target on its command line instead (see
+    add_targets).  The event of the action being run is kept per thread,
+    since SCons runs parallel jobs on threads.
+    '''
+
+    def __init__(self, writer, fields):
+        self.writer = writer
+        self.fields = dict(fields)
+        self.target_fields = {}  # Target path -> fields of its rule
+        self.local = threading.local()
+
+    def add_targets(self, paths, fields):
+        '''Record actions writing one of paths with fields of their rule.'''
+        fields = dict(fields)
+        for path in paths:
+            self.target_fields[path] = fields
+
+    def get_target_fields(self, args):
+        '''Return fields of the target of a command line (the path after -o,
+        or the first target path), or an empty dict.'''
+        paths = [arg.strip('"') for arg in args]
+        if '-o' in paths[:-1]:
+            paths.insert(0, paths[paths.index('-o') + 1])
+        for path in paths:
+            fields = self.target_fields.get(path)
+            if fields is not None:
+                return fields
+        return {}
+
+    def start(self, tool, fields=None):
+        event = dict(self.fields)
+        event.update(fields or {})
+        event.update(tool=tool,
+                     start=time.time(),
+                     end=None,
+                     user_time=None,
+                     system_time=None,
+                     max_rss=None,
+                     cached=None,
+                     exit_status=None)
+        self.local.event = event
+        return event
+
+    def finish(self, event, exit_status):
+        event['end'] = time.time()
+        event['exit_status'] = exit_status
+        self.local.event = None
+        self.writer.write(event)
+
+    def set_cached(self, cached):
+        event = getattr(self.local, 'event', None)
+        if event is not None:
+            event['cached'] = cached
+
+    def set_result(self, result):
+        '''Record the result of remote_exec (see remote_exec.make_spawn).'''
+        self.set_cached(result.get('cached'))
+
+    def get_spawn(self, spawn):
+        '''Return a SCons SPAWN function collecting resource usage.
+
+        Only the POSIX default of SCons is replaced, by running commands in
+        a shell as it does; any other spawn (or every spawn where os.wait4
+        is unavailable) is returned as is.
+        '''
+        if (not hasattr(os, 'wait4') or
+                getattr(spawn, '__module__', None) != DEFAULT_SPAWN_MODULE):
+            return spawn
+
+        def local_spawn(sh, escape, cmd, args, env):
+            return self.call([sh, '-c', ' '.join(args)], env)
+
+        return local_spawn
+
+    def wrap(self, spawn):
+        '''Return a SCons SPAWN function recording the actions of spawn.'''
+
+        def event_spawn(sh, escape, cmd, args, env):
+            event = self.start(os.path.basename(args[0].strip('"')),
+                               self.get_target_fields(args))
+            exit_status = -1
+            try:
+                exit_status = spawn(sh, escape, cmd, args, env)
+            finally:
+                self.finish(event, exit_status)
+            return exit_status
+
+        return event_spawn
+
+    def call(self, argv, env=None):
+        '''Run argv and record its resource usage; return exit status.'''
+        proc = subprocess.Popen(argv, env=env, close_fds=True)
+        if not hasattr(os, 'wait4'):
+            return proc.wait()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = get_exit_status(status)
+        event = getattr(self.local, 'event', None)
+        if event is not None:
+            event['user_time'] = rusage.ru_utime
+            event['system_time'] = rusage.ru_stime
+            event['max_rss'] = rusage.ru_maxrss
+        return proc.returncode
+
+
+@contextlib.contextmanager
+def record(env, tool):
+    '''Record the block as an action of tool (if env has a recorder).
+
+    The block sets 'exit_status' of the event it is given; an event of a
+    block that raises has exit status -1.
+    '''
+    recorder = env.get(ACTION_RECORDER)
+    event = {} if recorder is None else recorder.start(tool)
+    event['exit_status'] = -1
+    try:
+        yield event
+    finally:
+        if recorder is not None:
+            recorder.finish(event, event['exit_status'])
@@ -1,50 +1,651 @@
 # Copyright (c) 2013 Che-Liang Chiou
 
+import os
+import subprocess
+
+from scons_package import build_events
+from scons_package import test_runner
 from scons_package.builder_maker_registry import BuilderMakerRegistry
+from scons_package.label import LabelOfFile
 from scons_package.package_registry import PackageEnvironmentRegistry
+from scons_package.resource_pool import ResourcePoolRegistry
 
 # Attributes
+ARCHIVE = 'archive'
+ARCHIVE_MEMBERS = 'archive_members'
 BUILD_OUTPUT = 'build_output'
 BUILDER_TYPE = 'builder_type'
+COMMAND = 'command'
 ENV = 'env'
 EXPORT_ENV = 'export_env'
+EXPORT_INCLUDES = 'export_includes'
+EXPORT_LIBPATH = 'export_libpath'
+HDRS = 'hdrs'
+INTERFACE = 'interface'
+OUTPUT_TYPE = 'output_type'
+PCH = 'pch'
+POOL = 'pool'
+TEST = 'test'
 VARIANT = 'variant'
 
 # Builder types
+GENRULE = 'Genrule'
 PROGRAM = 'Program'
+SHARED_LIBRARY = 'SharedLibrary'
 STATIC_LIBRARY = 'StaticLibrary'
-BUILDER_TYPES = frozenset((PROGRAM, STATIC_LIBRARY))
+BUILDER_TYPES = frozenset((GENRULE, PROGRAM, SHARED_LIBRARY, STATIC_LIBRARY))
+LIBRARY_TYPES = frozenset((SHARED_LIBRARY, STATIC_LIBRARY))
+
+# Archive modes of static libraries (other than full archives)
+THIN_ARCHIVE = 'thin'
+INCREMENTAL_ARCHIVE = 'incremental'
+ARCHIVE_MODES = frozenset((THIN_ARCHIVE, INCREMENTAL_ARCHIVE))
+
+# Resource pool of test executions (if declared)
+TEST_POOL = 'test'
+
+# Tools of compile and link actions dispatched to an execution service
+EXECUTOR_TOOLS = ('$CC', '$CXX', '$LINK')
+
+# Source suffixes compiled as C++ (others are compiled as C)
+CXX_SUFFIXES = frozenset(('.C', '.cc', '.cpp', '.cxx', '.c++'))
+
+# Suffixes of generated files that are compiled by dependents
+SOURCE_SUFFIXES = CXX_SUFFIXES.union(('.c',))
+
+# Directory of cached genrule outputs
+GENRULE_CACHE = '#.scons_package/genrule'
 
+# Suffix of the interface signature of a library
+INTERFACE_SUFFIX = '.iface'
 
-def builder_maker(rule, bmreg, pereg):
+# Commands of building a precompiled header
+PCH_COMS = {
+    'c': '$CC -o $TARGET -x c-header -c $CFLAGS $CCFLAGS $_CCCOMCOM $SOURCE',
+    'c++': ('$CXX -o $TARGET -x c++-header -c $CXXFLAGS $CCFLAGS $_CCCOMCOM '
+            '$SOURCE'),
+}
+SHPCH_COMS = {
+    'c': ('$SHCC -o $TARGET -x c-header -c $SHCFLAGS $SHCCFLAGS $_CCCOMCOM '
+          '$SOURCE'),
+    'c++': ('$SHCXX -o $TARGET -x c++-header -c $SHCXXFLAGS $SHCCFLAGS '
+            '$_CCCOMCOM $SOURCE'),
+}
+
+
+def builder_maker(rule, bmreg, pereg, variant=None, rpreg=None):
     '''Make SCons builder of a given rule.'''
     assert isinstance(bmreg, BuilderMakerRegistry)
     assert isinstance(pereg, PackageEnvironmentRegistry)
-    # Retrieve environment from rule/package/default (in that order)
+    assert rpreg is None or isinstance(rpreg, ResourcePoolRegistry)
+    env = get_env(rule, bmreg, pereg)
+    builder_type = get_builder_type(rule, bmreg, variant)
+    env = import_search_paths(rule, bmreg, env)
+    env = import_export_env(rule, bmreg, env)
+    # Build (or reuse) precompiled header with the environment of objects
+    pch = _make_pch(rule, bmreg, env, variant,
+                    builder_type == SHARED_LIBRARY)
+    # Record actions of the rule, and dispatch compile and link actions to
+    # the execution service
+    fields = {'rule': str(rule.name),
+              'variant': variant,
+              'builder_type': builder_type}
+    recorder = None  # Of Python function actions of the rule
+    if bmreg.event_writer is not None:
+        recorder = build_events.ActionRecorder(bmreg.event_writer, fields)
+    overrides = {}
+    spawn, spawn_recorder = get_spawn(bmreg, env)
+    if spawn is not env['SPAWN']:
+        overrides['SPAWN'] = spawn
+    # Resource pool that caps concurrent actions of the rule
+    pool = None
+    if rpreg is not None:
+        try:
+            pool = bmreg.get_attr(rule, POOL)
+        except KeyError:
+            pass
+        pool = rpreg.get_pool(builder_type, pool)
+    # Call builder and make alias
+    if builder_type == GENRULE:
+        output = _make_genrule(rule, bmreg, env, recorder, pool)
+    else:
+        output = _make_binary(rule, bmreg, env, builder_type, pch, overrides,
+                              pool)
+    if pool is not None:
+        rpreg.set_node_pool(output, pool)
+    if spawn_recorder is not None and builder_type != GENRULE:
+        targets = list(output) + get_objects(env, output)
+        spawn_recorder.add_targets([node.path for node in targets], fields)
+    if builder_type in LIBRARY_TYPES:
+        bmreg.set_attr(rule, INTERFACE,
+                       _make_interface(rule, bmreg, env, output,
+                                       builder_type == SHARED_LIBRARY,
+                                       recorder))
+    bmreg.set_attr(rule, BUILD_OUTPUT, output)
+    bmreg.set_attr(rule, OUTPUT_TYPE, builder_type)
+    env.Alias(str(rule.name), output)
+    # Run test program
+    try:
+        test_options = bmreg.get_attr(rule, TEST)
+    except KeyError:
+        test_options = None
+    if test_options is not None:
+        assert builder_type == PROGRAM
+        test_pool = None
+        if rpreg is not None and rpreg.has_pool(TEST_POOL):
+            test_pool = rpreg.get_pool(builder_type, TEST_POOL)
+        results = test_runner.make_test_results(env, output,
+                                                rule.outputs[0].path,
+                                                test_options, test_pool,
+                                                recorder)
+        if test_pool is not None:
+            rpreg.set_node_pool(results, test_pool)
+        # The program does not contain (and is not relinked with) its
+        # shared libraries
+        for label in get_link_libraries(rule.name, bmreg):
+            if bmreg.get_attr(label, OUTPUT_TYPE) == SHARED_LIBRARY:
+                env.Depends(results, bmreg.get_attr(label, BUILD_OUTPUT))
+        env.Alias('test', results)
+        env.Alias('test' + str(rule.name), results)
+
+
+def get_spawn(bmreg, env):
+    '''Return SPAWN of the environment and its recorder (or None).
+
+    The SPAWN records actions and dispatches compile and link actions to
+    the execution service.  It is made once per environment, since SCons
+    warns about an object (of a source shared by rules) built with
+    different environments.
+    '''
     try:
-        env = bmreg.get_attr(rule, ENV)
+        return bmreg.spawns[id(env)][1:]
     except KeyError:
-        env = pereg.search(rule.name.package_name)
-    # Create target and source
+        pass
+    spawn = env['SPAWN']
+    recorder = None
+    if bmreg.event_writer is not None:
+        recorder = build_events.ActionRecorder(
+            bmreg.event_writer,
+            {'rule': None, 'variant': None, 'builder_type': None})
+        spawn = recorder.get_spawn(spawn)
+    if bmreg.executor is not None:
+        from scons_package import remote_exec
+        tools = [os.path.basename(env.subst(tool)) for tool in EXECUTOR_TOOLS]
+        on_result = recorder.set_result if recorder is not None else None
+        spawn = remote_exec.make_spawn(bmreg.executor, tools, spawn,
+                                       on_result)
+    if recorder is not None:
+        spawn = recorder.wrap(spawn)
+    # Keep env so that its id is not reused
+    bmreg.spawns[id(env)] = (env, spawn, recorder)
+    return spawn, recorder
+
+
+def get_objects(env, output):
+    '''Return objects that env compiles for (the sources of) output.'''
+    builders = [env['BUILDERS'].get(name)
+                for name in ('StaticObject', 'SharedObject')]
+    return [node for target in output for node in target.sources
+            if node.has_builder() and node.builder in builders]
+
+
+def _make_binary(rule, bmreg, env, builder_type, pch, overrides,
+                 pool=None):
+    '''Compile and link (or archive) sources and depends of the rule.
+
+    Only the link (or archive) runs in the resource pool.
+    '''
     assert len(rule.outputs) == 1
     target = rule.outputs[0].path
     source = [label.path for label in rule.inputs]
+    # Compile sources generated by genrule depends; the other outputs (such
+    # as headers) are generated before the objects are compiled
+    headers = []
     for dep in rule.depends:
-        source.extend(bmreg.get_attr(dep, BUILD_OUTPUT))
-    # Import exported environment from depends
-    new_env = None
+        if bmreg.get_attr(dep, BUILDER_TYPE) != GENRULE:
+            continue
+        for node in bmreg.get_attr(dep, BUILD_OUTPUT):
+            if os.path.splitext(node.path)[1] in SOURCE_SUFFIXES:
+                source.append(node)
+            else:
+                headers.append(node)
+    # Compile objects explicitly so that they depend on the headers (and
+    # are not compiled in the resource pool of the link)
+    if pch is not None or headers or pool is not None:
+        ccflags = env.Split(env.get('CCFLAGS', []))
+        if pch is not None:
+            pch_header, pch_node = pch
+            ccflags.extend(('-include', pch_header, '-Winvalid-pch'))
+            headers.append(pch_node)
+        if builder_type == SHARED_LIBRARY:
+            make_object = env.SharedObject
+        else:
+            make_object = env.Object
+        objects = []
+        for src in source:
+            objects.extend(make_object(src, CCFLAGS=ccflags, **overrides))
+        env.Depends(objects, headers)
+        source = objects
+    # A static library depends on the interfaces of its library depends,
+    # which it does not contain; programs and shared libraries link the
+    # libraries of all depends
+    interfaces = []
     for dep in rule.depends:
-        export_env = bmreg.get_attr(dep, EXPORT_ENV)
-        if export_env is None:
+        dep_type = bmreg.get_attr(dep, BUILDER_TYPE)
+        if dep_type in LIBRARY_TYPES and builder_type == STATIC_LIBRARY:
+            interfaces.extend(bmreg.get_attr(dep, INTERFACE))
+        elif dep_type not in LIBRARY_TYPES and dep_type != GENRULE:
+            source.extend(bmreg.get_attr(dep, BUILD_OUTPUT))
+    # Shared libraries are linked by path rather than as sources, so that
+    # the output is linked again only when their interfaces change
+    shared_libraries = []
+    members = []
+    if builder_type != STATIC_LIBRARY:
+        for label in get_link_libraries(rule.name, bmreg):
+            library = bmreg.get_attr(label, BUILD_OUTPUT)
+            if bmreg.get_attr(label, OUTPUT_TYPE) == SHARED_LIBRARY:
+                shared_libraries.extend(library)
+                interfaces.extend(bmreg.get_attr(label, INTERFACE))
+            else:
+                source.extend(library)
+                try:
+                    members.extend(bmreg.get_attr(label, ARCHIVE_MEMBERS))
+                except KeyError:
+                    pass
+    if shared_libraries:
+        paths = [node.path for node in shared_libraries]
+        linkcom = 'SHLINKCOM' if builder_type == SHARED_LIBRARY else 'LINKCOM'
+        overrides[linkcom] = env[linkcom] + ' $SHARED_LIBRARIES'
+        overrides['SHARED_LIBRARIES'] = paths
+        overrides['RPATH'] = (env.Split(env.get('RPATH', [])) +
+                              get_run_paths(env, env.File(target).path,
+                                            paths))
+    # Shared libraries are not archived
+    archive = None
+    if builder_type == STATIC_LIBRARY:
+        try:
+            archive = bmreg.get_attr(rule, ARCHIVE)
+        except KeyError:
+            pass
+    if archive is not None:
+        overrides['ARFLAGS'] = get_arflags(env, archive)
+    if builder_type == SHARED_LIBRARY:
+        # Dependents record the name, not the path, and search the run path
+        overrides['SHLINKFLAGS'] = (env.Split(env.get('SHLINKFLAGS', [])) +
+                                    ['-Wl,-soname=${TARGET.file}'])
+    if pool is not None:
+        overrides['SPAWN'] = pool.wrap(overrides.get('SPAWN', env['SPAWN']))
+    builder = getattr(env, builder_type)
+    output = builder(target=target, source=source, **overrides)
+    env.Depends(output, interfaces)
+    env.Depends(output, members)
+    env.Requires(output, shared_libraries)
+    if archive == THIN_ARCHIVE:
+        # A thin archive holds only the paths of its members, which may not
+        # change when the members do; what links it depends on the members
+        bmreg.set_attr(rule, ARCHIVE_MEMBERS,
+                       [member for node in output for member in node.sources])
+    if archive == INCREMENTAL_ARCHIVE:
+        # Keep the archive so that ar replaces only the changed members
+        env.Precious(output)
+        env.AddPreAction(output, env.Action(_prune_archive, None))
+    return output
+
+
+def get_builder_type(rule, bmreg, variant):
+    '''Return the builder type of the rule in the variant.
+
+    Static libraries are built as shared libraries in the variants of
+    bmreg.shared_variants.
+    '''
+    builder_type = bmreg.get_attr(rule, BUILDER_TYPE)
+    if builder_type == STATIC_LIBRARY and variant in bmreg.shared_variants:
+        return SHARED_LIBRARY
+    return builder_type
+
+
+def get_run_paths(env, target, libraries):
+    '''Return RPATH of target (a path) to find the libraries (paths).
+
+    Paths are relative to $ORIGIN, the directory of target when it is
+    loaded, so that the build directory may be moved.
+    '''
+    target_dir = os.path.dirname(target)
+    rpath = []
+    for library in libraries:
+        path = os.path.relpath(os.path.dirname(library), target_dir)
+        if path == os.curdir:
+            path = '\\$$ORIGIN'
+        else:
+            path = os.path.join('\\$$ORIGIN', path)
+        if path not in rpath:
+            rpath.append(path)
+    return [env.Literal(path) for path in rpath]
+
+
+def get_link_libraries(label, bmreg):
+    '''Return libraries that the rule depends on, in link order.
+
+    A library comes before the libraries it depends on.
+    '''
+    # Depth-first post-order, reversed
+    order = []
+    visited = set()
+    stack = [(label, iter(bmreg.rules[label].depends))]
+    while stack:
+        current, depends = stack[-1]
+        for dep in depends:
+            if (dep not in visited and
+                    bmreg.get_attr(dep, BUILDER_TYPE) in LIBRARY_TYPES):
+                visited.add(dep)
+                stack.append((dep, iter(bmreg.rules[dep].depends)))
+                break
+        else:
+            stack.pop()
+            if current != label:
+                order.append(current)
+    order.reverse()
+    return order
+
+
+def _make_interface(rule, bmreg, env, library, dynamic=False,
+                    recorder=None):
+    '''Make the interface signature of a library.
+
+    The signature lists digests of the public headers and the symbols
+    exported by the library (from the dynamic symbol table of a shared
+    library); its contents change only when these change.
+    '''
+    try:
+        hdrs = [label.path for label in bmreg.get_attr(rule, HDRS)]
+    except KeyError:
+        hdrs = []
+    return env.Command(rule.outputs[0].path + INTERFACE_SUFFIX,
+                       library + hdrs,
+                       env.Action(_write_interface, None),
+                       INTERFACE_DYNAMIC=dynamic,
+                       ACTION_RECORDER=recorder)
+
+
+def _write_interface(target, source, env):
+    library, headers = source[0], source[1:]
+    args = [env.subst('$NM') or 'nm', '-g', '-P', '--defined-only']
+    if env.get('INTERFACE_DYNAMIC'):
+        args.append('-D')
+    with build_events.record(env, os.path.basename(args[0])) as event:
+        proc = subprocess.Popen(args + [library.path],
+                                stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        event['exit_status'] = proc.returncode
+    if proc.returncode != 0:
+        return proc.returncode
+    lines = ['header %s %s' % (header.srcnode().path, header.get_csig())
+             for header in headers]
+    lines.extend('symbol %s' % symbol
+                 for symbol in get_exported_symbols(output.decode('utf-8')))
+    with open(target[0].path, 'w') as interface:
+        interface.write(''.join(line + '\n' for line in lines))
+    return 0
+
+
+def get_exported_symbols(nm_output):
+    '''Return sorted "name type" of symbols listed by nm -P.'''
+    symbols = set()
+    for line in nm_output.splitlines():
+        fields = line.split()
+        # Skip archive member lines (e.g., "libx.a[x.o]:")
+        if len(fields) < 2 or line.endswith(':'):
             continue
-        if new_env is None:
-            new_env = env.Clone()
+        symbols.add('%s %s' % (fields[0], fields[1]))
+    return sorted(symbols)
+
+
+def _make_genrule(rule, bmreg, env, recorder=None, pool=None):
+    '''Run the command of the rule through the genrule cache.
+
+    Outputs of the depends (the tools) are substituted for $TOOLS.  Only
+    commands that are run (not cache hits) hold a slot of the pool.
+    '''
+    target = [label.path for label in rule.outputs]
+    source = [label.path for label in rule.inputs]
+    tools = []
+    for dep in rule.depends:
+        tools.extend(bmreg.get_attr(dep, BUILD_OUTPUT))
+    action = env.Action(_run_genrule, strfunction=_genrule_string,
+                        varlist=['GENRULE_COMMAND'])
+    output = env.Command(target, source, action,
+                         GENRULE_COMMAND=bmreg.get_attr(rule, COMMAND),
+                         GENRULE_CACHE=env.Dir(GENRULE_CACHE).abspath,
+                         ACTION_RECORDER=recorder,
+                         RESOURCE_POOL=pool,
+                         TOOLS=tools)
+    env.Depends(output, tools)
+    return output
+
+
+def _genrule_string(target, source, env):
+    return env.subst(env['GENRULE_COMMAND'], target=target, source=source)
+
+
+def _run_genrule(target, source, env):
+    from scons_package import genrule_cache
+    command = _genrule_string(target, source, env)
+    tools = env['TOOLS']
+    # Key the result by source paths, which are the same in every variant
+    key_command = command
+    for node in sorted(target + source + tools,
+                       key=lambda node: -len(node.path)):
+        key_command = key_command.replace(node.path, node.srcnode().path)
+    inputs = [(node.srcnode().path, node.abspath) for node in source + tools]
+    environ = dict((str(key), str(value))
+                   for key, value in env['ENV'].items())
+    tool = genrule_cache.get_tool(command, environ.get('PATH', os.defpath))
+    if tool is not None:
+        tool = os.path.abspath(tool)
+        if tool not in set(path for _, path in inputs):
+            inputs.append((tool, tool))
+    outputs = [(node.srcnode().path, node.abspath) for node in target]
+    cache = genrule_cache.GenruleCache(env['GENRULE_CACHE'])
+    recorder = env.get(build_events.ACTION_RECORDER)
+    call = recorder.call if recorder is not None else subprocess.call
+    pool = env.get('RESOURCE_POOL')
+    if pool is not None:
+        call = pool.wrap(call)
+    if recorder is None:
+        return cache.run(command, key_command, inputs, outputs, environ,
+                         call)[0]
+    event = recorder.start(os.path.basename(tool or 'sh'))
+    exit_code = -1
+    try:
+        exit_code, cached = cache.run(command, key_command, inputs, outputs,
+                                      environ, call)
+        recorder.set_cached(cached)
+    finally:
+        recorder.finish(event, exit_code)
+    return exit_code
+
+
+def get_source_files(bmreg):
+    '''Return sorted paths of files read by rules and not generated.'''
+    producers = bmreg.rules.producers
+    paths = set()
+    for label in bmreg.rules:
+        rule = bmreg.rules[label]
+        labels = list(rule.inputs)
+        for key in (HDRS, PCH):
+            try:
+                value = bmreg.get_attr(label, key)
+            except KeyError:
+                continue
+            if isinstance(value, LabelOfFile):
+                labels.append(value)
+            else:
+                labels.extend(value)
+        paths.update(file_label.path for file_label in labels
+                     if file_label not in producers)
+    return sorted(paths)
+
+
+def get_env(rule, bmreg, pereg):
+    '''Retrieve environment from rule/package/default (in that order).'''
+    try:
+        return bmreg.get_attr(rule, ENV)
+    except KeyError:
+        return pereg.search(rule.name.package_name)
+
+
+def import_search_paths(rule, bmreg, env):
+    '''Return env with search paths exported from the rule and its depends.
+
+    Rules with identical search paths in the same environment share one
+    environment.
+    '''
+    cpppath = get_search_paths(rule.name, bmreg, EXPORT_INCLUDES)
+    libpath = get_search_paths(rule.name, bmreg, EXPORT_LIBPATH)
+    if not cpppath and not libpath:
+        return env
+    key = (id(env), cpppath, libpath)
+    try:
+        return bmreg.get_env(key)
+    except KeyError:
+        pass
+    new_env = env.Clone()
+    new_env.AppendUnique(CPPPATH=list(cpppath), LIBPATH=list(libpath))
+    bmreg.set_env(key, new_env)
+    return new_env
+
+
+def get_search_paths(label, bmreg, key):
+    '''Return paths exported from the rule and its transitive depends.
+
+    Paths are ordered by a depth-first walk of the depends, with duplicates
+    removed, and identical tuples of paths are the same object.
+    '''
+    try:
+        return bmreg.get_search_paths(label, key)
+    except KeyError:
+        pass
+    try:
+        paths = list(bmreg.get_attr(label, key))
+    except KeyError:
+        paths = []
+    seen = set(paths)
+    for dep in bmreg.rules[label].depends:
+        for path in get_search_paths(dep, bmreg, key):
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return bmreg.set_search_paths(label, key, tuple(paths))
+
+
+def import_export_env(rule, bmreg, env):
+    '''Return env modified by environments exported from depends.
+
+    Rules with the same depends exporting environments in the same
+    environment share one environment.
+    '''
+    export_envs = []
+    for dep in rule.depends:
+        try:
+            export_envs.append((dep, bmreg.get_attr(dep, EXPORT_ENV)))
+        except KeyError:
+            continue
+    if not export_envs:
+        return env
+    key = (EXPORT_ENV, id(env), tuple(dep for dep, _ in export_envs))
+    try:
+        return bmreg.get_env(key)
+    except KeyError:
+        pass
+    new_env = env.Clone()
+    for _, export_env in export_envs:
         export_env(new_env)  # Modify env in place
-    if new_env is not None:
-        env = new_env
-    # Call builder and make alias
-    builder_type = bmreg.get_attr(rule, BUILDER_TYPE)
-    builder = getattr(env, builder_type)
-    output = builder(target=target, source=source)
-    bmreg.set_attr(rule, BUILD_OUTPUT, output)
-    env.Alias(str(rule.name), output)
+    bmreg.set_env(key, new_env)
+    return new_env
+
+
+def _make_pch(rule, bmreg, env, variant, shared=False):
+    '''Return (header path, precompiled header node) of the rule, or None.
+
+    Rules sharing a header in the same environment and variant share a
+    single precompiled header.  Objects of shared libraries are compiled
+    with different flags and use a precompiled header of their own.
+    '''
+    try:
+        header = bmreg.get_attr(rule, PCH)
+    except KeyError:
+        return None
+    assert isinstance(header, LabelOfFile)
+    language = get_language(rule)
+    key = (id(env), variant, header, language, shared)
+    try:
+        return bmreg.get_pch(key)
+    except KeyError:
+        pass
+    index = get_pch_index(bmreg.pchs, key)
+    path = get_pch_path(header.path, language, shared, index)
+    command = (SHPCH_COMS if shared else PCH_COMS)[language]
+    pch_header = env.File(path).path
+    pch_node = env.Command(path + '.gch', header.path, command)
+    pch = (pch_header, pch_node)
+    bmreg.set_pch(key, pch)
+    return pch
+
+
+def get_pch_index(pchs, key):
+    '''Return index of the environment of key among the environments of
+    precompiled headers (keys of pchs) of the same header.'''
+    return sum(1 for other in pchs if other[1:] == key[1:])
+
+
+def get_pch_path(header_path, language, shared, index):
+    '''Return path that objects include the precompiled header as.
+
+    GCC looks for path.gch next to the (missing) header at path, which
+    tells apart the precompiled headers of the header by the language, by
+    shared objects, and by the index of the environment.
+    '''
+    tag = language
+    if shared:
+        tag += '-shared'
+    if index:
+        tag += '-%d' % index
+    dirname, basename = os.path.split(header_path)
+    return os.path.join(dirname, '.pch', tag, basename)
+
+
+def get_language(rule):
+    for label in rule.inputs:
+        if os.path.splitext(label.path)[1] in CXX_SUFFIXES:
+            return 'c++'
+    return 'c'
+
+
+def get_arflags(env, archive):
+    arflags = env.subst('$ARFLAGS')
+    if archive == THIN_ARCHIVE:
+        flags = 'T'
+    else:
+        assert archive == INCREMENTAL_ARCHIVE
+        # Deterministic archives (D) have no timestamps to compare with
+        arflags = arflags.replace('D', '')
+        flags = 'uU'
+    for flag in flags:
+        if flag not in arflags:
+            arflags += flag
+    return arflags
+
+
+def _prune_archive(target, source, env):
+    '''Delete members that are no longer sources of the archive.'''
+    archive = target[0].path
+    if not os.path.exists(archive):
+        return 0
+    ar = env.subst('$AR')
+    members = subprocess.check_output([ar, 't', archive])
+    members = members.decode('utf-8').split()
+    sources = set(os.path.basename(node.path) for node in source)
+    stale = [member for member in members if member not in sources]
+    if stale:
+        return subprocess.call([ar, 'd', archive] + stale)
+    return 0
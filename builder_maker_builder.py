@@ -1,8 +1,9 @@
 # Copyright (c) 2013 Che-Liang Chiou
 
-from SCons.Script import Environment
+import os
 
 from scons_package import builder_maker
+from scons_package import test_runner
 from scons_package.label import LabelOfFile, LabelOfRule
 from scons_package.rule import Rule
 
@@ -15,17 +16,28 @@ class BuilderMakerBuilder:
         self.variant = None
         self.env = None
         self.export_env = None
+        self.export_includes = None
+        self.export_libpath = None
+        self.hdrs = None
+        self.pch = None
+        self.archive = None
+        self.pool = None
+        self.test_options = None
+        self.command = None
 
     def set_builder_type(self, builder_type):
         if builder_type not in builder_maker.BUILDER_TYPES:
             raise RuntimeError('unsupported builder type: %s' % builder_type)
         self.builder_type = builder_type
 
-    def set_name_srcs_deps(self, name, srcs, deps):
+    def set_name_srcs_deps(self, name, srcs, deps, outs=None):
         label = LabelOfRule.make_label(name)
         inputs = LabelOfFile.make_label_list(srcs)
         depends = LabelOfRule.make_label_list(deps)
-        outputs = [LabelOfFile.make_label(name)]
+        if outs is None:
+            outputs = [LabelOfFile.make_label(name)]
+        else:
+            outputs = LabelOfFile.make_label_list(outs)
         self.rule = Rule(label, inputs, depends, outputs)
 
     def set_variant(self, variant):
@@ -33,6 +45,7 @@ class BuilderMakerBuilder:
         self.variant = variant
 
     def set_env(self, env):
+        from SCons.Script import Environment
         assert isinstance(env, Environment)
         self.env = env
 
@@ -40,9 +53,68 @@ class BuilderMakerBuilder:
         assert callable(export_env)
         self.export_env = export_env
 
+    def set_export_includes(self, export_includes):
+        self.export_includes = self._make_path_list(export_includes)
+
+    def set_export_libpath(self, export_libpath):
+        self.export_libpath = self._make_path_list(export_libpath)
+
+    def _make_path_list(self, paths):
+        # Paths are relative to the package unless they start with '#'; they
+        # are kept relative (to the top) so that SCons searches both the
+        # build and the source directory of a variant
+        assert self.rule is not None
+        if isinstance(paths, str):
+            paths = paths.split()
+        package_path = self.rule.name.package_name.path
+        path_list = []
+        for path in paths:
+            if not path.startswith('#'):
+                path = os.path.normpath(os.path.join(package_path, path))
+            if path not in path_list:
+                path_list.append(path)
+        return tuple(path_list)
+
+    def set_hdrs(self, hdrs):
+        self.hdrs = LabelOfFile.make_label_list(hdrs)
+
+    def set_pch(self, pch):
+        self.pch = LabelOfFile.make_label(pch)
+
+    def set_archive(self, archive):
+        if archive not in builder_maker.ARCHIVE_MODES:
+            raise RuntimeError('unsupported archive mode: %s' % archive)
+        self.archive = archive
+
+    def set_pool(self, pool):
+        assert isinstance(pool, str)
+        self.pool = pool
+
+    def set_test_options(self, test_options):
+        assert isinstance(test_options, test_runner.TestOptions)
+        self.test_options = test_options
+
+    def set_command(self, command):
+        assert isinstance(command, str)
+        self.command = command
+
     def build(self, bmreg):
         assert self.rule is not None
         assert self.builder_type is not None
+        if (self.archive is not None and
+                self.builder_type != builder_maker.STATIC_LIBRARY):
+            raise RuntimeError('archive mode of non-library: %s' %
+                               self.rule.name)
+        if (self.test_options is not None and
+                self.builder_type != builder_maker.PROGRAM):
+            raise RuntimeError('test of non-program: %s' % self.rule.name)
+        is_genrule = self.builder_type == builder_maker.GENRULE
+        if self.command is not None and not is_genrule:
+            raise RuntimeError('command of non-genrule: %s' % self.rule.name)
+        if self.command is None and is_genrule:
+            raise RuntimeError('genrule without command: %s' % self.rule.name)
+        if not self.rule.outputs:
+            raise RuntimeError('rule without outputs: %s' % self.rule.name)
         bmreg.add_rule(self.rule)
         bmreg.set_attr(self.rule, builder_maker.BUILDER_TYPE,
                        self.builder_type)
@@ -53,3 +125,21 @@ class BuilderMakerBuilder:
         if self.export_env is not None:
             bmreg.set_attr(self.rule, builder_maker.EXPORT_ENV,
                            self.export_env)
+        if self.export_includes:
+            bmreg.set_attr(self.rule, builder_maker.EXPORT_INCLUDES,
+                           self.export_includes)
+        if self.export_libpath:
+            bmreg.set_attr(self.rule, builder_maker.EXPORT_LIBPATH,
+                           self.export_libpath)
+        if self.hdrs:
+            bmreg.set_attr(self.rule, builder_maker.HDRS, self.hdrs)
+        if self.pch is not None:
+            bmreg.set_attr(self.rule, builder_maker.PCH, self.pch)
+        if self.archive is not None:
+            bmreg.set_attr(self.rule, builder_maker.ARCHIVE, self.archive)
+        if self.pool is not None:
+            bmreg.set_attr(self.rule, builder_maker.POOL, self.pool)
+        if self.test_options is not None:
+            bmreg.set_attr(self.rule, builder_maker.TEST, self.test_options)
+        if self.command is not None:
+            bmreg.set_attr(self.rule, builder_maker.COMMAND, self.command)
@@ -19,6 +19,14 @@ class BuilderMakerRegistry:
     def __init__(self):
         self.rules = RuleRegistry()
         self.label_attrs = LabelAttributes()
+        self.pchs = {}
+        self.envs = {}
+        self.search_paths = {}
+        self.interned_paths = {}
+        self.executor = None
+        self.event_writer = None
+        self.spawns = {}  # id(env) -> (env, SPAWN, its recorder)
+        self.shared_variants = set()  # Variants linking shared libraries
 
     def add_rule(self, rule):
         assert isinstance(rule, Rule)
@@ -27,6 +35,29 @@ class BuilderMakerRegistry:
             raise RuntimeError('duplicated rule: %s' % rule.name)
         self.rules.add_rule(rule)
 
+    def remove_package(self, package_name):
+        '''Remove rules (and their attributes) of the package.
+
+        Return the removed rules and a dict of their attributes, which
+        restore_package() takes.
+        '''
+        rules = self.rules.remove_package(package_name)
+        attrs = {}
+        for rule in rules:
+            attrs[rule.name] = self.label_attrs.remove_attrs(rule.name)
+        # Search paths of dependents may change, too
+        self.search_paths.clear()
+        return rules, attrs
+
+    def restore_package(self, package_name, rules, attrs):
+        '''Replace rules of the package with rules removed before.'''
+        self.remove_package(package_name)
+        for rule in rules:
+            self.add_rule(rule)
+        for label, label_attrs in attrs.items():
+            for key, value in label_attrs.items():
+                self.label_attrs.set_attr(label, key, value)
+
     def get_attr(self, label, key):
         assert isinstance(label, (Label, Rule))
         if isinstance(label, Rule):
@@ -39,6 +70,31 @@ class BuilderMakerRegistry:
             label = label.name
         self.label_attrs.set_attr(label, key, value)
 
+    def get_pch(self, key):
+        return self.pchs[key]
+
+    def set_pch(self, key, pch):
+        if key in self.pchs:
+            raise KeyError('overwrite precompiled header: %s' % (key,))
+        self.pchs[key] = pch
+
+    def get_env(self, key):
+        return self.envs[key]
+
+    def set_env(self, key, env):
+        if key in self.envs:
+            raise KeyError('overwrite environment: %s' % (key,))
+        self.envs[key] = env
+
+    def get_search_paths(self, label, key):
+        return self.search_paths[label, key]
+
+    def set_search_paths(self, label, key, paths):
+        '''Memoize paths of label and return the interned paths.'''
+        paths = self.interned_paths.setdefault(paths, paths)
+        self.search_paths[label, key] = paths
+        return paths
+
 
 class LabelAttributes:
 
@@ -54,3 +110,7 @@ class LabelAttributes:
         assert isinstance(label, Label)
         assert isinstance(key, str)
         self.attributes[label][key] = value
+
+    def remove_attrs(self, label):
+        assert isinstance(label, Label)
+        return self.attributes.pop(label, {})
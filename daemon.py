@@ -0,0 +1,446 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''A long-lived build daemon keeping the build graph warm.
+
+The daemon runs "scons --interactive", which evaluates SConscripts once and
+then keeps the registries, the sorted rules, and SCons's node and
+signature state in memory between builds.  Build requests from a thin
+client are forwarded to it, so a build starts without Python startup,
+SConscript evaluation, or a full dependency scan.  Since the interactive
+prompt also runs shell commands, requests are served only with an authkey
+or on a Unix domain socket in a directory private to the user, and their
+targets may not contain control characters.
+
+The source tree is watched through inotify (or by polling mtimes where
+inotify is unavailable).  Changes made by builds are ignored: signature
+databases, .scons_package, build roots and targets, which SCons lists in
+a manifest after making builders.  A changed SConscript (of a name that
+SCons read) restarts SCons so that the graph is evaluated again, since
+builders of a running SCons cannot be replaced (reload_package updates
+the rule graph only); changed sources optionally trigger a build.
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+try:
+    from scons_package.remote_exec import check_listen_address
+except ImportError:
+    # Imported as a top-level module by tools/scons_package_daemon
+    from remote_exec import check_listen_address
+
+
+# Directories never watched
+SKIP_DIRS = frozenset(('.git', '.hg', '.svn', '.scons_package'))
+
+SCONSCRIPT_NAMES = frozenset(('SConstruct', 'Sconstruct', 'sconstruct',
+                              'SConscript'))
+
+PROMPT = b'scons>>> '
+
+ERROR_MARKERS = ('scons: *** ', 'scons: building terminated because of errors')
+
+# Environment variable of the path of the manifest written by SCons
+MANIFEST_ENV = 'SCONS_PACKAGE_DAEMON_MANIFEST'
+
+MANIFEST_PATH = '.scons_package/daemon.json'
+
+
+def is_sconscript(path, names=SCONSCRIPT_NAMES):
+    return os.path.basename(path) in names
+
+
+def is_sconsign(path):
+    return os.path.basename(path).startswith('.sconsign')
+
+
+def get_targets(top):
+    '''Return absolute paths of files with builders below a Dir node.'''
+    from SCons.Node.FS import Dir
+    targets = []
+    dirs = [top]
+    while dirs:
+        directory = dirs.pop()
+        for name, node in directory.entries.items():
+            if name in ('.', '..'):
+                continue
+            if isinstance(node, Dir):
+                dirs.append(node)
+            elif node.has_builder():
+                targets.append(node.get_abspath())
+    return sorted(targets)
+
+
+def write_manifest(path, build_roots=()):
+    '''Write SConscripts read, build roots, and targets of SCons to path.'''
+    import SCons.Node
+    from SCons.Script import Dir
+    manifest = {
+        'sconscripts': sorted(node.srcnode().get_abspath()
+                              for node in SCons.Node.SConscriptNodes),
+        'build_roots': sorted(Dir(root).get_abspath()
+                              for root in build_roots),
+        'targets': get_targets(Dir('#')),
+    }
+    with open(path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def _walk_dirs(root, skip_dirs):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [dirname for dirname in dirnames
+                       if dirname not in skip_dirs and
+                       os.path.join(dirpath, dirname) not in skip_dirs]
+        yield dirpath, filenames
+
+
+class PollingWatcher(object):
+    '''Watch a tree by comparing file mtimes.'''
+
+    def __init__(self, root, skip_dirs=SKIP_DIRS, interval=1.0):
+        self.root = root
+        self.skip_dirs = frozenset(skip_dirs)
+        self.interval = interval
+        self.mtimes = self._scan()
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        mtimes = {}
+        for dirpath, filenames in _walk_dirs(self.root, self.skip_dirs):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    mtimes[path] = os.stat(path).st_mtime
+                except OSError:
+                    pass
+        return mtimes
+
+    def poll(self):
+        '''Return paths changed since the last poll.'''
+        mtimes = self._scan()
+        changed = set(path for path, mtime in mtimes.items()
+                      if self.mtimes.get(path) != mtime)
+        changed.update(set(self.mtimes) - set(mtimes))
+        self.mtimes = mtimes
+        return changed
+
+    def wait(self, timeout=None):
+        '''Return changed paths, waiting up to timeout seconds for them.'''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            changed = self.poll()
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return changed
+            time.sleep(self.interval)
+
+
+class InotifyWatcher(object):
+    '''Watch a tree through Linux inotify.'''
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_ISDIR = 0x40000000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, root, skip_dirs=SKIP_DIRS):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init'):
+            raise OSError(errno.ENOSYS, 'inotify not supported')
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.skip_dirs = frozenset(skip_dirs)
+        self.dirs = {}  # Watch descriptor -> directory
+        for dirpath, _ in _walk_dirs(root, self.skip_dirs):
+            self._add_watch(dirpath)
+
+    def close(self):
+        os.close(self.fd)
+
+    def _add_watch(self, dirpath):
+        wd = self.libc.inotify_add_watch(self.fd, dirpath.encode('utf-8'),
+                                         self.MASK)
+        if wd >= 0:
+            self.dirs[wd] = dirpath
+
+    def wait(self, timeout=None):
+        '''Return changed paths, waiting up to timeout seconds for them.'''
+        changed = set()
+        created = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        while readable:
+            for path, mask in self._read_events():
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    created.add(path)
+                elif (mask & (self.IN_DELETE | self.IN_MOVED_FROM) and
+                      path in created):
+                    # A temporary file (e.g., of ar or an editor)
+                    created.discard(path)
+                    changed.discard(path)
+                    continue
+                changed.add(path)
+            # Coalesce a burst of events (e.g., an editor saving a file)
+            readable, _, _ = select.select([self.fd], [], [], 0.05)
+        return changed
+
+    def _read_events(self):
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            dirpath = self.dirs.get(wd)
+            if dirpath is None:
+                continue
+            path = os.path.join(dirpath, name.decode('utf-8', 'replace'))
+            if mask & self.IN_ISDIR:
+                if (mask & (self.IN_CREATE | self.IN_MOVED_TO) and
+                        os.path.basename(path) not in self.skip_dirs and
+                        path not in self.skip_dirs):
+                    for subdir, _ in _walk_dirs(path, self.skip_dirs):
+                        self._add_watch(subdir)
+                continue
+            yield path, mask
+
+
+def make_watcher(root, skip_dirs=SKIP_DIRS):
+    '''Return an inotify watcher, or a polling watcher if unsupported.'''
+    try:
+        return InotifyWatcher(root, skip_dirs)
+    except (OSError, AttributeError):
+        return PollingWatcher(root, skip_dirs)
+
+
+def check_target(target):
+    '''Raise ValueError if target is empty or has control characters.'''
+    if (not isinstance(target, str) or not target or
+            any(ord(char) < 0x20 or ord(char) == 0x7f for char in target)):
+        raise ValueError('invalid target: %r' % (target,))
+
+
+def is_build_failed(output):
+    return any(marker in output for marker in ERROR_MARKERS)
+
+
+class BuildDaemon(object):
+    '''Serve build requests from a warm "scons --interactive" process.'''
+
+    def __init__(self, root, scons_args=(), skip_dirs=SKIP_DIRS,
+                 eager=False, scons='scons'):
+        self.root = os.path.realpath(root)
+        self.scons_args = list(scons_args)
+        self.skip_dirs = frozenset(os.path.join(self.root, path)
+                                   if os.sep in path else path
+                                   for path in skip_dirs)
+        self.eager = eager
+        self.scons = scons
+        self.lock = threading.Lock()
+        self.proc = None
+        self.manifest_path = os.path.join(self.root, MANIFEST_PATH)
+        self.set_manifest({})
+
+    def start(self):
+        with self.lock:
+            self._start_scons()
+
+    def stop(self):
+        with self.lock:
+            self._stop_scons()
+
+    def _start_scons(self):
+        dirname = os.path.dirname(self.manifest_path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        environ = dict(os.environ)
+        environ[MANIFEST_ENV] = self.manifest_path
+        self.proc = subprocess.Popen(
+            [self.scons, '--interactive'] + self.scons_args,
+            cwd=self.root,
+            env=environ,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        output = self._read_until_prompt()
+        try:
+            with open(self.manifest_path) as manifest_file:
+                self.set_manifest(json.load(manifest_file))
+        except (IOError, OSError, ValueError):
+            self.set_manifest({})  # Builders were not made
+        return output
+
+    def set_manifest(self, manifest):
+        self.sconscripts = frozenset(manifest.get('sconscripts', ()))
+        self.sconscript_names = SCONSCRIPT_NAMES.union(
+            os.path.basename(path) for path in self.sconscripts)
+        self.build_roots = tuple(manifest.get('build_roots', ()))
+        self.targets = frozenset(manifest.get('targets', ()))
+
+    def is_ignored(self, path):
+        '''Return True if path is written by SCons rather than edited.'''
+        if is_sconsign(path) or path in self.targets:
+            return True
+        return any(path.startswith(root + os.sep)
+                   for root in self.build_roots)
+
+    def is_sconscript(self, path):
+        return (path in self.sconscripts or
+                is_sconscript(path, self.sconscript_names))
+
+    def _stop_scons(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.write(b'exit\n')
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.proc.wait()
+        self.proc.stdout.close()
+        self.proc = None
+
+    def _read_until_prompt(self):
+        fd = self.proc.stdout.fileno()
+        output = []
+        tail = b''
+        while not tail.endswith(PROMPT):
+            chunk = os.read(fd, 64 * 1024)
+            if not chunk:
+                raise RuntimeError('scons exited: %s' %
+                                   b''.join(output).decode('utf-8', 'replace'))
+            output.append(chunk)
+            tail = (tail + chunk)[-len(PROMPT):]
+        output = b''.join(output)[:-len(PROMPT)]
+        return output.decode('utf-8', 'replace')
+
+    def build(self, targets=()):
+        '''Build targets (default targets if empty); return (ok, output).
+
+        Targets are checked, since they are written to the command line of
+        "scons --interactive", which also runs shell commands.
+        '''
+        for target in targets:
+            check_target(target)
+        command = ' '.join(['build'] + list(targets)) + '\n'
+        with self.lock:
+            if self.proc is None:
+                output = self._start_scons()
+                if is_build_failed(output):
+                    self.proc = None
+                    return False, output
+            self.proc.stdin.write(command.encode('utf-8'))
+            self.proc.stdin.flush()
+            output = self._read_until_prompt()
+        return not is_build_failed(output), output
+
+    def on_change(self, paths):
+        '''Restart SCons if a SConscript changed; build if eager.'''
+        paths = [path for path in paths if not self.is_ignored(path)]
+        if not paths:
+            return
+        if any(self.is_sconscript(path) for path in paths):
+            with self.lock:
+                self._stop_scons()
+                try:
+                    self._start_scons()
+                except RuntimeError as exc:
+                    sys.stderr.write('%s\n' % exc)
+                    self.proc = None
+        if self.eager:
+            _, output = self.build()
+            sys.stdout.write(output)
+
+    def watch_forever(self, watcher):
+        while True:
+            paths = watcher.wait()
+            if paths:
+                self.on_change(paths)
+
+    def serve_forever(self, address, authkey=None):
+        check_listen_address(address, authkey)
+        listener = Listener(address, authkey=authkey)
+        try:
+            while True:
+                conn = listener.accept()
+                thread = threading.Thread(target=self._serve_connection,
+                                          args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+
+    def _serve_connection(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    break
+                try:
+                    conn.send(self.build(request.get('targets', ())))
+                except (RuntimeError, ValueError) as exc:
+                    conn.send((False, '%s\n' % exc))
+        finally:
+            conn.close()
+
+
+def run_daemon(root, address, authkey=None, scons_args=(),
+               skip_dirs=SKIP_DIRS, eager=False):
+    '''Start the daemon, serving requests and watching root.
+
+    Without an authkey, address must be a Unix domain socket in a
+    directory private to the user (see check_listen_address).
+    '''
+    check_listen_address(address, authkey)
+    daemon = BuildDaemon(root, scons_args, skip_dirs, eager)
+    daemon.start()
+    thread = threading.Thread(target=daemon.serve_forever,
+                              args=(address, authkey))
+    thread.daemon = True
+    thread.start()
+    watcher = make_watcher(daemon.root,
+                           daemon.skip_dirs.union(daemon.build_roots))
+    try:
+        daemon.watch_forever(watcher)
+    finally:
+        watcher.close()
+        daemon.stop()
+
+
+def request_build(address, targets=(), authkey=None):
+    '''Ask the daemon to build targets; return (ok, output).'''
+    conn = Client(address, authkey=authkey)
+    try:
+        conn.send({'targets': list(targets)})
+        return conn.recv()
+    finally:
+        conn.close()
@@ -0,0 +1,144 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Discover packages by scanning the source tree for build files.
+
+Directories are listed concurrently, level by level, on a thread pool.
+Listings are cached by directory mtime, which changes whenever an entry
+is added or removed, so a warm scan only stats directories.  Packages are
+returned sorted by path so that they are loaded in deterministic order.
+'''
+
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+
+# Directories never scanned
+SKIP_DIRS = frozenset(('.git', '.hg', '.svn', '.scons_package'))
+
+CACHE_VERSION = 1
+
+
+class DirectoryListing(object):
+
+    def __init__(self, mtime, subdirs, has_build_file):
+        self.mtime = mtime
+        self.subdirs = subdirs
+        self.has_build_file = has_build_file
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(*value)
+
+    def to_json(self):
+        return [self.mtime, self.subdirs, self.has_build_file]
+
+
+class PackageDiscovery(object):
+
+    def __init__(self, root, build_file, skip_dirs=(), jobs=None):
+        self.root = root
+        self.build_file = build_file
+        # Either directory names (skipped anywhere) or paths from root
+        self.skip_dirs = SKIP_DIRS.union(os.path.normpath(path)
+                                         for path in skip_dirs)
+        self.jobs = jobs
+        self.listings = {}  # Path relative to root -> DirectoryListing
+
+    def load_cache(self, cache_path):
+        try:
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return
+        if (cache.get('version') != CACHE_VERSION or
+                cache.get('build_file') != self.build_file or
+                cache.get('skip_dirs') != sorted(self.skip_dirs)):
+            return
+        self.listings = dict((path, DirectoryListing.from_json(value))
+                             for path, value in cache['dirs'].items())
+
+    def save_cache(self, cache_path):
+        dirname = os.path.dirname(cache_path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        cache = {
+            'version': CACHE_VERSION,
+            'build_file': self.build_file,
+            'skip_dirs': sorted(self.skip_dirs),
+            'dirs': dict((path, listing.to_json())
+                         for path, listing in self.listings.items()),
+        }
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.rename(tmp_path, cache_path)
+
+    def discover(self):
+        '''Return sorted paths (relative to root) of packages.'''
+        old_listings = self.listings
+        self.listings = {}
+        packages = []
+        pool = ThreadPool(self.jobs)
+        try:
+            frontier = [os.curdir]
+            while frontier:
+                listings = pool.map(
+                    lambda path: self._list(path, old_listings.get(path)),
+                    frontier)
+                next_frontier = []
+                for path, listing in zip(frontier, listings):
+                    if listing is None:
+                        continue
+                    self.listings[path] = listing
+                    if listing.has_build_file:
+                        packages.append(path)
+                    next_frontier.extend(
+                        os.path.normpath(os.path.join(path, subdir))
+                        for subdir in listing.subdirs)
+                frontier = next_frontier
+        finally:
+            pool.close()
+            pool.join()
+        return sorted(packages)
+
+    def _list(self, path, listing):
+        full_path = os.path.join(self.root, path)
+        try:
+            mtime = os.stat(full_path).st_mtime
+        except OSError:
+            return None
+        if listing is not None and listing.mtime == mtime:
+            return listing
+        subdirs = []
+        has_build_file = False
+        try:
+            names = os.listdir(full_path)
+        except OSError:
+            return None
+        for name in sorted(names):
+            if name == self.build_file:
+                has_build_file = True
+                continue
+            if name in self.skip_dirs:
+                continue
+            subdir = os.path.normpath(os.path.join(path, name))
+            if subdir in self.skip_dirs:
+                continue
+            child = os.path.join(full_path, name)
+            # Do not follow symbolic links, which may form cycles
+            if os.path.isdir(child) and not os.path.islink(child):
+                subdirs.append(name)
+        return DirectoryListing(mtime, subdirs, has_build_file)
+
+
+def discover_packages(root=os.curdir, build_file='SConscript', skip_dirs=(),
+                      cache_path=None, jobs=None):
+    '''Return sorted paths of directories (under root) with a build file.'''
+    discovery = PackageDiscovery(root, build_file, skip_dirs, jobs)
+    if cache_path is not None:
+        discovery.load_cache(cache_path)
+    packages = discovery.discover()
+    if cache_path is not None:
+        discovery.save_cache(cache_path)
+    return packages
@@ -4,13 +4,12 @@ from collections import defaultdict
 import os
 import sys
 
-from SCons.Script import SConscript
-
 from scons_package import builder_maker
 from scons_package.builder_maker_registry import BuilderMakerRegistry
 from scons_package.package_registry import PackageEnvironmentRegistry
 from scons_package.package_registry import PackageVariantRegistry
-from scons_package.utils import topology_sort
+from scons_package.resource_pool import ResourcePoolRegistry
+from scons_package.utils import IncrementalTopologicalOrder, topology_sort
 
 
 def exec_builder_makers(build_order,
@@ -25,6 +24,8 @@ def exec_builder_makers(build_order,
         exec_variant_builder_makers(build_order, None)
         return
 
+    from SCons.Script import SConscript
+
     if build_root is None:
         build_order.sort_by(variants=None)
         SConscript(sconscript, exports={'variant': None})
@@ -44,8 +45,10 @@ def exec_builder_makers(build_order,
 
 
 def exec_variant_builder_makers(build_order, variant):
+    build_order.made_builders = True
     for rule in build_order.get_rules(variant):
-        builder_maker.builder_maker(rule, build_order.bmreg, build_order.pereg)
+        builder_maker.builder_maker(rule, build_order.bmreg, build_order.pereg,
+                                    variant, build_order.rpreg)
 
 
 class BuilderMakerOrder:
@@ -57,34 +60,125 @@ class BuilderMakerOrder:
         if cls.Instance is None:
             cls.Instance = cls(BuilderMakerRegistry.get_instance(),
                                PackageVariantRegistry.get_instance(),
-                               PackageEnvironmentRegistry.get_instance())
+                               PackageEnvironmentRegistry.get_instance(),
+                               ResourcePoolRegistry.get_instance())
         return cls.Instance
 
-    def __init__(self, bmreg, pvreg, pereg):
+    def __init__(self, bmreg, pvreg, pereg, rpreg=None):
         assert isinstance(bmreg, BuilderMakerRegistry)
         assert isinstance(pvreg, PackageVariantRegistry)
         assert isinstance(pereg, PackageEnvironmentRegistry)
+        assert rpreg is None or isinstance(rpreg, ResourcePoolRegistry)
         self.bmreg = bmreg
         self.pvreg = pvreg
         self.pereg = pereg
+        self.rpreg = rpreg
+        self.variants = None
+        self.order = None
         self.sorted_variants = None
         self.variant_rules = None
+        self.made_builders = False
 
     def sort_by(self, variants):
+        rules = self.bmreg.rules
+        self._check_depends(rules, rules.get_missing_dependencies())
+        self.variants = variants
+        self._sort()
+        self._partition()
+
+    def _sort(self):
+        rules = self.bmreg.rules
+        self.order = IncrementalTopologicalOrder()
+        for rule in rules.get_sorted_rules():
+            self.order.add_node(rule.name)
+            self.order.set_neighbors(rule.name, rules.get_depends(rule))
+
+    def update_package(self, package_name, evaluate):
+        '''Re-evaluate a package and update the sorted rules.
+
+        Rules and package registry entries of the package are replaced by
+        those declared by evaluate(), and the topological order is updated
+        only in the region between the changed rules and their neighbors.
+        If evaluate() fails, or the new rules have missing dependencies or
+        cycles, the old rules and entries are restored (and the error is
+        raised).  Builders made already are not updated.
+        '''
+        assert self.order is not None
+        if self.made_builders:
+            raise RuntimeError('update package after making builders: %s' %
+                               package_name)
+        bmreg = self.bmreg
+        old_rules, old_attrs = bmreg.remove_package(package_name)
+        old_variants = self.pvreg.remove_owner(package_name)
+        old_envs = self.pereg.remove_owner(package_name)
+        updating_order = False
+        try:
+            evaluate()
+            new_rules = bmreg.rules.get_package_rules(package_name)
+            self._check_update(package_name, old_rules, new_rules)
+            updating_order = True
+            self._update_order(old_rules, new_rules)
+            self._partition()
+        except Exception:
+            bmreg.restore_package(package_name, old_rules, old_attrs)
+            self.pvreg.restore_owner(package_name, old_variants)
+            self.pereg.restore_owner(package_name, old_envs)
+            if updating_order:
+                # The order may be partially updated; sort the old rules
+                self._sort()
+                self._partition()
+            raise
+
+    def _check_update(self, package_name, old_rules, new_rules):
+        '''Check depends of new rules and dependents of removed rules.
+
+        This runs before updating the order, which still has the removed
+        rules.
+        '''
+        rules = self.bmreg.rules
+        new_labels = set(rule.name for rule in new_rules)
+        missing = []
+        for rule in new_rules:
+            for depend in rule.depends:
+                if depend not in rules:
+                    missing.append((rule.name, depend))
+        for rule in old_rules:
+            if rule.name in new_labels:
+                continue
+            for label in self.order.reverse_neighbors[rule.name]:
+                if label.package_name != package_name:
+                    missing.append((label, rule.name))
+        self._check_depends(rules, missing)
+
+    def _update_order(self, old_rules, new_rules):
+        rules = self.bmreg.rules
+        order = self.order
+        new_labels = set(rule.name for rule in new_rules)
+        for rule in old_rules:
+            if rule.name not in new_labels:
+                order.remove_node(rule.name)
+        for rule in new_rules:
+            order.add_node(rule.name)
+        for rule in new_rules:
+            order.set_neighbors(rule.name, rules.get_depends(rule))
+
+    def _partition(self):
+        '''Partition sorted rules by variant.'''
         bmreg = self.bmreg
         pvreg = self.pvreg
         rules = bmreg.rules
-        self._check_depends(rules)
+        variants = self.variants
+        sorted_rules = [rules[label] for label in self.order]
 
         if variants is None:
             self.sorted_variants = None
-            self.variant_rules = {None: rules.get_sorted_rules()}
+            self.variant_rules = {None: sorted_rules}
             return
 
         graph = defaultdict(set)
         for label_from in rules:
             variant_from = self._get_variant(bmreg, pvreg, label_from)
-            for label_to in rules[label_from].depends:
+            for label_to in rules.get_depends(rules[label_from]):
                 variant_to = self._get_variant(bmreg, pvreg, label_to)
                 if variant_from != variant_to:
                     graph[variant_from].add(variant_to)
@@ -94,11 +188,23 @@ class BuilderMakerOrder:
         self.sorted_variants = topology_sort(variants, get_neighbors)
 
         self.variant_rules = defaultdict(list)
-        for rule in rules.get_sorted_rules():
+        for rule in sorted_rules:
             variant = self._get_variant(bmreg, pvreg, rule.name)
             self.variant_rules[variant].append(rule)
         assert len(variants) == len(self.variant_rules)
 
+    def get_sorted_rules(self):
+        '''Return rules of all variants sorted topologically.'''
+        assert self.order is not None
+        rules = self.bmreg.rules
+        return [rules[label] for label in self.order]
+
+    def get_variant(self, label):
+        '''Return variant of the rule, or None if not sorted by variants.'''
+        if self.variants is None:
+            return None
+        return self._get_variant(self.bmreg, self.pvreg, label)
+
     def get_sorted_variants(self):
         assert self.sorted_variants is not None
         return self.sorted_variants
@@ -108,9 +214,9 @@ class BuilderMakerOrder:
         return self.variant_rules[variant]
 
     @staticmethod
-    def _check_depends(rules):
+    def _check_depends(rules, missing_dependencies):
         okay = True
-        for name, depend in rules.get_missing_dependencies():
+        for name, depend in missing_dependencies:
             sys.stderr.write('%s depends on non-existing %s\n' %
                              (name, depend))
             sys.stderr.write('Targets in package %s:\n' % depend.package_name)
@@ -0,0 +1,82 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Content-addressed execution of genrule commands.
+
+The outputs of a genrule command are cached by a digest of the command
+line, the contents of its inputs, and the contents of the tool binary it
+runs.  Paths in the digest are source paths rather than variant paths, so
+that a result is reused across variants as well as after a clean build;
+outputs are kept in the content store of remote_exec.
+
+This module does not depend on SCons.
+'''
+
+import json
+import os
+import shlex
+import subprocess
+
+from scons_package.remote_exec import ActionCache, ContentStore
+from scons_package.remote_exec import digest_bytes, digest_file
+from scons_package.remote_exec import find_executable
+
+
+def get_tool(command, path):
+    '''Return path of the binary that the shell command runs, or None.'''
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    if not args:
+        return None
+    return find_executable(args[0], path)
+
+
+class GenruleCache(object):
+    '''Outputs of genrule commands keyed by the digest of the command.'''
+
+    def __init__(self, root):
+        self.store = ContentStore(os.path.join(root, 'cas'))
+        self.cache = ActionCache(os.path.join(root, 'ac'))
+
+    @staticmethod
+    def get_digest(key_command, inputs, outputs):
+        '''Digest of a command; inputs and outputs are (key, path) pairs.'''
+        key = {'command': key_command,
+               'inputs': [(key_path, digest_file(path))
+                          for key_path, path in inputs],
+               'outputs': [key_path for key_path, _ in outputs]}
+        return digest_bytes(json.dumps(key, sort_keys=True).encode('utf-8'))
+
+    def run(self, command, key_command, inputs, outputs, environ=None,
+            call=subprocess.call):
+        '''Run the shell command unless its outputs are cached.
+
+        The command is run by call(argv, env), such as subprocess.call.
+        Return (exit code, whether the outputs were restored from cache).
+        '''
+        digest = self.get_digest(key_command, inputs, outputs)
+        try:
+            result = self.cache.get(digest)
+        except KeyError:
+            pass
+        else:
+            if self._materialize(result, outputs):
+                return 0, True
+        exit_code = call(['/bin/sh', '-c', command], env=environ)
+        if exit_code == 0:
+            result = {'outputs': dict((key_path, self.store.put(path))
+                                      for key_path, path in outputs)}
+            self.cache.put(digest, result)
+        return exit_code, False
+
+    def _materialize(self, result, outputs):
+        digests = result['outputs']
+        if any(key_path not in digests for key_path, _ in outputs):
+            return False
+        try:
+            for key_path, path in outputs:
+                self.store.get(digests[key_path], path)
+        except KeyError:
+            return False
+        return True
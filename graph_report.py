@@ -0,0 +1,146 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Report the shape of the rule graph.
+
+For each rule, the report lists its depth (the longest chain of depends
+below it), fan-in (direct dependents), fan-out (direct depends), the
+number of transitive dependents (the rules rebuilt when it changes), and
+whether it lies on a critical chain (a longest chain of the graph).
+
+Rules are visited once in topological order and once in reverse; the
+transitive dependents of a rule are a bitset (a Python integer of up to V
+bits) made by the union of its direct dependents' bitsets.  This takes
+O(E) unions of O(V/w) words each, O(V * E / w) time for V rules, E edges
+and w-bit words, instead of a graph search per rule.  The bitset of a
+rule is dropped once its last depend has been visited, so only bitsets
+of rules with unvisited depends are kept; that is O(V^2 / w) words in
+the worst case, but far fewer when depends are near in the order.
+'''
+
+import json
+
+
+class RuleStats(object):
+
+    def __init__(self, label, variant):
+        self.label = label
+        self.variant = variant
+        self.depth = 0
+        self.height = 0  # Longest chain of dependents above the rule
+        self.fan_in = 0
+        self.fan_out = 0
+        self.dependents = 0
+        self.critical = False
+
+    def to_json(self):
+        return {'label': str(self.label),
+                'variant': self.variant,
+                'depth': self.depth,
+                'fan_in': self.fan_in,
+                'fan_out': self.fan_out,
+                'dependents': self.dependents,
+                'critical': self.critical}
+
+
+class GraphReport(object):
+
+    def __init__(self, stats, critical_chain):
+        self.stats = stats  # In topological order
+        self.critical_chain = critical_chain
+
+    def get_ranked_stats(self):
+        '''Return stats ranked by transitive dependents, then fan-in.'''
+        return sorted(self.stats,
+                      key=lambda stat: (-stat.dependents, -stat.fan_in,
+                                        str(stat.label)))
+
+    def to_json(self):
+        return {'rules': [stat.to_json() for stat in self.stats],
+                'critical_chain': [str(label)
+                                   for label in self.critical_chain]}
+
+    def write_json(self, output):
+        json.dump(self.to_json(), output, indent=2, sort_keys=True)
+        output.write('\n')
+
+    def write_summary(self, output, top=20):
+        output.write('%d rules, %d edges, critical chain of %d rules\n' %
+                     (len(self.stats),
+                      sum(stat.fan_out for stat in self.stats),
+                      len(self.critical_chain)))
+        output.write('\n%10s %6s %6s %7s %8s  %s\n' %
+                     ('dependents', 'depth', 'fan-in', 'fan-out', 'critical',
+                      'rule'))
+        for stat in self.get_ranked_stats()[:top]:
+            output.write('%10d %6d %6d %7d %8s  %s\n' %
+                         (stat.dependents, stat.depth, stat.fan_in,
+                          stat.fan_out, '*' if stat.critical else '',
+                          stat.label))
+        output.write('\nCritical chain:\n')
+        for label in self.critical_chain:
+            output.write('    %s\n' % label)
+
+
+def make_report(sorted_rules, get_variant=lambda label: None,
+                get_depends=lambda rule: rule.depends):
+    '''Make the report of rules sorted topologically (depends first).'''
+    stats = [RuleStats(rule.name, get_variant(rule.name))
+             for rule in sorted_rules]
+    index = dict((stat.label, i) for i, stat in enumerate(stats))
+    depends = [[index[label] for label in get_depends(rule)]
+               for rule in sorted_rules]
+    dependents = [[] for _ in stats]
+    for i, depend_indices in enumerate(depends):
+        for j in depend_indices:
+            dependents[j].append(i)
+    # Depth and fan-out, depends first
+    for i, stat in enumerate(stats):
+        stat.fan_out = len(depends[i])
+        for j in depends[i]:
+            stat.depth = max(stat.depth, stats[j].depth + 1)
+    # Height and transitive dependents, dependents first; the bitset of a
+    # rule is last used by its first depend in the order
+    last_users = [min(depend_indices) if depend_indices else None
+                  for depend_indices in depends]
+    reachable = {}
+    for i in range(len(stats) - 1, -1, -1):
+        stat = stats[i]
+        stat.fan_in = len(dependents[i])
+        bits = 0
+        for j in dependents[i]:
+            stat.height = max(stat.height, stats[j].height + 1)
+            bits |= reachable[j] | (1 << j)
+        for j in dependents[i]:
+            if last_users[j] == i:
+                reachable.pop(j, None)
+        if last_users[i] is not None:
+            reachable[i] = bits
+        stat.dependents = _count_bits(bits)
+    # Critical chains
+    length = max([stat.depth + stat.height for stat in stats] or [-1])
+    for stat in stats:
+        stat.critical = stat.depth + stat.height == length
+    return GraphReport(stats, _get_critical_chain(stats, depends, length))
+
+
+def _count_bits(bits):
+    return bin(bits).count('1')
+
+
+def _get_critical_chain(stats, depends, length):
+    '''Return labels of a critical chain, from the top down.'''
+    chain = []
+    current = None
+    for i, stat in enumerate(stats):
+        if stat.height == 0 and stat.depth == length:
+            current = i
+            break
+    while current is not None:
+        chain.append(stats[current].label)
+        next_index = None
+        for j in depends[current]:
+            if stats[j].depth == stats[current].depth - 1:
+                next_index = j
+                break
+        current = next_index
+    return chain
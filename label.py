@@ -3,8 +3,6 @@
 import os
 import re
 
-from SCons.Script import Dir
-
 
 class Label(object):
 
@@ -93,7 +91,9 @@ class PackageName(object):
     def make_package_name(cls, package_str=None):
         assert package_str is None or isinstance(package_str, str)
         if not package_str:
-            package_str = Dir('.').srcnode().path
+            # The package of the SConscript being read ('.' at the top)
+            from SCons.Script import Dir
+            package_str = Dir('.').srcnode().get_path(Dir('#'))
         return cls(package_str)
 
     def __init__(self, package_name):
@@ -0,0 +1,372 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Generate a Ninja build file from the declared rules.
+
+Instead of creating SCons builders, the backend walks the sorted rules of
+each variant and writes compile and link commands substituted from the
+rule's environment, including the effects of export_env.  Objects track
+headers through compiler depfiles, and the build file regenerates itself
+when a SConscript changes.  Test executions are not generated, and
+genrule commands are run without the genrule cache.
+'''
+
+import os
+
+from scons_package import builder_maker
+
+
+NINJA_RULES = (
+    ('cc', (
+        ('command', '$tool -MMD -MF $out.d -o $out -c $flags $in'),
+        ('depfile', '$out.d'),
+        ('deps', 'gcc'),
+        ('description', 'CC $out'),
+    )),
+    ('cxx', (
+        ('command', '$tool -MMD -MF $out.d -o $out -c $flags $in'),
+        ('depfile', '$out.d'),
+        ('deps', 'gcc'),
+        ('description', 'CXX $out'),
+    )),
+    ('pch', (
+        ('command', '$tool -MMD -MF $out.d -o $out -x ${language}-header -c '
+                    '$flags $in'),
+        ('depfile', '$out.d'),
+        ('deps', 'gcc'),
+        ('description', 'PCH $out'),
+    )),
+    ('ar', (
+        ('command', 'rm -f $out && $tool $arflags $out $in && $ranlib $out'),
+        ('description', 'AR $out'),
+    )),
+    ('ar_incremental', (
+        ('command', '$tool $arflags $out $in && $ranlib $out'),
+        ('description', 'AR $out'),
+    )),
+    ('link', (
+        ('command', '$tool -o $out $linkflags $in $libs'),
+        ('description', 'LINK $out'),
+    )),
+    ('genrule', (
+        ('command', '$command'),
+        ('description', 'GEN $out'),
+    )),
+    ('regen', (
+        ('command', '$regen_command'),
+        ('generator', '1'),
+        ('description', 'Regenerating $out'),
+    )),
+)
+
+
+class NinjaWriter(object):
+
+    def __init__(self, output):
+        self.output = output
+
+    @staticmethod
+    def escape(value):
+        return value.replace('$', '$$')
+
+    @staticmethod
+    def escape_path(path):
+        return path.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+    def newline(self):
+        self.output.write('\n')
+
+    def comment(self, text):
+        self.output.write('# %s\n' % text)
+
+    def variable(self, key, value, indent=0):
+        self.output.write('%s%s = %s\n' % ('  ' * indent, key, value))
+
+    def rule(self, name, variables):
+        self.output.write('rule %s\n' % name)
+        for key, value in variables:
+            self.variable(key, value, indent=1)
+        self.newline()
+
+    def build(self, outputs, rule, inputs=(), implicit=(), variables=()):
+        line = ['build']
+        line.extend(self.escape_path(path) for path in outputs)
+        line[-1] += ':'
+        line.append(rule)
+        line.extend(self.escape_path(path) for path in inputs)
+        if implicit:
+            line.append('|')
+            line.extend(self.escape_path(path) for path in implicit)
+        self.output.write(' '.join(line) + '\n')
+        for key, value in variables:
+            self.variable(key, self.escape(value), indent=1)
+
+    def default(self, targets):
+        self.output.write('default %s\n' %
+                          ' '.join(self.escape_path(path) for path in targets))
+
+
+class NinjaGenerator(object):
+
+    def __init__(self, build_order, writer):
+        self.build_order = build_order
+        self.writer = writer
+        self.outputs = {}  # Rule label -> output paths
+        self.headers = {}  # Rule label -> headers generated by depends
+        self.output_types = {}  # Rule label -> builder type of its outputs
+        self.cxx_rules = set()
+        self.pchs = {}
+
+    def generate(self, build_root, regen_command, regen_deps, path):
+        writer = self.writer
+        writer.comment('Generated by scons_package; do not edit.')
+        writer.newline()
+        for name, variables in NINJA_RULES:
+            writer.rule(name, variables)
+        if self.build_order.sorted_variants is None:
+            self.generate_variant(None, build_root or '')
+        else:
+            for variant in self.build_order.get_sorted_variants():
+                self.generate_variant(variant,
+                                      os.path.join(build_root, variant))
+        writer.newline()
+        writer.build([path], 'regen', implicit=regen_deps,
+                     variables=[('regen_command', regen_command)])
+        writer.default(sorted(path for outputs in self.outputs.values()
+                              for path in outputs))
+
+    def generate_variant(self, variant, prefix):
+        self.writer.comment('Variant: %s' % variant)
+        for rule in self.build_order.get_rules(variant):
+            outputs = self.generate_rule(rule, variant, prefix)
+            self.writer.build([str(rule.name)], 'phony', outputs)
+            self.outputs[rule.name] = outputs
+        self.writer.newline()
+
+    def generate_rule(self, rule, variant, prefix):
+        bmreg = self.build_order.bmreg
+        pereg = self.build_order.pereg
+        env = builder_maker.get_env(rule, bmreg, pereg)
+        env = builder_maker.import_search_paths(rule, bmreg, env)
+        env = builder_maker.import_export_env(rule, bmreg, env)
+        builder_type = builder_maker.get_builder_type(rule, bmreg, variant)
+        self.output_types[rule.name] = builder_type
+        if builder_type == builder_maker.GENRULE:
+            return self.generate_genrule(rule, env, prefix)
+        shared = builder_type == builder_maker.SHARED_LIBRARY
+
+        # Sources and headers generated by genrule depends; headers of
+        # indirect depends are included through the direct ones
+        sources = [(self.get_input(label, prefix), label.path)
+                   for label in rule.inputs]
+        headers = set()
+        for dep in rule.depends:
+            if (bmreg.get_attr(dep, builder_maker.BUILDER_TYPE) !=
+                    builder_maker.GENRULE):
+                headers.update(self.headers[dep])
+                continue
+            for path in self.outputs[dep]:
+                if (os.path.splitext(path)[1] in
+                        builder_maker.SOURCE_SUFFIXES):
+                    sources.append((path, None))
+                else:
+                    headers.add(path)
+        headers = sorted(headers)
+        self.headers[rule.name] = headers
+        # Generated headers are found in the build directory of a package
+        cpppath = builder_maker.get_search_paths(
+            rule.name, bmreg, builder_maker.EXPORT_INCLUDES)
+        include_flags = ''.join(' -I' + os.path.join(prefix, path)
+                                for path in cpppath
+                                if prefix and not path.startswith('#'))
+        pch = self.generate_pch(rule, env, variant, prefix, include_flags,
+                                shared)
+        objsuffix = env.subst('$SHOBJSUFFIX' if shared else '$OBJSUFFIX')
+        objects = []
+        for src, path in sources:
+            if path is None:
+                obj = os.path.splitext(src)[0] + objsuffix
+            else:
+                obj = os.path.join(prefix,
+                                   os.path.splitext(path)[0] + objsuffix)
+            objects.append(self.generate_object(env, src, obj, pch, headers,
+                                                include_flags, shared))
+        # Static libraries do not contain their library depends, which are
+        # linked into programs and shared libraries instead
+        source = list(objects)
+        for dep in rule.depends:
+            dep_type = bmreg.get_attr(dep, builder_maker.BUILDER_TYPE)
+            if (dep_type != builder_maker.GENRULE and
+                    dep_type not in builder_maker.LIBRARY_TYPES):
+                source.extend(self.outputs[dep])
+        shared_libraries = []
+        if builder_type != builder_maker.STATIC_LIBRARY:
+            for label in builder_maker.get_link_libraries(rule.name, bmreg):
+                if (self.output_types[label] ==
+                        builder_maker.SHARED_LIBRARY):
+                    shared_libraries.extend(self.outputs[label])
+                else:
+                    source.extend(self.outputs[label])
+
+        is_cxx = (any(os.path.splitext(src)[1] in builder_maker.CXX_SUFFIXES
+                      for src, _ in sources) or
+                  any(dep in self.cxx_rules for dep in rule.depends))
+        if is_cxx:
+            self.cxx_rules.add(rule.name)
+
+        assert len(rule.outputs) == 1
+        dirname, basename = os.path.split(rule.outputs[0].path)
+        if builder_type == builder_maker.STATIC_LIBRARY:
+            target = os.path.join(prefix, dirname, env.subst(
+                '${LIBPREFIX}%s${LIBSUFFIX}' % basename))
+            try:
+                archive = bmreg.get_attr(rule, builder_maker.ARCHIVE)
+            except KeyError:
+                archive = None
+            if archive is None:
+                arflags = env.subst('$ARFLAGS')
+            else:
+                arflags = builder_maker.get_arflags(env, archive)
+            if archive == builder_maker.INCREMENTAL_ARCHIVE:
+                ninja_rule = 'ar_incremental'
+            else:
+                ninja_rule = 'ar'
+            self.writer.build([target], ninja_rule, source, variables=[
+                ('tool', env.subst('$AR')),
+                ('arflags', arflags),
+                ('ranlib', env.subst('$RANLIB')),
+            ])
+        else:
+            if shared:
+                target = os.path.join(prefix, dirname, env.subst(
+                    '${SHLIBPREFIX}%s${SHLIBSUFFIX}' % basename))
+                tool = env.subst('$SHCXX' if is_cxx else '$SHLINK')
+                linkflags = '%s -Wl,-soname=%s' % (
+                    env.subst('$SHLINKFLAGS'), os.path.basename(target))
+            else:
+                assert builder_type == builder_maker.PROGRAM
+                target = os.path.join(prefix, dirname, env.subst(
+                    '${PROGPREFIX}%s${PROGSUFFIX}' % basename))
+                tool = env.subst('$CXX' if is_cxx else '$LINK')
+                linkflags = env.subst('$LINKFLAGS')
+            libs = _subst(env, '$_LIBDIRFLAGS $_LIBFLAGS', target, source)
+            # Without interface signatures, the target is linked again
+            # whenever a shared library changes
+            if shared_libraries:
+                rpath = builder_maker.get_run_paths(env, target,
+                                                    shared_libraries)
+                linkflags += ' ' + _subst(env.Override({'RPATH': rpath}),
+                                          '$_RPATH', target, source)
+                libs = ' '.join([libs] + shared_libraries)
+            linkflags = linkflags.strip()
+            libs = libs.strip()
+            variables = [('tool', tool), ('linkflags', linkflags),
+                         ('libs', libs)]
+            self.writer.build([target], 'link', source, shared_libraries,
+                              variables)
+        return [target]
+
+    def get_input(self, label, prefix):
+        '''Return path of an input, which may be generated by a genrule.'''
+        if label in self.build_order.bmreg.rules.producers:
+            return os.path.join(prefix, label.path)
+        return label.path
+
+    def generate_genrule(self, rule, env, prefix):
+        targets = [os.path.join(prefix, label.path) for label in rule.outputs]
+        sources = [self.get_input(label, prefix) for label in rule.inputs]
+        tools = []
+        for dep in rule.depends:
+            tools.extend(self.outputs[dep])
+        command = self.build_order.bmreg.get_attr(rule, builder_maker.COMMAND)
+        env = env.Override({'TOOLS': [env.File(path) for path in tools]})
+        self.writer.build(targets, 'genrule', sources, tools, variables=[
+            ('command', _subst(env, command, targets, sources)),
+        ])
+        self.headers[rule.name] = []
+        return targets
+
+    def generate_object(self, env, src, obj, pch, headers=(),
+                        include_flags='', shared=False):
+        suffix = os.path.splitext(src)[1]
+        if suffix in builder_maker.CXX_SUFFIXES:
+            ninja_rule = 'cxx'
+            tool, flags = _get_compile_command(env, 'c++', shared)
+        else:
+            ninja_rule = 'cc'
+            tool, flags = _get_compile_command(env, 'c', shared)
+        tool = env.subst(tool)
+        flags = _subst(env, flags, obj, src)
+        flags += include_flags
+        implicit = list(headers)
+        if pch is not None:
+            flags += ' -include %s -Winvalid-pch' % pch[:-len('.gch')]
+            implicit.append(pch)
+        self.writer.build([obj], ninja_rule, [src], implicit, variables=[
+            ('tool', tool),
+            ('flags', flags),
+        ])
+        return obj
+
+    def generate_pch(self, rule, env, variant, prefix, include_flags='',
+                     shared=False):
+        '''Return path of the precompiled header of the rule, or None.'''
+        try:
+            header = self.build_order.bmreg.get_attr(rule, builder_maker.PCH)
+        except KeyError:
+            return None
+        language = builder_maker.get_language(rule)
+        key = (id(env), variant, header, language, shared)
+        if key in self.pchs:
+            return self.pchs[key]
+        index = builder_maker.get_pch_index(self.pchs, key)
+        gch = os.path.join(prefix, builder_maker.get_pch_path(
+            header.path, language, shared, index) + '.gch')
+        tool, flags = _get_compile_command(env, language, shared)
+        flags = _subst(env, flags, gch, header.path) + include_flags
+        self.writer.build([gch], 'pch', [header.path], variables=[
+            ('tool', env.subst(tool)),
+            ('language', language),
+            ('flags', flags),
+        ])
+        self.pchs[key] = gch
+        return gch
+
+
+def _get_compile_command(env, language, shared):
+    '''Return the compiler and its flags (not substituted).'''
+    if language == 'c++':
+        if shared:
+            return '$SHCXX', '$SHCXXFLAGS $SHCCFLAGS $_CCCOMCOM'
+        return '$CXX', '$CXXFLAGS $CCFLAGS $_CCCOMCOM'
+    if shared:
+        return '$SHCC', '$SHCFLAGS $SHCCFLAGS $_CCCOMCOM'
+    return '$CC', '$CFLAGS $CCFLAGS $_CCCOMCOM'
+
+
+def _subst(env, string, target, source):
+    # Directories of paths like '#include' are resolved against target nodes
+    if not isinstance(target, list):
+        target = [target]
+    if not isinstance(source, list):
+        source = [source]
+    return env.subst(string,
+                     target=[env.File(path) for path in target],
+                     source=[env.File(path) for path in source])
+
+
+def get_regen_deps():
+    '''Return paths of the SConstruct and SConscripts that SCons read.
+
+    Paths are relative to the top directory, and those of SConscripts read
+    in a variant directory are of their sources.
+    '''
+    import SCons.Node
+    return sorted(set(node.srcnode().path
+                      for node in SCons.Node.SConscriptNodes))
+
+
+def generate_ninja(build_order, output, path, build_root,
+                   regen_command, regen_deps):
+    '''Write Ninja build file of sorted rules of build_order to output.'''
+    generator = NinjaGenerator(build_order, NinjaWriter(output))
+    generator.generate(build_root, regen_command, regen_deps, path)
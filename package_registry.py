@@ -1,7 +1,5 @@
 # Copyright (c) 2013 Che-Liang Chiou
 
-from SCons.Script import Environment
-
 from scons_package.label import PackageName
 
 
@@ -12,6 +10,7 @@ class PackageAttributes(object):
         self.attr_class = attr_class
         self.package_trie = PackageTrie()
         self.attrs = {}
+        self.owners = {}  # Package that declared the entry -> packages
         self._default = None
 
     def get_default(self):
@@ -23,13 +22,35 @@ class PackageAttributes(object):
 
     default = property(get_default, set_default)
 
-    def add(self, package_name, value):
+    def add(self, package_name, value, owner=None):
         assert isinstance(package_name, PackageName)
         assert isinstance(value, self.attr_class)
+        assert owner is None or isinstance(owner, PackageName)
         if package_name in self.attrs:
             raise KeyError('overwrite package: %s' % package_name)
         self.package_trie.add(package_name)
         self.attrs[package_name] = value
+        if owner is not None:
+            self.owners.setdefault(owner, []).append(package_name)
+
+    def remove_owner(self, owner):
+        '''Remove and return entries declared by the owner package.
+
+        Entries are (package name, value) pairs, which restore_owner()
+        takes.
+        '''
+        assert isinstance(owner, PackageName)
+        entries = []
+        for package_name in self.owners.pop(owner, ()):
+            self.package_trie.remove(package_name)
+            entries.append((package_name, self.attrs.pop(package_name)))
+        return entries
+
+    def restore_owner(self, owner, entries):
+        '''Replace entries of the owner with entries removed before.'''
+        self.remove_owner(owner)
+        for package_name, value in entries:
+            self.add(package_name, value, owner)
 
     def search(self, package_name):
         assert isinstance(package_name, PackageName)
@@ -66,6 +87,7 @@ class PackageEnvironmentRegistry(PackageAttributes):
         return cls.Instance
 
     def __init__(self):
+        from SCons.Script import Environment
         super(PackageEnvironmentRegistry, self).__init__(Environment)
 
 
@@ -91,6 +113,8 @@ class PackageTrie:
             child_path = path + component
             # Same package
             if child_path == package_name.path:
+                if child.package_name is None:  # Removed before
+                    child.package_name = package_name
                 assert package_name == child.package_name
                 break
             # package_name is shorter
@@ -113,25 +137,41 @@ class PackageTrie:
             assert component not in node.edges
             node.edges[component] = PackageTrie.Node(package_name)
 
+    def remove(self, package_name):
+        assert isinstance(package_name, PackageName)
+        node = self._search(self.root, '', package_name.path)
+        if node is None or node.package_name != package_name:
+            raise KeyError(str(package_name))
+        # Keep the node as other packages may be below it
+        node.package_name = None
+
     def search(self, target):
         assert isinstance(target, (PackageName, str))
         if isinstance(target, PackageName):
             target = target.path
-        return self._search(self.root, '', target).package_name
+        node = self._search(self.root, '', target)
+        return node.package_name if node is not None else None
 
     def _search(self, node, path, target):
+        '''Return the deepest node of target or its parent packages.'''
         assert target.startswith(path)
         for component, child in node.edges.items():
             child_path = path + component
             # Same package
             if child_path == target:
-                return child
+                found = child
+                break
             # target is shorter
             if child_path.startswith(target):
                 continue
             # child_path is shorter
             if target.startswith(child_path):
-                return self._search(child, child_path, target)
+                found = self._search(child, child_path, target)
+                break
         # target does not match any child
         else:
-            return node
+            found = None
+        if found is not None and found.package_name is not None:
+            return found
+        # Skip removed packages
+        return node if node.package_name is not None else None
@@ -0,0 +1,502 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Content-addressed execution of compile and link actions.
+
+An action is a command line plus its input and output files.  Its digest
+is computed from the command line and the contents of its inputs, and the
+result of a successful action is cached by that digest; outputs are kept
+in a content-addressed store.  Headers discovered by the compiler are
+recorded with the result and must be unchanged for a cache hit.
+
+LocalExecutor runs actions on a local multi-process worker pool; serve()
+exports an executor over multiprocessing.connection so that several
+checkouts on the same machine may share one warm pool and action cache,
+and RemoteExecutor is the client side of that protocol.
+
+This module does not depend on SCons; make_spawn() adapts an executor to
+the SPAWN construction variable of SCons.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from multiprocessing import Pool
+from multiprocessing.connection import Client, Listener
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# Global header of a thin archive (which holds paths of its members)
+THIN_ARCHIVE_MAGIC = b'!<thin>\n'
+
+
+def digest_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def digest_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        while True:
+            chunk = file_obj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def find_executable(name, path):
+    '''Return path of the executable name searched in path, or None.'''
+    if os.sep in name:
+        return name if os.path.isfile(name) else None
+    for dirpath in path.split(os.pathsep):
+        candidate = os.path.join(dirpath, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def _atomic_copy(src, dst):
+    dirname = os.path.dirname(dst)
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+    fd, tmp = tempfile.mkstemp(dir=dirname or os.path.curdir)
+    os.close(fd)
+    try:
+        shutil.copy2(src, tmp)
+        os.rename(tmp, dst)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+class ContentStore(object):
+    '''Files keyed by the digest of their contents.'''
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, path):
+        digest = digest_file(path)
+        if not self.has(digest):
+            _atomic_copy(path, self.path(digest))
+        return digest
+
+    def get(self, digest, path):
+        if not self.has(digest):
+            raise KeyError(digest)
+        if os.path.exists(path):
+            os.remove(path)
+        _atomic_copy(self.path(digest), path)
+
+
+class ActionCache(object):
+    '''Results of successful actions keyed by action digest.'''
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, action_digest):
+        return os.path.join(self.root, action_digest[:2], action_digest)
+
+    def get(self, action_digest):
+        try:
+            with open(self.path(action_digest)) as result_file:
+                return json.load(result_file)
+        except (IOError, OSError, ValueError):
+            raise KeyError(action_digest)
+
+    def put(self, action_digest, result):
+        path = self.path(action_digest)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'w') as result_file:
+            json.dump(result, result_file, sort_keys=True)
+        os.rename(tmp, path)
+
+
+class Action(object):
+
+    def __init__(self, argv, cwd, inputs, outputs, environ=None):
+        assert argv
+        self.argv = list(argv)
+        self.cwd = cwd
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.environ = dict(environ or {})
+
+    @classmethod
+    def from_dict(cls, action_dict):
+        return cls(action_dict['argv'],
+                   action_dict['cwd'],
+                   action_dict['inputs'],
+                   action_dict['outputs'],
+                   action_dict['environ'])
+
+    def to_dict(self):
+        return {'argv': self.argv,
+                'cwd': self.cwd,
+                'inputs': self.inputs,
+                'outputs': self.outputs,
+                'environ': self.environ}
+
+    def is_compile(self):
+        return '-c' in self.argv
+
+    def get_digest(self, input_digests):
+        # The working directory is left out so that checkouts of the same
+        # tree share results.
+        key = {'argv': self.argv,
+               'inputs': [(path, input_digests[path]) for path in self.inputs],
+               'outputs': self.outputs,
+               'environ': self.environ}
+        return digest_bytes(json.dumps(key, sort_keys=True).encode('utf-8'))
+
+    def resolve(self, path):
+        return os.path.join(self.cwd, path)
+
+
+def parse_depfile(contents):
+    '''Return dependencies listed in a Makefile-style depfile.'''
+    contents = contents.replace('\\\n', ' ')
+    deps = []
+    for line in contents.splitlines():
+        if ':' not in line:
+            continue
+        _, line_deps = line.split(':', 1)
+        deps.extend(line_deps.split())
+    return deps
+
+
+def execute_action(action_dict, store_root):
+    '''Run an action and store its outputs (executed by pool workers).'''
+    action = Action.from_dict(action_dict)
+    argv = list(action.argv)
+    depfile = None
+    if action.is_compile():
+        fd, depfile = tempfile.mkstemp(suffix='.d')
+        os.close(fd)
+        argv.extend(('-MD', '-MF', depfile))
+    try:
+        proc = subprocess.Popen(argv,
+                                cwd=action.cwd,
+                                env=action.environ or None,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        result = {'exit_code': proc.returncode,
+                  'stdout': stdout.decode('utf-8', 'replace'),
+                  'stderr': stderr.decode('utf-8', 'replace'),
+                  'outputs': {},
+                  'deps': {}}
+        if proc.returncode != 0:
+            return result
+        store = ContentStore(store_root)
+        for path in action.outputs:
+            result['outputs'][path] = store.put(action.resolve(path))
+        if depfile is not None:
+            with open(depfile) as depfile_obj:
+                for path in parse_depfile(depfile_obj.read()):
+                    result['deps'][path] = digest_file(action.resolve(path))
+        return result
+    finally:
+        if depfile is not None and os.path.exists(depfile):
+            os.remove(depfile)
+
+
+class LocalExecutor(object):
+    '''Execute actions on a local worker pool, with an action cache.
+
+    Workers run in the working directory of the action, so this executor
+    must share the file system with its clients.
+    '''
+
+    def __init__(self, root, jobs=None):
+        self.store = ContentStore(os.path.join(root, 'cas'))
+        self.cache = ActionCache(os.path.join(root, 'ac'))
+        self.pool = Pool(jobs)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def execute(self, action):
+        assert isinstance(action, Action)
+        input_digests = {}
+        for path in action.inputs:
+            input_digests[path] = digest_file(action.resolve(path))
+        action_digest = action.get_digest(input_digests)
+        try:
+            result = self.cache.get(action_digest)
+        except KeyError:
+            pass
+        else:
+            if self._materialize(action, result):
+                result['cached'] = True
+                return result
+        result = self.pool.apply(execute_action,
+                                 (action.to_dict(), self.store.root))
+        if result['exit_code'] == 0:
+            self.cache.put(action_digest, result)
+        result['cached'] = False
+        return result
+
+    def _materialize(self, action, result):
+        for path, digest in result['deps'].items():
+            try:
+                if digest_file(action.resolve(path)) != digest:
+                    return False
+            except (IOError, OSError):
+                return False
+        try:
+            for path, digest in result['outputs'].items():
+                self.store.get(digest, action.resolve(path))
+        except KeyError:
+            return False
+        return True
+
+
+def parse_address(address):
+    '''Parse host:port, or return a Unix domain socket path as is.'''
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or 'localhost', int(port))
+    return address
+
+
+def serve(address, executor, authkey=None):
+    '''Serve execution requests until interrupted.
+
+    Requests run arbitrary commands, so the address is checked by
+    check_listen_address() first.
+    '''
+    check_listen_address(address, authkey)
+    listener = Listener(address, authkey=authkey)
+    try:
+        while True:
+            conn = listener.accept()
+            thread = threading.Thread(target=_serve_connection,
+                                      args=(conn, executor))
+            thread.daemon = True
+            thread.start()
+    finally:
+        listener.close()
+
+
+def check_listen_address(address, authkey=None):
+    '''Raise ValueError unless only the user may connect to address.
+
+    Without an authkey, a service may listen only on a Unix domain socket
+    in a directory private to the user.
+    '''
+    if authkey is None:
+        if not isinstance(address, str):
+            raise ValueError('authkey required to listen on %s:%d' %
+                             address)
+        _check_private_dir(os.path.dirname(os.path.abspath(address)))
+
+
+def make_private_dir(path):
+    '''Make a directory accessible by the user only (if missing).'''
+    if not os.path.isdir(path):
+        os.makedirs(path, 0o700)
+    _check_private_dir(path)
+
+
+def _check_private_dir(path):
+    stat = os.stat(path)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise ValueError('directory accessible by other users: %s' % path)
+
+
+def _serve_connection(conn, executor):
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+            try:
+                result = executor.execute(Action.from_dict(request))
+            except Exception as exc:
+                result = {'exit_code': -1,
+                          'stdout': '',
+                          'stderr': 'execution service: %s\n' % exc,
+                          'outputs': {},
+                          'deps': {},
+                          'cached': False}
+            conn.send(result)
+    finally:
+        conn.close()
+
+
+class RemoteExecutor(object):
+    '''Client of an execution service started by serve().'''
+
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+        self.local = threading.local()
+
+    def execute(self, action):
+        assert isinstance(action, Action)
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, authkey=self.authkey)
+            self.local.conn = conn
+        conn.send(action.to_dict())
+        return conn.recv()
+
+
+def make_spawn(executor, tools, spawn, on_result=None):
+    '''Make a SCons SPAWN function dispatching tools' actions to executor.
+
+    Command lines that do not run one of the tools, or whose outputs are
+    not named by -o, are passed to spawn unchanged.  on_result, if given,
+    is called with the result of each dispatched action.
+    '''
+    tools = frozenset(tools)
+
+    def remote_spawn(sh, escape, cmd, args, env):
+        argv = [unescape(arg) for arg in args]
+        if os.path.basename(argv[0]) not in tools:
+            return spawn(sh, escape, cmd, args, env)
+        action = make_action(argv, os.getcwd(), env)
+        if action is None:
+            return spawn(sh, escape, cmd, args, env)
+        result = executor.execute(action)
+        if on_result is not None:
+            on_result(result)
+        sys.stdout.write(result['stdout'])
+        sys.stderr.write(result['stderr'])
+        return result['exit_code']
+
+    return remote_spawn
+
+
+def unescape(arg):
+    '''Undo the quoting that SCons applies to arguments for the shell.'''
+    if len(arg) >= 2 and arg[0] == arg[-1] == '"':
+        chars = []
+        escaped = False
+        for char in arg[1:-1]:
+            if char == '\\' and not escaped:
+                escaped = True
+                continue
+            chars.append(char)
+            escaped = False
+        arg = ''.join(chars)
+    return arg
+
+
+def make_action(args, cwd, environ):
+    '''Make an action from a compile or link command line, or None.
+
+    Inputs are the files named on the command line, libraries of -l found
+    in the directories of -L, members of thin archives, and the tool (other
+    files of the toolchain, and libraries found in its default directories,
+    are not inputs).  None is returned, too, if the members of a thin
+    archive cannot be listed.
+    '''
+    outputs = []
+    libdirs = []
+    libraries = []
+    for i, arg in enumerate(args):
+        for flag, values in (('-o', outputs), ('-L', libdirs),
+                             ('-l', libraries)):
+            if arg == flag and i + 1 < len(args):
+                values.append(args[i + 1])
+            elif arg.startswith(flag) and len(arg) > 2:
+                values.append(arg[2:])
+    if not outputs:
+        return None
+    inputs = []
+    for i, arg in enumerate(args[1:]):
+        if (not arg.startswith('-') and args[i] not in ('-L', '-l') and
+                arg not in outputs and
+                os.path.isfile(os.path.join(cwd, arg))):
+            inputs.append(arg)
+    for library in libraries:
+        path = find_library(library, libdirs, cwd, '-static' in args)
+        if path is not None and path not in inputs:
+            inputs.append(path)
+    environ = dict((str(key), str(value)) for key, value in environ.items())
+    for path in list(inputs):
+        members = get_thin_archive_members(path, cwd, environ)
+        if members is None:
+            return None
+        inputs.extend(member for member in members if member not in inputs)
+    tool = args[0]
+    if os.sep not in tool:
+        tool = find_executable(tool, environ.get('PATH', os.defpath))
+    elif not os.path.isfile(os.path.join(cwd, tool)):
+        tool = None
+    if tool is not None and tool not in inputs:
+        inputs.append(tool)
+    return Action(args, cwd, inputs, outputs, environ)
+
+
+def get_thin_archive_members(path, cwd, environ):
+    '''Return members of the thin archive at path (relative to cwd).
+
+    An empty list is returned if path is not a thin archive, and None if
+    its members cannot be listed.
+    '''
+    if not path.endswith('.a'):
+        return []
+    try:
+        with open(os.path.join(cwd, path), 'rb') as archive:
+            if archive.read(len(THIN_ARCHIVE_MAGIC)) != THIN_ARCHIVE_MAGIC:
+                return []
+    except (IOError, OSError):
+        return []
+    ar = find_executable('ar', environ.get('PATH', os.defpath))
+    if ar is None:
+        return None
+    proc = subprocess.Popen([ar, 't', path],
+                            cwd=cwd,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        return None
+    # ar lists members relative to the working directory
+    return [os.path.normpath(member)
+            for member in output.decode('utf-8').splitlines()]
+
+
+def find_library(library, libdirs, cwd, static=False):
+    '''Return path of the library of -l found in libdirs, or None.'''
+    if library.startswith(':'):
+        names = [library[1:]]
+    elif static:
+        names = ['lib%s.a' % library]
+    else:
+        names = ['lib%s.so' % library, 'lib%s.a' % library]
+    for libdir in libdirs:
+        for name in names:
+            path = os.path.join(libdir, name)
+            if os.path.isfile(os.path.join(cwd, path)):
+                return path
+    return None
@@ -0,0 +1,156 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Named resource pools that cap concurrent actions.
+
+The targets of a rule in a pool of size N are scheduled by the Taskmaster
+of SCons (see install_scheduler) so that at most N of them are handed out
+to jobs at the same time; the others wait without holding a job, so that
+the remaining -j jobs keep compiling.
+
+A pool is also a semaphore of N slots that an action of the pool holds
+while it runs: command actions through their SPAWN, and Python function
+actions (genrules and tests) through the RESOURCE_POOL construction
+variable.  This bounds actions run outside of the scheduler.
+'''
+
+import threading
+
+# Construction variable of the pool of a function action
+RESOURCE_POOL = 'RESOURCE_POOL'
+
+
+class ResourcePool(object):
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.semaphore = threading.BoundedSemaphore(size)
+
+    def call(self, function, *args, **kwargs):
+        '''Call function while holding a slot of the pool.'''
+        with self.semaphore:
+            return function(*args, **kwargs)
+
+    def wrap(self, function):
+        '''Return function that runs while holding a slot of the pool.'''
+        def pooled_function(*args, **kwargs):
+            return self.call(function, *args, **kwargs)
+        return pooled_function
+
+
+def call(env, function, *args, **kwargs):
+    '''Call function in the pool of the action of env (if any).'''
+    pool = env.get(RESOURCE_POOL)
+    if pool is None:
+        return function(*args, **kwargs)
+    return pool.call(function, *args, **kwargs)
+
+
+class ResourcePoolRegistry:
+
+    Instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls.Instance is None:
+            cls.Instance = cls()
+        return cls.Instance
+
+    def __init__(self):
+        self.pools = {}
+        self.builder_type_pools = {}
+        self.node_pools = {}  # Target node -> pool
+
+    def add_pool(self, name, size):
+        assert isinstance(name, str)
+        assert isinstance(size, int)
+        if size <= 0:
+            raise ValueError('non-positive pool size: %s=%d' % (name, size))
+        if name in self.pools:
+            raise KeyError('overwrite pool: %s' % name)
+        self.pools[name] = ResourcePool(name, size)
+
+    def has_pool(self, name):
+        return name in self.pools
+
+    def set_builder_type_pool(self, builder_type, name):
+        if name not in self.pools:
+            raise KeyError('undefined pool: %s' % name)
+        self.builder_type_pools[builder_type] = name
+
+    def get_pool(self, builder_type, name=None):
+        '''Return pool of the rule, or None (from rule/builder type).'''
+        if name is None:
+            name = self.builder_type_pools.get(builder_type)
+        if name is None:
+            return None
+        if name not in self.pools:
+            raise KeyError('undefined pool: %s' % name)
+        return self.pools[name]
+
+    def set_node_pool(self, nodes, pool):
+        '''Schedule the target nodes in the pool.'''
+        assert isinstance(pool, ResourcePool)
+        for node in nodes:
+            self.node_pools[node] = pool
+
+
+class PoolScheduler(object):
+    '''Mixin of SCons.Taskmaster.Taskmaster scheduling pools.
+
+    A ready node of a full pool is deferred rather than handed out, and is
+    handed out when a node of the pool finishes (in the next search for a
+    ready node).  On stop, deferred nodes go back to the candidates, which
+    the Taskmaster then marks as not built.
+    '''
+
+    rpreg = None
+
+    def _find_next_ready_node(self):
+        # SCons node states; a node is finished after executing
+        from SCons.Node import executing
+        if not hasattr(self, 'deferred_nodes'):
+            self.deferred_nodes = []
+            self.running_nodes = {}  # Pool -> nodes handed out
+        for nodes in self.running_nodes.values():
+            nodes[:] = [node for node in nodes
+                        if node.get_state() <= executing]
+        for i, node in enumerate(self.deferred_nodes):
+            pool = self.rpreg.node_pools[node]
+            if self._has_slot(pool):
+                del self.deferred_nodes[i]
+                self.ready_exc = None
+                return self._hand_out(node, pool)
+        while True:
+            node = super(PoolScheduler, self)._find_next_ready_node()
+            pool = self.rpreg.node_pools.get(node)
+            if pool is None or self.ready_exc is not None:
+                return node
+            if self._has_slot(pool):
+                return self._hand_out(node, pool)
+            self.deferred_nodes.append(node)
+
+    def _has_slot(self, pool):
+        return len(self.running_nodes.get(pool, ())) < pool.size
+
+    def _hand_out(self, node, pool):
+        self.running_nodes.setdefault(pool, []).append(node)
+        return node
+
+    def stop(self):
+        self.candidates.extend(getattr(self, 'deferred_nodes', ()))
+        self.deferred_nodes = []
+        super(PoolScheduler, self).stop()
+
+
+def install_scheduler(rpreg):
+    '''Make SCons schedule target nodes of the pools of rpreg.'''
+    import SCons.Taskmaster
+    taskmaster = SCons.Taskmaster.Taskmaster
+    if issubclass(taskmaster, PoolScheduler):
+        taskmaster.rpreg = rpreg
+        return
+    SCons.Taskmaster.Taskmaster = type('PoolTaskmaster',
+                                       (PoolScheduler, taskmaster),
+                                       {'rpreg': rpreg})
+
@@ -1,6 +1,6 @@
 # Copyright (c) 2013 Che-Liang Chiou
 
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
 from scons_package.label import Label, LabelOfRule, LabelOfFile
 from scons_package.utils import topology_sort
@@ -10,6 +10,8 @@ class RuleRegistry:
 
     def __init__(self):
         self.rules = OrderedDict()
+        self.package_labels = defaultdict(list)
+        self.producers = {}  # Output -> label of the rule
 
     def __len__(self):
         return len(self.rules)
@@ -21,12 +23,43 @@ class RuleRegistry:
         assert isinstance(label, Label)
         return self.rules[label]
 
+    def __contains__(self, label):
+        return label in self.rules
+
     def has_rule(self, rule):
         return rule.name in self.rules
 
     def add_rule(self, rule):
         assert isinstance(rule, Rule)
         self.rules[rule.name] = rule
+        self.package_labels[rule.name.package_name].append(rule.name)
+        for output in rule.outputs:
+            self.producers[output] = rule.name
+
+    def get_package_rules(self, package_name):
+        return [self.rules[label]
+                for label in self.package_labels.get(package_name, ())]
+
+    def remove_package(self, package_name):
+        '''Remove and return rules of the package.'''
+        labels = self.package_labels.pop(package_name, ())
+        rules = [self.rules.pop(label) for label in labels]
+        for rule in rules:
+            for output in rule.outputs:
+                if self.producers.get(output) == rule.name:
+                    del self.producers[output]
+        return rules
+
+    def get_depends(self, rule):
+        '''Return depends of the rule and producers of its inputs.'''
+        assert isinstance(rule, Rule)
+        depends = list(rule.depends)
+        for label in rule.inputs:
+            producer = self.producers.get(label)
+            if (producer is not None and producer != rule.name and
+                    producer not in depends):
+                depends.append(producer)
+        return depends
 
     def get_missing_dependencies(self):
         for label, rule in self.rules.items():
@@ -37,7 +70,7 @@ class RuleRegistry:
     def get_sorted_rules(self):
         def get_neighbors(rule):
             assert isinstance(rule, Rule)
-            return (self.rules[label] for label in rule.depends)
+            return (self.rules[label] for label in self.get_depends(rule))
         return topology_sort(self.rules.values(), get_neighbors)
 
 
@@ -0,0 +1,142 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Content signatures of source files, computed ahead of the build.
+
+SCons computes the content signature (the digest of the contents) of a
+file serially, when the file is first visited.  SignatureCache computes
+the signatures of many files on a thread pool beforehand (hashlib releases
+the GIL while hashing), reading large files through mmap.  Signatures are
+kept in a database keyed by path and validated by size and mtime, so
+unchanged files are not read again across runs.
+
+A file modified within RACY_SECONDS before the database is saved is not
+kept, since a later change with the same mtime would go unnoticed.
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import stat
+import time
+from multiprocessing.pool import ThreadPool
+
+
+CACHE_VERSION = 1
+
+# Files at least this large are read through mmap
+MMAP_THRESHOLD = 1024 * 1024
+
+RACY_SECONDS = 2
+
+
+def digest_file(path, size, hash_name='md5'):
+    '''Return hex digest of the contents of a file of the given size.'''
+    hasher = hashlib.new(hash_name)
+    with open(path, 'rb') as file_obj:
+        if size >= MMAP_THRESHOLD:
+            contents = mmap.mmap(file_obj.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            try:
+                hasher.update(contents)
+            finally:
+                contents.close()
+        else:
+            hasher.update(file_obj.read())
+    return hasher.hexdigest()
+
+
+class FileSignature(object):
+
+    def __init__(self, size, mtime, digest):
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(*value)
+
+    def to_json(self):
+        return [self.size, self.mtime, self.digest]
+
+
+class SignatureCache(object):
+
+    def __init__(self, hash_name='md5', jobs=None):
+        self.hash_name = hash_name
+        self.jobs = jobs
+        self.signatures = {}  # Path -> FileSignature
+
+    def load_cache(self, cache_path):
+        try:
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return
+        if (cache.get('version') != CACHE_VERSION or
+                cache.get('hash') != self.hash_name):
+            return
+        self.signatures = dict((path, FileSignature.from_json(value))
+                               for path, value in cache['files'].items())
+
+    def save_cache(self, cache_path):
+        dirname = os.path.dirname(cache_path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        deadline = time.time() - RACY_SECONDS
+        cache = {
+            'version': CACHE_VERSION,
+            'hash': self.hash_name,
+            'files': dict((path, signature.to_json())
+                          for path, signature in self.signatures.items()
+                          if signature.mtime < deadline),
+        }
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.rename(tmp_path, cache_path)
+
+    def get_paths(self):
+        '''Return paths of files with a recorded signature.'''
+        return sorted(self.signatures)
+
+    def update(self, path, size, mtime, digest):
+        '''Record the signature of a file (hashed by someone else).'''
+        self.signatures[path] = FileSignature(size, mtime, digest)
+
+    def prefetch(self, paths):
+        '''Return digests of regular files among paths, keyed by path.'''
+        paths = sorted(set(paths))
+        pool = ThreadPool(self.jobs)
+        try:
+            signatures = pool.map(self._get_signature, paths)
+        finally:
+            pool.close()
+            pool.join()
+        digests = {}
+        for path, signature in zip(paths, signatures):
+            if signature is None:
+                self.signatures.pop(path, None)
+                continue
+            self.signatures[path] = signature
+            digests[path] = signature.digest
+        return digests
+
+    def _get_signature(self, path):
+        try:
+            path_stat = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(path_stat.st_mode):
+            return None
+        signature = self.signatures.get(path)
+        if (signature is not None and
+                signature.size == path_stat.st_size and
+                signature.mtime == path_stat.st_mtime):
+            return signature
+        try:
+            digest = digest_file(path, path_stat.st_size, self.hash_name)
+        except (IOError, OSError):
+            return None
+        return FileSignature(path_stat.st_size, path_stat.st_mtime, digest)
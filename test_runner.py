@@ -0,0 +1,139 @@
+# Copyright (c) 2013 Che-Liang Chiou
+
+'''Run test programs, optionally sharded, with per-test timeouts.
+
+Each shard of a test is a SCons target whose sources are the test binary
+and its runtime data, so a shard is re-run only when the fingerprint of
+the binary or its data changes; an unchanged passing test is skipped.
+Shards run in parallel under -j, bounded by the resource pool of tests
+(which a shard holds while its process runs).
+'''
+
+import os
+import subprocess
+import sys
+import threading
+
+from scons_package import build_events
+from scons_package import resource_pool
+from scons_package.label import LabelOfFile
+
+
+class TestOptions(object):
+
+    def __init__(self, data=(), shards=1, timeout=None, args=()):
+        assert isinstance(shards, int)
+        assert timeout is None or isinstance(timeout, (int, float))
+        if shards <= 0:
+            raise ValueError('non-positive number of shards: %d' % shards)
+        if timeout is not None and timeout <= 0:
+            raise ValueError('non-positive timeout: %s' % timeout)
+        self.data = LabelOfFile.make_label_list(data)
+        self.shards = shards
+        self.timeout = timeout
+        self.args = list(args)
+
+
+def get_shard_environ(environ, shard_index, total_shards):
+    '''Return environment of a shard (Bazel and googletest conventions).'''
+    environ = dict(environ)
+    if total_shards > 1:
+        for prefix in ('TEST_', 'GTEST_'):
+            environ[prefix + 'TOTAL_SHARDS'] = str(total_shards)
+            environ[prefix + 'SHARD_INDEX'] = str(shard_index)
+    return environ
+
+
+def run_process(argv, environ, timeout):
+    '''Run a test process; return (exit status, output, timed out).'''
+    proc = subprocess.Popen(argv,
+                            env=environ,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        proc.kill()
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    try:
+        output, _ = proc.communicate()
+    finally:
+        if timer is not None:
+            timer.cancel()
+    return proc.returncode, output.decode('utf-8', 'replace'), bool(timed_out)
+
+
+def run_test(target, source, env):
+    '''SCons action of running a test shard.
+
+    source[0] is the test binary; the log of a passing shard is written to
+    target[0], and the log of a failing shard is printed instead, so that
+    the shard is run again on the next build.
+    '''
+    shard_index = env['TEST_SHARD_INDEX']
+    total_shards = env['TEST_TOTAL_SHARDS']
+    timeout = env['TEST_TIMEOUT']
+    argv = [source[0].abspath] + [env.subst(arg) for arg in env['TEST_ARGS']]
+    environ = get_shard_environ(env['ENV'], shard_index, total_shards)
+    with build_events.record(env, os.path.basename(argv[0])) as event:
+        status, output, timed_out = resource_pool.call(env, run_process,
+                                                       argv, environ,
+                                                       timeout)
+        event['exit_status'] = status
+    name = str(source[0])
+    if total_shards > 1:
+        name = '%s (shard %d of %d)' % (name, shard_index + 1, total_shards)
+    if timed_out:
+        sys.stdout.write(output)
+        sys.stdout.write('TIMEOUT: %s after %s seconds\n' % (name, timeout))
+        return 1
+    if status != 0:
+        sys.stdout.write(output)
+        sys.stdout.write('FAIL: %s exited with %d\n' % (name, status))
+        return 1
+    with open(target[0].abspath, 'w') as log_file:
+        log_file.write(output)
+    return 0
+
+
+def _test_string(target, source, env):
+    total_shards = env['TEST_TOTAL_SHARDS']
+    if total_shards == 1:
+        return 'Testing %s' % source[0]
+    return 'Testing %s (shard %d of %d)' % (source[0],
+                                            env['TEST_SHARD_INDEX'] + 1,
+                                            total_shards)
+
+
+def get_result_path(program_path, shard_index, total_shards):
+    if total_shards == 1:
+        return program_path + '.test_result'
+    return '%s.test_result-%d-of-%d' % (program_path,
+                                         shard_index + 1, total_shards)
+
+
+def make_test_results(env, program, program_path, options, pool=None,
+                      recorder=None):
+    '''Make a SCons target per shard of the test program.'''
+    assert isinstance(options, TestOptions)
+    source = [program] + [label.path for label in options.data]
+    action = env.Action(run_test, strfunction=_test_string,
+                        varlist=['TEST_SHARD_INDEX', 'TEST_TOTAL_SHARDS',
+                                 'TEST_TIMEOUT', 'TEST_ARGS'])
+    results = []
+    for shard_index in range(options.shards):
+        result_path = get_result_path(program_path, shard_index,
+                                      options.shards)
+        results.extend(env.Command(result_path, source, action,
+                                   TEST_SHARD_INDEX=shard_index,
+                                   TEST_TOTAL_SHARDS=options.shards,
+                                   TEST_TIMEOUT=options.timeout,
+                                   TEST_ARGS=options.args,
+                                   RESOURCE_POOL=pool,
+                                   ACTION_RECORDER=recorder))
+    return results
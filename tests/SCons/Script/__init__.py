@@ -11,6 +11,9 @@ class Dir(object):
     def srcnode(self):
         return Dir()
 
+    def get_path(self, dir=None):
+        return self.path
+
 
 class Environment(object):
     pass
@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from scons_package.build_events import (ACTION_RECORDER,
+                                        DEFAULT_SPAWN_MODULE,
+                                        ActionRecorder,
+                                        open_event_writer,
+                                        record)
+
+
+class MemoryWriter(object):
+
+    def __init__(self):
+        self.events = []
+
+    def write(self, event):
+        self.events.append(event)
+
+
+class TestEventWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_file(self):
+        path = os.path.join(self.root, 'log/events.jsonl')
+        writer = open_event_writer(path=path)
+        for i in range(100):
+            writer.write({'index': i})
+        writer.close()
+        with open(path) as events:
+            self.assertEqual(list(range(100)),
+                             [json.loads(line)['index'] for line in events])
+
+    def test_socket(self):
+        address = os.path.join(self.root, 'events.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+        listener.listen(1)
+        received = []
+
+        def receive():
+            conn, _ = listener.accept()
+            lines = conn.makefile('r')
+            received.extend(json.loads(line) for line in lines)
+            lines.close()
+            conn.close()
+
+        thread = threading.Thread(target=receive)
+        thread.start()
+        writer = open_event_writer(address=address)
+        writer.write({'rule': '#a:a'})
+        writer.close()
+        thread.join()
+        listener.close()
+        self.assertEqual([{'rule': '#a:a'}], received)
+
+
+class TestActionRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = MemoryWriter()
+        self.recorder = ActionRecorder(self.writer,
+                                       {'rule': '#a:a', 'variant': 'opt'})
+
+    def test_wrap(self):
+        def spawn(sh, escape, cmd, args, env):
+            self.recorder.set_result({'cached': True, 'exit_code': 0})
+            return 3
+
+        event_spawn = self.recorder.wrap(spawn)
+        self.assertEqual(3, event_spawn('sh', None, 'g++',
+                                        ['"/usr/bin/g++"', '-c'], {}))
+        event, = self.writer.events
+        self.assertEqual('#a:a', event['rule'])
+        self.assertEqual('opt', event['variant'])
+        self.assertEqual('g++', event['tool'])
+        self.assertEqual(True, event['cached'])
+        self.assertEqual(3, event['exit_status'])
+        self.assertLessEqual(event['start'], event['end'])
+
+    def test_resource_usage(self):
+        if not hasattr(os, 'wait4'):
+            return
+        def default_spawn(sh, escape, cmd, args, env):
+            raise AssertionError('default spawn is replaced')
+
+        default_spawn.__module__ = DEFAULT_SPAWN_MODULE
+        event_spawn = self.recorder.wrap(
+            self.recorder.get_spawn(default_spawn))
+        self.assertEqual(0, event_spawn('sh', None, 'true', ['true'],
+                                        dict(os.environ)))
+        self.assertEqual(2, event_spawn('sh', None, 'exit',
+                                        ['exit', '2'], dict(os.environ)))
+        self.assertEqual(-9, event_spawn('sh', None, 'kill',
+                                         ['kill', '-9', '$$'],
+                                         dict(os.environ)))
+        for event in self.writer.events:
+            self.assertEqual(None, event['cached'])
+            self.assertGreater(event['max_rss'], 0)
+            self.assertGreaterEqual(event['user_time'], 0)
+            self.assertGreaterEqual(event['system_time'], 0)
+        self.assertEqual([0, 2, -9], [event['exit_status']
+                                      for event in self.writer.events])
+
+    def test_user_spawn(self):
+        commands = []
+
+        def spawn(sh, escape, cmd, args, env):
+            commands.append(args)
+            return 0
+
+        self.assertIs(spawn, self.recorder.get_spawn(spawn))
+        event_spawn = self.recorder.wrap(self.recorder.get_spawn(spawn))
+        self.assertEqual(0, event_spawn('sh', None, 'ccache',
+                                        ['ccache', 'g++', '-c'], {}))
+        self.assertEqual([['ccache', 'g++', '-c']], commands)
+        event, = self.writer.events
+        self.assertEqual('ccache', event['tool'])
+        self.assertEqual(0, event['exit_status'])
+        self.assertEqual(None, event['max_rss'])
+
+    def test_target_fields(self):
+        def spawn(sh, escape, cmd, args, env):
+            return 0
+
+        self.recorder.add_targets(['p/a.o', 'p/liba.a'],
+                                  {'rule': '#p:a', 'variant': None})
+        self.recorder.add_targets(['p/b'], {'rule': '#p:b', 'variant': None})
+        event_spawn = self.recorder.wrap(spawn)
+        for args in (['gcc', '-o', 'p/a.o', '-c', 'p/a.c'],
+                     ['ar', 'rc', 'p/liba.a', 'p/a.o'],
+                     ['gcc', '-o', '"p/b"', 'p/a.o', 'p/liba.a'],
+                     ['gcc', '-c', 'p/c.c']):
+            event_spawn('sh', None, args[0], args, {})
+        self.assertEqual([('#p:a', None), ('#p:a', None), ('#p:b', None),
+                          ('#a:a', 'opt')],
+                         [(event['rule'], event['variant'])
+                          for event in self.writer.events])
+
+    def test_record(self):
+        env = {ACTION_RECORDER: self.recorder}
+        with record(env, 'nm') as event:
+            event['exit_status'] = 2
+        with self.assertRaises(OSError):
+            with record(env, 'test'):
+                raise OSError('no such test')
+        self.assertEqual([('nm', 2), ('test', -1)],
+                         [(event['tool'], event['exit_status'])
+                          for event in self.writer.events])
+        self.assertTrue(all(event['end'] is not None
+                            for event in self.writer.events))
+
+    def test_record_without_recorder(self):
+        with record({}, 'nm') as event:
+            event['exit_status'] = 0
+        self.assertEqual([], self.writer.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
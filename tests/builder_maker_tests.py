@@ -0,0 +1,479 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from scons_package import builder_maker
+from scons_package.builder_maker_registry import BuilderMakerRegistry
+from scons_package.label import LabelOfFile, LabelOfRule, PackageName
+from scons_package.remote_exec import find_executable
+from scons_package.rule import Rule
+
+
+def make_rule(name, depends=()):
+    return Rule(LabelOfRule.make_label(name),
+                [],
+                LabelOfRule.make_label_list(depends),
+                [LabelOfFile.make_label(name)])
+
+
+class TestSearchPaths(unittest.TestCase):
+
+    def setUp(self):
+        self.bmreg = BuilderMakerRegistry()
+        self.key = builder_maker.EXPORT_INCLUDES
+
+    def add_rule(self, name, depends=(), paths=()):
+        rule = make_rule(name, depends)
+        self.bmreg.add_rule(rule)
+        if paths:
+            self.bmreg.set_attr(rule, self.key, tuple(paths))
+        return rule.name
+
+    def get_paths(self, label):
+        return builder_maker.get_search_paths(label, self.bmreg, self.key)
+
+    def test_transitive_paths(self):
+        self.add_rule('#a:a', paths=['#a/include'])
+        self.add_rule('#b:b', ['#a:a'], paths=['#b/include', '#a/include'])
+        self.add_rule('#c:c', paths=['#c/include'])
+        label = self.add_rule('#d:d', ['#b:b', '#c:c'])
+        self.assertEqual(('#b/include', '#a/include', '#c/include'),
+                         self.get_paths(label))
+        self.assertEqual(('#c/include',),
+                         self.get_paths(LabelOfRule.make_label('#c:c')))
+
+    def test_shared_paths(self):
+        self.add_rule('#a:a', paths=['#a/include'])
+        label1 = self.add_rule('#b:b', ['#a:a'])
+        label2 = self.add_rule('#c:c', ['#a:a'])
+        self.assertIs(self.get_paths(label1), self.get_paths(label2))
+
+    def test_remove_package(self):
+        self.add_rule('#a:a', paths=['#a/include'])
+        label = self.add_rule('#b:b', ['#a:a'])
+        self.assertEqual(('#a/include',), self.get_paths(label))
+        self.bmreg.remove_package(PackageName('a'))
+        self.add_rule('#a:a', paths=['#a/inc'])
+        self.assertEqual(('#a/inc',), self.get_paths(label))
+
+
+class TestLinkLibraries(unittest.TestCase):
+
+    def setUp(self):
+        self.bmreg = BuilderMakerRegistry()
+
+    def add_rule(self, name, builder_type, depends=()):
+        rule = make_rule(name, depends)
+        self.bmreg.add_rule(rule)
+        self.bmreg.set_attr(rule, builder_maker.BUILDER_TYPE, builder_type)
+        return rule.name
+
+    def get_names(self, label):
+        return [str(dep)
+                for dep in builder_maker.get_link_libraries(label, self.bmreg)]
+
+    def test_link_order(self):
+        self.add_rule('#base:base', builder_maker.STATIC_LIBRARY)
+        self.add_rule('#gen:gen', builder_maker.GENRULE)
+        self.add_rule('#util:util', builder_maker.STATIC_LIBRARY,
+                      ['#base:base', '#gen:gen'])
+        self.add_rule('#net:net', builder_maker.STATIC_LIBRARY,
+                      ['#base:base'])
+        label = self.add_rule('#app:app', builder_maker.PROGRAM,
+                              ['#util:util', '#net:net'])
+        names = self.get_names(label)
+        self.assertEqual(['#base:base', '#net:net', '#util:util'],
+                         sorted(names))
+        self.assertLess(names.index('#util:util'), names.index('#base:base'))
+        self.assertLess(names.index('#net:net'), names.index('#base:base'))
+
+    def test_long_chain(self):
+        self.add_rule('#p:r0', builder_maker.STATIC_LIBRARY)
+        for i in range(1, 3000):
+            self.add_rule('#p:r%d' % i, builder_maker.STATIC_LIBRARY,
+                          ['#p:r%d' % (i - 1)])
+        label = self.add_rule('#p:app', builder_maker.PROGRAM, ['#p:r2999'])
+        names = self.get_names(label)
+        self.assertEqual(3000, len(names))
+        self.assertEqual('#p:r2999', names[0])
+        self.assertEqual('#p:r0', names[-1])
+
+
+class TestSourceFiles(unittest.TestCase):
+
+    def test_get_source_files(self):
+        bmreg = BuilderMakerRegistry()
+        gen = Rule(LabelOfRule.make_label('#a:gen'),
+                   LabelOfFile.make_label_list(['#a:gen.py']),
+                   [],
+                   LabelOfFile.make_label_list(['#a:gen.cc']))
+        lib = Rule(LabelOfRule.make_label('#a:lib'),
+                   LabelOfFile.make_label_list(['#a:lib.cc', '#a:gen.cc']),
+                   [gen.name],
+                   [LabelOfFile.make_label('#a:lib')])
+        bmreg.add_rule(gen)
+        bmreg.add_rule(lib)
+        bmreg.set_attr(lib, builder_maker.HDRS,
+                       LabelOfFile.make_label_list(['#a:lib.h']))
+        bmreg.set_attr(lib, builder_maker.PCH,
+                       LabelOfFile.make_label('#a:pch.h'))
+        self.assertEqual(['a/gen.py', 'a/lib.cc', 'a/lib.h', 'a/pch.h'],
+                         builder_maker.get_source_files(bmreg))
+
+
+class TestSharedLibraries(unittest.TestCase):
+
+    class Env(object):
+
+        def Literal(self, string):
+            return string
+
+    def setUp(self):
+        self.bmreg = BuilderMakerRegistry()
+
+    def add_rule(self, name, builder_type, depends=()):
+        rule = make_rule(name, depends)
+        self.bmreg.add_rule(rule)
+        self.bmreg.set_attr(rule, builder_maker.BUILDER_TYPE, builder_type)
+        return rule
+
+    def test_builder_type(self):
+        lib = self.add_rule('#a:lib', builder_maker.STATIC_LIBRARY)
+        app = self.add_rule('#a:app', builder_maker.PROGRAM, ['#a:lib'])
+        self.bmreg.shared_variants.add('dbg')
+        self.assertEqual(builder_maker.STATIC_LIBRARY,
+                         builder_maker.get_builder_type(lib, self.bmreg,
+                                                        'opt'))
+        self.assertEqual(builder_maker.SHARED_LIBRARY,
+                         builder_maker.get_builder_type(lib, self.bmreg,
+                                                        'dbg'))
+        self.assertEqual(builder_maker.PROGRAM,
+                         builder_maker.get_builder_type(app, self.bmreg,
+                                                        'dbg'))
+
+    def test_link_shared_libraries(self):
+        self.add_rule('#a:base', builder_maker.SHARED_LIBRARY)
+        self.add_rule('#a:util', builder_maker.STATIC_LIBRARY, ['#a:base'])
+        app = self.add_rule('#a:app', builder_maker.PROGRAM, ['#a:util'])
+        self.assertEqual(['#a:util', '#a:base'],
+                         [str(label) for label in
+                          builder_maker.get_link_libraries(app.name,
+                                                           self.bmreg)])
+
+    def test_run_paths(self):
+        self.assertEqual(
+            ['\\$$ORIGIN', '\\$$ORIGIN/../base'],
+            builder_maker.get_run_paths(self.Env(), 'out/app/app',
+                                        ['out/app/libutil.so',
+                                         'out/base/libbase.so',
+                                         'out/base/libnet.so']))
+
+
+class TestPch(unittest.TestCase):
+
+    class Env(object):
+
+        class File(object):
+
+            def __init__(self, path):
+                self.path = path
+
+        def __init__(self):
+            self.targets = []
+
+        def Clone(self):
+            return TestPch.Env()
+
+        def Command(self, target, source, action):
+            self.targets.append(target)
+            return [target]
+
+    def setUp(self):
+        self.bmreg = BuilderMakerRegistry()
+
+    def add_rule(self, name, srcs, depends=(), pch='common.h'):
+        package = name.split(':')[0]
+        rule = Rule(LabelOfRule.make_label(name),
+                    [LabelOfFile.make_label('%s:%s' % (package, src))
+                     for src in srcs],
+                    LabelOfRule.make_label_list(depends),
+                    [LabelOfFile.make_label(name)])
+        self.bmreg.add_rule(rule)
+        if pch is not None:
+            self.bmreg.set_attr(rule, builder_maker.PCH,
+                                LabelOfFile.make_label('%s:%s' %
+                                                       (package, pch)))
+        return rule
+
+    def make_pch(self, rule, env, variant=None, shared=False):
+        return builder_maker._make_pch(rule, self.bmreg, env, variant,
+                                       shared)
+
+    def test_share_pch(self):
+        env = self.Env()
+        pch1 = self.make_pch(self.add_rule('#a:x', ['x.cc']), env)
+        pch2 = self.make_pch(self.add_rule('#a:y', ['y.cc']), env)
+        self.assertIs(pch1, pch2)
+        self.assertEqual(['a/.pch/c++/common.h.gch'], env.targets)
+        self.assertEqual('a/.pch/c++/common.h', pch1[0])
+        self.assertEqual(None,
+                         self.make_pch(self.add_rule('#a:z', ['z.cc'],
+                                                     pch=None), env))
+
+    def test_separate_pch(self):
+        env1 = self.Env()
+        env2 = self.Env()
+        cxx_rule = self.add_rule('#a:x', ['x.cc'])
+        c_rule = self.add_rule('#a:y', ['y.c'])
+        paths = set(self.make_pch(rule, env, variant, shared)[0]
+                    for rule in (cxx_rule, c_rule)
+                    for env in (env1, env2)
+                    for variant in (None, 'opt')
+                    for shared in (False, True))
+        self.assertEqual(16, len(self.bmreg.pchs))
+        # Variants are built in separate directories
+        self.assertEqual(set(['a/.pch/c/common.h',
+                              'a/.pch/c-1/common.h',
+                              'a/.pch/c-shared/common.h',
+                              'a/.pch/c-shared-1/common.h',
+                              'a/.pch/c++/common.h',
+                              'a/.pch/c++-1/common.h',
+                              'a/.pch/c++-shared/common.h',
+                              'a/.pch/c++-shared-1/common.h']), paths)
+
+    def test_key(self):
+        env = self.Env()
+        rule = self.add_rule('#a:x', ['x.cc'])
+        key = (id(env), 'opt', LabelOfFile.make_label('#a:common.h'), 'c++',
+               True)
+        self.assertEqual(0, builder_maker.get_pch_index(self.bmreg.pchs,
+                                                        key))
+        pch = self.make_pch(rule, env, 'opt', True)
+        self.assertIs(pch, self.bmreg.get_pch(key))
+        # Another environment of the header
+        self.assertEqual(1, builder_maker.get_pch_index(
+            self.bmreg.pchs, (id(self.Env()),) + key[1:]))
+        self.assertEqual(0, builder_maker.get_pch_index(
+            self.bmreg.pchs, key[:3] + ('c', True)))
+
+    def test_export_env(self):
+        env = self.Env()
+        self.add_rule('#a:a', ['a.cc'], pch=None)
+        self.bmreg.set_attr(self.bmreg.rules[LabelOfRule.make_label('#a:a')],
+                            builder_maker.EXPORT_ENV, lambda env: None)
+        rule1 = self.add_rule('#b:x', ['x.cc'], ['#a:a'])
+        rule2 = self.add_rule('#b:y', ['y.cc'], ['#a:a'])
+        rule3 = self.add_rule('#b:z', ['z.cc'])
+        env1 = builder_maker.import_export_env(rule1, self.bmreg, env)
+        env2 = builder_maker.import_export_env(rule2, self.bmreg, env)
+        self.assertIsNot(env, env1)
+        self.assertIs(env1, env2)
+        self.assertIs(env, builder_maker.import_export_env(rule3, self.bmreg,
+                                                           env))
+        self.assertIs(self.make_pch(rule1, env1), self.make_pch(rule2, env2))
+        self.assertEqual('b/.pch/c++-1/common.h',
+                         self.make_pch(rule3, env)[0])
+
+
+class TestArchive(unittest.TestCase):
+
+    class Env(object):
+
+        def __init__(self, **variables):
+            self.variables = variables
+
+        def subst(self, string):
+            return self.variables[string[1:]]
+
+    class Node(object):
+
+        def __init__(self, path):
+            self.path = path
+
+    def test_get_arflags(self):
+        thin = builder_maker.THIN_ARCHIVE
+        incremental = builder_maker.INCREMENTAL_ARCHIVE
+        for arflags, archive, expect in (('rc', thin, 'rcT'),
+                                         ('rcT', thin, 'rcT'),
+                                         ('rcD', thin, 'rcDT'),
+                                         ('rc', incremental, 'rcuU'),
+                                         ('rcu', incremental, 'rcuU'),
+                                         ('rcD', incremental, 'rcuU'),
+                                         ('rcTD', incremental, 'rcTuU')):
+            self.assertEqual(expect, builder_maker.get_arflags(
+                self.Env(ARFLAGS=arflags), archive))
+
+    @unittest.skipUnless(find_executable('ar',
+                                         os.environ.get('PATH', os.defpath)),
+                         'requires ar')
+    def test_prune_archive(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for name in ('a.o', 'b.o', 'c.o'):
+                paths.append(os.path.join(tmpdir, name))
+                with open(paths[-1], 'w') as obj_file:
+                    obj_file.write(name)
+            archive = os.path.join(tmpdir, 'liba.a')
+            env = self.Env(AR='ar')
+            target = [self.Node(archive)]
+            source = [self.Node(paths[0]), self.Node(paths[2])]
+            self.assertEqual(0, builder_maker._prune_archive(target, source,
+                                                             env))
+            subprocess.check_call(['ar', 'rc', archive] + paths)
+            self.assertEqual(0, builder_maker._prune_archive(target, source,
+                                                             env))
+            members = subprocess.check_output(['ar', 't', archive])
+            self.assertEqual(['a.o', 'c.o'], members.decode('utf-8').split())
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestInterface(unittest.TestCase):
+
+    def test_get_exported_symbols(self):
+        nm_output = ('liba.a[a.o]:\n'
+                     '_Z1av T 0 6\n'
+                     'counter B 0 4\n'
+                     '\n'
+                     'liba.a[b.o]:\n'
+                     '_Z1bv T 0 6\n'
+                     '_Z1av T 10 6\n')
+        self.assertEqual(['_Z1av T', '_Z1bv T', 'counter B'],
+                         builder_maker.get_exported_symbols(nm_output))
+
+
+def can_build():
+    if not find_executable('cc', os.environ.get('PATH', os.defpath)):
+        return False
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['scons', '--version'],
+                                   stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(can_build(), 'requires scons and a C compiler')
+class TestThinArchiveBuild(unittest.TestCase):
+
+    SCONSTRUCT = '''
+import sys
+sys.path.insert(0, %r)
+import scons_package as sp
+sp.default_environment(Environment())
+if ARGUMENTS.get('remote'):
+    sp.remote_execution(root=%r, jobs=1)
+sp.load_packages()
+sp.make_builders()
+'''
+
+    SCONSCRIPT = '''
+import scons_package as sp
+sp.library('foo', ['foo.c'], archive='thin')
+sp.program('app', ['app.c'], deps=[':foo'])
+'''
+
+    def setUp(self):
+        self.topdir = tempfile.mkdtemp()
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        rexec_root = os.path.join(self.topdir, '.rexec')
+        sources = {'SConstruct': self.SCONSTRUCT % (tests_dir, rexec_root),
+                   'p/SConscript': self.SCONSCRIPT,
+                   'p/app.c': 'int foo(void);\n'
+                              'int main(void) { return foo(); }\n'}
+        os.mkdir(os.path.join(self.topdir, 'p'))
+        for path, contents in sources.items():
+            self.write(path, contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.topdir)
+
+    def write(self, path, contents):
+        with open(os.path.join(self.topdir, path), 'w') as src_file:
+            src_file.write(contents)
+
+    def build_and_run(self, value, *args):
+        # Values have the same number of digits so that the sizes of the
+        # members stay the same
+        self.write('p/foo.c', 'int foo(void) { return %d; }\n' % value)
+        proc = subprocess.Popen(['scons', '-Q', '.'] + list(args),
+                                cwd=self.topdir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        self.assertEqual(0, proc.returncode, output)
+        app = os.path.join(self.topdir, 'p/app')
+        self.assertEqual(value, subprocess.call([app]), output)
+
+    def test_relink(self):
+        for value in (1, 2, 3):
+            self.build_and_run(value)
+
+    def test_relink_remote(self):
+        for value in (1, 2, 1):
+            self.build_and_run(value, 'remote=1')
+
+
+@unittest.skipUnless(can_build(), 'requires scons and a C compiler')
+class TestSharedSourceBuild(unittest.TestCase):
+
+    SCONSTRUCT = '''
+import sys
+sys.path.insert(0, %r)
+import scons_package as sp
+sp.default_environment(Environment())
+sp.stream_build_events(path='events.jsonl')
+sp.load_packages()
+sp.make_builders()
+'''
+
+    SCONSCRIPT = '''
+import scons_package as sp
+sp.library('foo', ['foo.c'])
+sp.program('app', ['app.c'], deps=[':foo'])
+sp.test('app_test', ['app.c'], deps=[':foo'])
+'''
+
+    def setUp(self):
+        self.topdir = tempfile.mkdtemp()
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        sources = {'SConstruct': self.SCONSTRUCT % tests_dir,
+                   'p/SConscript': self.SCONSCRIPT,
+                   'p/foo.c': 'int foo(void) { return 0; }\n',
+                   'p/app.c': 'int foo(void);\n'
+                              'int main(void) { return foo(); }\n'}
+        os.mkdir(os.path.join(self.topdir, 'p'))
+        for path, contents in sources.items():
+            with open(os.path.join(self.topdir, path), 'w') as src_file:
+                src_file.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.topdir)
+
+    def test_shared_object(self):
+        proc = subprocess.Popen(['scons', '-Q', '.', 'test'],
+                                cwd=self.topdir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        self.assertEqual(0, proc.returncode, output)
+        self.assertNotIn('Two different environments', output)
+        with open(os.path.join(self.topdir, 'events.jsonl')) as events:
+            events = [json.loads(line) for line in events]
+        # Compiles and links; the object of app.c is compiled once for
+        # either rule
+        rules = [event['rule'] for event in events
+                 if event['tool'] not in ('ar', 'ranlib', 'nm', 'app_test')]
+        self.assertEqual(4, len(rules))
+        self.assertEqual(['#p:app', '#p:app_test', '#p:foo'],
+                         sorted(set(rules)))
+        self.assertEqual(['#p:foo'], [event['rule'] for event in events
+                                      if event['tool'] == 'ar'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from scons_package.daemon import *
+
+
+class TestWatchers(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, '.git'))
+        os.mkdir(os.path.join(self.root, 'pkg'))
+        self.touch('pkg/a.c')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, path):
+        return os.path.join(self.root, path)
+
+    def touch(self, path, contents=''):
+        with open(self.path(path), 'a') as file_obj:
+            file_obj.write(contents)
+
+    def check_watcher(self, watcher):
+        try:
+            self.assertEqual(set(), watcher.wait(0))
+            self.touch('.git/index', 'x')
+            self.touch('pkg/tmp', 'x')
+            os.remove(self.path('pkg/tmp'))
+            self.touch('pkg/a.c', 'x')
+            self.assertEqual(set([self.path('pkg/a.c')]), watcher.wait(1))
+            os.mkdir(self.path('pkg/sub'))
+            watcher.wait(1)
+            self.touch('pkg/sub/SConscript')
+            self.assertIn(self.path('pkg/sub/SConscript'), watcher.wait(1))
+        finally:
+            watcher.close()
+
+    def test_polling_watcher(self):
+        self.check_watcher(PollingWatcher(self.root, interval=0.01))
+
+    def test_make_watcher(self):
+        self.check_watcher(make_watcher(self.root))
+
+
+class TestBuildDaemon(unittest.TestCase):
+
+    def test_is_sconscript(self):
+        self.assertTrue(is_sconscript('a/b/SConscript'))
+        self.assertTrue(is_sconscript('SConstruct'))
+        self.assertFalse(is_sconscript('a/b/SConscript.c'))
+
+    def test_manifest(self):
+        daemon = BuildDaemon('/src')
+        self.assertTrue(daemon.is_ignored('/src/.sconsign.dblite'))
+        self.assertFalse(daemon.is_ignored('/src/a/a.o'))
+        self.assertFalse(daemon.is_sconscript('/src/a/BUILD'))
+        daemon.set_manifest({'sconscripts': ['/src/SConstruct',
+                                             '/src/a/BUILD'],
+                             'build_roots': ['/src/out'],
+                             'targets': ['/src/a/a.o']})
+        self.assertTrue(daemon.is_ignored('/src/a/a.o'))
+        self.assertTrue(daemon.is_ignored('/src/out/a/a.o'))
+        self.assertFalse(daemon.is_ignored('/src/a/a.c'))
+        self.assertFalse(daemon.is_ignored('/src/outside.c'))
+        # New packages use the same build file name
+        self.assertTrue(daemon.is_sconscript('/src/b/BUILD'))
+        self.assertTrue(daemon.is_sconscript('/src/b/SConscript'))
+        self.assertFalse(daemon.is_sconscript('/src/b/b.c'))
+
+    def test_is_build_failed(self):
+        self.assertFalse(is_build_failed("scons: `a' is up to date.\n"))
+        self.assertTrue(is_build_failed('scons: *** [a.o] Error 1\n'))
+
+    def test_check_target(self):
+        check_target('p/a.o')
+        for target in ('', 'p\nshell touch x', 'p\rx', 'p\x7f', None):
+            self.assertRaises(ValueError, check_target, target)
+
+    def test_invalid_request(self):
+        # Targets are checked before SCons is run
+        daemon = BuildDaemon('/src', scons='/nonexistent/scons')
+        self.assertRaises(ValueError, daemon.build, ['p\nshell touch x'])
+        self.assertRaises(ValueError, daemon.serve_forever, ('localhost', 0))
+        root = tempfile.mkdtemp()
+        try:
+            os.chmod(root, 0o755)
+            self.assertRaises(ValueError, daemon.serve_forever,
+                              os.path.join(root, 'daemon.sock'))
+        finally:
+            shutil.rmtree(root)
+
+
+def can_build():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['scons', '--version'],
+                                   stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(can_build(), 'requires scons')
+class TestBuildDaemonBuild(unittest.TestCase):
+
+    SCONSTRUCT = '''
+import sys
+sys.path.insert(0, %r)
+import scons_package as sp
+sp.default_environment(Environment())
+sp.load_packages(build_file='BUILD')
+sp.make_builders()
+'''
+
+    BUILD = '''
+import scons_package as sp
+sp.genrule('gen', ['out.txt'], 'cp $SOURCES $TARGET', srcs=['in.txt'])
+'''
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        os.mkdir(os.path.join(self.root, 'p'))
+        for path, contents in (('SConstruct', self.SCONSTRUCT % tests_dir),
+                               ('p/BUILD', self.BUILD),
+                               ('p/in.txt', 'x\n')):
+            with open(os.path.join(self.root, path), 'w') as src_file:
+                src_file.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_ignore_build(self):
+        daemon = BuildDaemon(self.root, ['-Q'])
+        daemon.start()
+        watcher = PollingWatcher(daemon.root, SKIP_DIRS, 0.01)
+        try:
+            self.assertEqual(set([os.path.join(self.root, 'SConstruct'),
+                                  os.path.join(self.root, 'p/BUILD')]),
+                             daemon.sconscripts)
+            ok, output = daemon.build(['p'])
+            self.assertTrue(ok, output)
+            # Outputs and signatures written by the build are ignored
+            changed = watcher.poll()
+            self.assertIn(os.path.join(self.root, 'p/out.txt'), changed)
+            self.assertEqual([], [path for path in changed
+                                  if not daemon.is_ignored(path)])
+        finally:
+            watcher.close()
+            daemon.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
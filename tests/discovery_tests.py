@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from scons_package.discovery import PackageDiscovery, discover_packages
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path in ('SConscript',
+                     'a/SConscript',
+                     'a/b/SConscript',
+                     'a/c/x.c',
+                     'build/a/SConscript',
+                     '.git/SConscript',
+                     'z/SConscript'):
+            self.touch(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def touch(self, path):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def test_discover_packages(self):
+        self.assertEqual(['.', 'a', 'a/b', 'build/a', 'z'],
+                         discover_packages(self.root))
+        self.assertEqual(['.', 'a', 'a/b', 'z'],
+                         discover_packages(self.root, skip_dirs=['build']))
+        self.assertEqual(['.', 'a', 'z'],
+                         discover_packages(self.root,
+                                           skip_dirs=['build', 'a/b']))
+
+    def test_cache(self):
+        cache_path = os.path.join(self.root, '.scons_package/packages.json')
+        self.assertEqual(['.', 'a', 'a/b', 'z'],
+                         discover_packages(self.root, skip_dirs=['build'],
+                                           cache_path=cache_path))
+        self.assertTrue(os.path.exists(cache_path))
+
+        # Listings are reused while directory mtimes are unchanged
+        discovery = PackageDiscovery(self.root, 'SConscript', ['build'])
+        discovery.load_cache(cache_path)
+        discovery.listings['a'].has_build_file = False
+        self.assertEqual(['.', 'a/b', 'z'], discovery.discover())
+
+        # Adding a package changes the mtime of its parent
+        self.touch('a/c/d/SConscript')
+        self.assertEqual(['.', 'a', 'a/b', 'a/c/d', 'z'],
+                         discover_packages(self.root, skip_dirs=['build'],
+                                           cache_path=cache_path))
+
+        # Cache of other skipped directories is not used
+        self.assertEqual(['.', 'a', 'a/b', 'a/c/d', 'build/a', 'z'],
+                         discover_packages(self.root, cache_path=cache_path))
+
+
+
+def can_build():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['scons', '--version'],
+                                   stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(can_build(), 'requires scons')
+class TestLoadPackages(unittest.TestCase):
+
+    SCONSTRUCT = '''
+import sys
+sys.path.insert(0, %r)
+import scons_package as sp
+sp.default_environment(Environment())
+sp.load_packages(build_root='out')
+sp.make_builders(sconscript='SConscript', build_root='out')
+'''
+
+    # The top-level build file is copied to the build root
+    SCONSCRIPT = '''
+import scons_package as sp
+Import('variant')
+sp.make_variant_builders(variant)
+'''
+
+    BUILD = '''
+import scons_package as sp
+sp.genrule('gen', ['out.txt'], 'cp $SOURCES $TARGET', srcs=['in.txt'])
+'''
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        for path, contents in (('SConstruct', self.SCONSTRUCT % tests_dir),
+                               ('SConscript', self.SCONSCRIPT),
+                               ('p/SConscript', self.BUILD),
+                               ('p/in.txt', 'x\n')):
+            path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as src_file:
+                src_file.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_skip_build_root(self):
+        for _ in range(2):
+            # Run from a package directory
+            proc = subprocess.Popen(['scons', '-Q', '-u', '.'],
+                                    cwd=os.path.join(self.root, 'p'),
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            output = proc.communicate()[0].decode('utf-8', 'replace')
+            self.assertEqual(0, proc.returncode, output)
+        self.assertTrue(os.path.exists(os.path.join(self.root,
+                                                    'out/p/out.txt')))
+        self.assertTrue(os.path.exists(os.path.join(self.root,
+                                                    'out/SConscript')))
+        cache_path = os.path.join(self.root, '.scons_package/packages.json')
+        with open(cache_path) as cache_file:
+            self.assertEqual(['p'], json.load(cache_file)['dirs']['.'][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+
+from scons_package.builder_maker_registry import BuilderMakerRegistry
+from scons_package.exec_build_makers import BuilderMakerOrder
+from scons_package.label import LabelOfFile, LabelOfRule, PackageName
+from scons_package.package_registry import PackageEnvironmentRegistry
+from scons_package.package_registry import PackageVariantRegistry
+from scons_package.rule import Rule
+
+
+def make_rule(name, depends=(), inputs=(), outputs=None):
+    if outputs is None:
+        outputs = [name]
+    return Rule(LabelOfRule.make_label(name),
+                LabelOfFile.make_label_list(inputs),
+                LabelOfRule.make_label_list(depends),
+                LabelOfFile.make_label_list(outputs))
+
+
+class TestBuilderMakerOrder(unittest.TestCase):
+
+    def setUp(self):
+        self.bmreg = BuilderMakerRegistry()
+        self.build_order = BuilderMakerOrder(self.bmreg,
+                                             PackageVariantRegistry(),
+                                             PackageEnvironmentRegistry())
+
+    def get_names(self):
+        return [str(rule.name) for rule in self.build_order.get_rules(None)]
+
+    def test_update_package(self):
+        self.bmreg.add_rule(make_rule('#b:b'))
+        self.bmreg.add_rule(make_rule('#a:a', ['#b:b']))
+        self.bmreg.add_rule(make_rule('#c:c', ['#a:a']))
+        self.build_order.sort_by(variants=None)
+        self.assertEqual(['#b:b', '#a:a', '#c:c'], self.get_names())
+
+        # Reverse the dependency between a and b
+        def evaluate_a():
+            self.bmreg.add_rule(make_rule('#a:a'))
+
+        def evaluate_b():
+            self.bmreg.add_rule(make_rule('#b:b', ['#a:a']))
+        self.build_order.update_package(PackageName('a'), evaluate_a)
+        self.build_order.update_package(PackageName('b'), evaluate_b)
+        names = self.get_names()
+        self.assertLess(names.index('#a:a'), names.index('#b:b'))
+        self.assertLess(names.index('#a:a'), names.index('#c:c'))
+
+        # Add a rule to a package
+        def evaluate_b2():
+            self.bmreg.add_rule(make_rule('#b:b', ['#a:a']))
+            self.bmreg.add_rule(make_rule('#b:b2', ['#b:b']))
+        self.build_order.update_package(PackageName('b'), evaluate_b2)
+        names = self.get_names()
+        self.assertEqual(4, len(names))
+        self.assertLess(names.index('#b:b'), names.index('#b:b2'))
+
+    def test_update_package_missing_dependency(self):
+        self.bmreg.add_rule(make_rule('#a:a'))
+        self.bmreg.add_rule(make_rule('#c:c', ['#a:a']))
+        self.build_order.sort_by(variants=None)
+        self.assertRaises(RuntimeError, self.build_order.update_package,
+                          PackageName('a'), lambda: None)
+
+    def test_update_package_removed_dependency(self):
+        self.bmreg.add_rule(make_rule('#a:x'))
+        self.bmreg.add_rule(make_rule('#a:y', ['#a:x']))
+        self.build_order.sort_by(variants=None)
+
+        def evaluate_a():
+            self.bmreg.add_rule(make_rule('#a:y', ['#a:x']))
+        self.assertRaises(RuntimeError, self.build_order.update_package,
+                          PackageName('a'), evaluate_a)
+        # The order is not modified
+        self.assertEqual(['#a:x', '#a:y'],
+                         [str(label) for label in self.build_order.order])
+
+    def test_failed_update_package(self):
+        pvreg = self.build_order.pvreg
+        self.bmreg.add_rule(make_rule('#a:a'))
+        self.bmreg.add_rule(make_rule('#b:b', ['#a:a']))
+        self.bmreg.add_rule(make_rule('#c:c', ['#b:b']))
+        self.bmreg.set_attr(LabelOfRule.make_label('#a:a'), 'variant', 'x')
+        pvreg.add(PackageName('a'), 'y', PackageName('a'))
+        self.build_order.sort_by(variants=None)
+
+        def evaluate_missing():
+            pvreg.add(PackageName('a'), 'z', PackageName('a'))
+            self.bmreg.add_rule(make_rule('#a:a'))
+            self.bmreg.add_rule(make_rule('#a:a2', ['#a:missing']))
+
+        def evaluate_cycle():
+            self.bmreg.add_rule(make_rule('#a:a', ['#b:b']))
+            self.bmreg.add_rule(make_rule('#a:a2', ['#c:c']))
+
+        def evaluate_error():
+            self.bmreg.add_rule(make_rule('#a:a2'))
+            raise SyntaxError('half-finished edit')
+
+        for evaluate, error in ((evaluate_missing, RuntimeError),
+                                (evaluate_cycle, ValueError),
+                                (evaluate_error, SyntaxError)):
+            self.assertRaises(error, self.build_order.update_package,
+                              PackageName('a'), evaluate)
+            # The old graph is still usable
+            self.assertEqual(['#a:a', '#b:b', '#c:c'],
+                             [str(rule.name) for rule in
+                              self.build_order.get_sorted_rules()])
+            self.assertEqual(['#a:a', '#b:b', '#c:c'], self.get_names())
+            self.assertEqual('x', self.bmreg.get_attr(
+                LabelOfRule.make_label('#a:a'), 'variant'))
+            self.assertEqual('y', pvreg.search(PackageName('a')))
+
+        # And it is updated later
+        def evaluate_a():
+            self.bmreg.add_rule(make_rule('#a:a'))
+            self.bmreg.add_rule(make_rule('#a:a2', ['#c:c']))
+        self.build_order.update_package(PackageName('a'), evaluate_a)
+        self.assertEqual(['#a:a', '#b:b', '#c:c', '#a:a2'], self.get_names())
+        self.assertRaises(KeyError, pvreg.search, PackageName('a'))
+
+    def test_update_package_after_making_builders(self):
+        self.bmreg.add_rule(make_rule('#a:a'))
+        self.build_order.sort_by(variants=None)
+        self.build_order.made_builders = True
+        self.assertRaises(RuntimeError, self.build_order.update_package,
+                          PackageName('a'), lambda: None)
+
+    def test_sort_by_producers(self):
+        # A rule compiling a generated source comes after the generator
+        self.bmreg.add_rule(make_rule('#a:lib', inputs=['#a:gen.cc']))
+        self.bmreg.add_rule(make_rule('#a:gen', outputs=['#a:gen.cc',
+                                                         '#a:gen.h']))
+        self.build_order.sort_by(variants=None)
+        self.assertEqual(['#a:gen', '#a:lib'], self.get_names())
+        rules = self.bmreg.rules
+        self.assertEqual([LabelOfRule.make_label('#a:gen')],
+                         rules.get_depends(rules[LabelOfRule.make_label(
+                             '#a:lib')]))
+        # Producers are removed with their package
+        self.bmreg.remove_package(PackageName('a'))
+        self.assertEqual({}, rules.producers)
+
+
+if __name__ == '__main__':
+    unittest.main()
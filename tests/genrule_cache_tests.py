@@ -0,0 +1,79 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from scons_package.genrule_cache import GenruleCache, find_executable
+from scons_package.genrule_cache import get_tool
+
+
+class TestGenruleCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.cache = GenruleCache(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.cwd)
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.cwd, name)
+
+    def write(self, name, contents):
+        with open(self.path(name), 'w') as file_obj:
+            file_obj.write(contents)
+
+    def read(self, name):
+        with open(self.path(name)) as file_obj:
+            return file_obj.read()
+
+    def run_copy(self, variant):
+        # Copy in.txt to <variant>/out.txt and count the runs in log.txt
+        os.mkdir(self.path(variant))
+        command = 'cp %s %s && echo run >> %s' % (
+            self.path('in.txt'), self.path(variant + '/out.txt'),
+            self.path('log.txt'))
+        key_command = command.replace(self.path(variant), '<out>')
+        return self.cache.run(command, key_command,
+                              [('in.txt', self.path('in.txt'))],
+                              [('out.txt', self.path(variant + '/out.txt'))])
+
+    def test_run(self):
+        self.write('in.txt', 'hello')
+        self.assertEqual((0, False), self.run_copy('opt'))
+        # Another variant (or a clean build) reuses the output
+        self.assertEqual((0, True), self.run_copy('dbg'))
+        self.assertEqual('hello', self.read('dbg/out.txt'))
+        self.assertEqual('run\n', self.read('log.txt'))
+        # Changed input
+        self.write('in.txt', 'world')
+        self.assertEqual((0, False), self.run_copy('fast'))
+        self.assertEqual('world', self.read('fast/out.txt'))
+        self.assertEqual('run\nrun\n', self.read('log.txt'))
+
+    def test_failure(self):
+        command = 'false'
+        outputs = [('out.txt', self.path('out.txt'))]
+        self.assertNotEqual(0, self.cache.run(command, command, [],
+                                              outputs)[0])
+        self.assertNotEqual(0, self.cache.run(command, command, [],
+                                              outputs)[0])
+
+    def test_get_tool(self):
+        self.assertEqual(None, find_executable('no-such-tool', self.cwd))
+        self.write('tool', '')
+        os.chmod(self.path('tool'), 0o755)
+        self.assertEqual(self.path('tool'), find_executable('tool', self.cwd))
+        self.assertEqual(self.path('tool'),
+                         get_tool('tool --flag "a b"', self.cwd))
+        self.assertEqual(sys.executable,
+                         get_tool('%s -c pass' % sys.executable, ''))
+        self.assertEqual(None, get_tool('', self.cwd))
+        self.assertEqual(None, get_tool('"unterminated', self.cwd))
+
+
+if __name__ == '__main__':
+    unittest.main()
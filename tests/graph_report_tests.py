@@ -0,0 +1,120 @@
+import json
+import random
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from scons_package import graph_report
+from scons_package.label import LabelOfFile, LabelOfRule
+from scons_package.rule import Rule
+
+
+def make_rule(name, depends=()):
+    return Rule(LabelOfRule.make_label(name),
+                [],
+                LabelOfRule.make_label_list(depends),
+                [LabelOfFile.make_label(name)])
+
+
+def make_report():
+    # base <- util <- app1
+    #      <- net  <- app2
+    #              <- app1
+    return graph_report.make_report([
+        make_rule('#base:base'),
+        make_rule('#util:util', ['#base:base']),
+        make_rule('#net:net', ['#base:base']),
+        make_rule('#app:app1', ['#util:util', '#net:net']),
+        make_rule('#app:app2', ['#net:net']),
+        make_rule('#tool:tool'),
+    ])
+
+
+class TestGraphReport(unittest.TestCase):
+
+    def get_stats(self, report):
+        return dict((str(stat.label), stat) for stat in report.stats)
+
+    def test_stats(self):
+        stats = self.get_stats(make_report())
+        base = stats['#base:base']
+        self.assertEqual(0, base.depth)
+        self.assertEqual(2, base.fan_in)
+        self.assertEqual(0, base.fan_out)
+        self.assertEqual(4, base.dependents)
+        self.assertTrue(base.critical)
+        net = stats['#net:net']
+        self.assertEqual(1, net.depth)
+        self.assertEqual(2, net.fan_in)
+        self.assertEqual(2, net.dependents)
+        self.assertTrue(net.critical)
+        app1 = stats['#app:app1']
+        self.assertEqual(2, app1.depth)
+        self.assertEqual(2, app1.fan_out)
+        self.assertEqual(0, app1.dependents)
+        self.assertTrue(app1.critical)
+        self.assertTrue(stats['#app:app2'].critical)
+        self.assertFalse(stats['#tool:tool'].critical)
+
+    def test_critical_chain(self):
+        chain = [str(label) for label in make_report().critical_chain]
+        self.assertEqual(3, len(chain))
+        self.assertEqual('#app:app1', chain[0])
+        self.assertEqual('#base:base', chain[-1])
+
+    def test_ranked_stats(self):
+        ranked = make_report().get_ranked_stats()
+        self.assertEqual(['#base:base', '#net:net', '#util:util'],
+                         [str(stat.label) for stat in ranked[:3]])
+
+    def test_output(self):
+        report = make_report()
+        output = StringIO()
+        report.write_json(output)
+        report_json = json.loads(output.getvalue())
+        self.assertEqual(6, len(report_json['rules']))
+        self.assertEqual(3, len(report_json['critical_chain']))
+        output = StringIO()
+        report.write_summary(output, top=2)
+        self.assertIn('6 rules, 5 edges', output.getvalue())
+        self.assertIn('#base:base', output.getvalue())
+
+    def test_long_chain(self):
+        rules = [make_rule('#p:r0')]
+        for i in range(1, 2000):
+            rules.append(make_rule('#p:r%d' % i, ['#p:r%d' % (i - 1)]))
+        stats = graph_report.make_report(rules).stats
+        self.assertEqual(1999, stats[0].dependents)
+        self.assertEqual(1999, stats[-1].depth)
+        self.assertTrue(all(stat.critical for stat in stats))
+
+    def test_dependents(self):
+        # Compare with a graph search per rule; depends may repeat
+        random.seed(0)
+        depends = [[]]
+        for i in range(1, 300):
+            depends.append([random.randrange(max(0, i - 20), i)
+                            for _ in range(random.randrange(4))])
+        rules = [make_rule('#p:r%d' % i,
+                           ['#p:r%d' % j for j in depends[i]])
+                 for i in range(len(depends))]
+        dependents = [set() for _ in depends]
+        for i in range(len(depends) - 1, -1, -1):
+            for j in depends[i]:
+                dependents[j].update(dependents[i])
+                dependents[j].add(i)
+        stats = graph_report.make_report(rules).stats
+        self.assertEqual([len(labels) for labels in dependents],
+                         [stat.dependents for stat in stats])
+
+    def test_empty(self):
+        report = graph_report.make_report([])
+        self.assertEqual([], report.stats)
+        self.assertEqual([], report.critical_chain)
+
+
+if __name__ == '__main__':
+    unittest.main()
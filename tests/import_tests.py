@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import unittest
+
+
+CHECK_IMPORTS = '''
+import sys
+import scons_package
+from scons_package import daemon, discovery, exec_build_makers
+from scons_package import genrule_cache, graph_report, ninja_backend
+from scons_package import remote_exec
+from scons_package.label import LabelOfRule
+from scons_package.package_registry import PackageVariantRegistry
+from scons_package.rule import RuleRegistry
+LabelOfRule.make_label('#a/b:c')
+scons_package.package_variant('opt', 'a/b')
+assert scons_package.search_package_variant('a/b/c') == 'opt'
+sys.stdout.write(' '.join(name for name in sys.modules
+                          if name.split('.')[0] == 'SCons'))
+'''
+
+
+class TestImport(unittest.TestCase):
+
+    def test_import_without_scons(self):
+        # Run in a fresh interpreter, as this one may have imported SCons
+        output = subprocess.check_output(
+            [sys.executable, '-c', CHECK_IMPORTS],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(b'', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from scons_package.ninja_backend import NinjaWriter
+from scons_package.remote_exec import find_executable
+
+
+class TestNinjaWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.output = StringIO()
+        self.writer = NinjaWriter(self.output)
+
+    def test_escape(self):
+        self.assertEqual('a$$b', NinjaWriter.escape('a$b'))
+        self.assertEqual('#a$:b', NinjaWriter.escape_path('#a:b'))
+        self.assertEqual('a$ b$$', NinjaWriter.escape_path('a b$'))
+
+    def test_rule(self):
+        self.writer.rule('cc', (('command', 'cc -c $in -o $out'),
+                                ('deps', 'gcc')))
+        self.assertEqual('rule cc\n'
+                         '  command = cc -c $in -o $out\n'
+                         '  deps = gcc\n'
+                         '\n',
+                         self.output.getvalue())
+
+    def test_build(self):
+        self.writer.build(['a.o'], 'cc', ['a.c'], ['a.h.gch'],
+                          [('flags', '-DX=$Y')])
+        self.writer.build(['#a:a'], 'phony', ['liba.a'])
+        self.writer.default(['liba.a'])
+        self.assertEqual('build a.o: cc a.c | a.h.gch\n'
+                         '  flags = -DX=$$Y\n'
+                         'build #a$:a: phony liba.a\n'
+                         'default liba.a\n',
+                         self.output.getvalue())
+
+
+def can_build():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['scons', '--version'],
+                                   stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
+def parse_builds(text):
+    '''Return build statements of a build file by their first output.'''
+    builds = {}
+    build = None
+    for line in text.splitlines():
+        if line.startswith('build '):
+            outputs, rest = line[len('build '):].split(': ', 1)
+            fields = rest.split()
+            inputs, implicit = fields[1:], []
+            if '|' in inputs:
+                index = inputs.index('|')
+                inputs, implicit = inputs[:index], inputs[index + 1:]
+            build = {'rule': fields[0], 'inputs': inputs,
+                     'implicit': implicit}
+            builds[outputs.split()[0]] = build
+        elif line.startswith('  ') and build is not None:
+            key, _, value = line.strip().partition(' =')
+            build[key] = value.strip()
+        else:
+            build = None
+    return builds
+
+
+@unittest.skipUnless(can_build(), 'requires scons')
+class TestNinjaGenerator(unittest.TestCase):
+
+    SCONSTRUCT = '''
+import sys
+sys.path.insert(0, %r)
+import scons_package as sp
+sp.default_environment(Environment(CC='gcc', CXX='g++', CXXFLAGS=['-O2']))
+sp.default_variant('opt')
+sp.shared_libraries('dbg')
+sp.load_packages()
+sp.make_ninja(build_root='out', variants=['opt', 'dbg'])
+'''
+
+    SOURCES = {
+        'p/SConscript': (
+            'import scons_package as sp\n'
+            'sp.library("a", ["a.cc"], pch="common.h", archive="thin",\n'
+            '           export_env=lambda env: env.Append(\n'
+            '               CPPDEFINES=["USE_A"]))\n'
+            'sp.program("app", ["app.cc"], deps=[":a"])\n'),
+        'p/common.h': '#include <stdio.h>\n',
+        'p/a.cc': 'int a() { return 0; }\n',
+        'p/app.cc': 'int a();\nint main() { return a(); }\n',
+        'q/SConscript': (
+            'import scons_package as sp\n'
+            'sp.library("b", ["b.c"], variant="dbg")\n'
+            'sp.program("bp", ["bp.c"], deps=[":b"], variant="dbg")\n'),
+        'q/b.c': 'int b(void) { return 0; }\n',
+        'q/bp.c': 'int b(void);\nint main(void) { return b(); }\n',
+    }
+
+    def setUp(self):
+        self.topdir = tempfile.mkdtemp()
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        sources = dict(self.SOURCES)
+        # The build file is regenerated by the SConstruct that SCons read
+        sources['SConstruct.ninja'] = self.SCONSTRUCT % tests_dir
+        for dirname in ('p', 'q'):
+            os.mkdir(os.path.join(self.topdir, dirname))
+        for path, contents in sources.items():
+            with open(os.path.join(self.topdir, path), 'w') as src_file:
+                src_file.write(contents)
+        proc = subprocess.Popen(['scons', '-Q', '-f', 'SConstruct.ninja'],
+                                cwd=self.topdir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        self.assertEqual(0, proc.returncode, output)
+        with open(os.path.join(self.topdir, 'build.ninja')) as build_file:
+            self.builds = parse_builds(build_file.read())
+
+    def tearDown(self):
+        shutil.rmtree(self.topdir)
+
+    def test_compile(self):
+        gch = 'out/opt/p/.pch/c++/common.h.gch'
+        self.assertEqual({'rule': 'pch', 'inputs': ['p/common.h'],
+                          'implicit': [], 'tool': 'g++',
+                          'language': 'c++', 'flags': '-O2'},
+                         self.builds[gch])
+        self.assertEqual({'rule': 'cxx', 'inputs': ['p/a.cc'],
+                          'implicit': [gch], 'tool': 'g++',
+                          'flags': '-O2 -include out/opt/p/.pch/c++/common.h '
+                                   '-Winvalid-pch'},
+                         self.builds['out/opt/p/a.o'])
+        # export_env of a depend applies to the dependent only
+        self.assertEqual('-O2 -DUSE_A',
+                         self.builds['out/opt/p/app.o']['flags'])
+        # Objects of shared libraries
+        self.assertEqual({'rule': 'cc', 'inputs': ['q/b.c'], 'implicit': [],
+                          'tool': 'gcc', 'flags': '-fPIC'},
+                         self.builds['out/dbg/q/b.os'])
+
+    def test_archive(self):
+        self.assertEqual({'rule': 'ar', 'inputs': ['out/opt/p/a.o'],
+                          'implicit': [], 'tool': 'ar', 'arflags': 'rcT',
+                          'ranlib': 'ranlib'},
+                         self.builds['out/opt/p/liba.a'])
+
+    def test_link(self):
+        self.assertEqual({'rule': 'link',
+                          'inputs': ['out/opt/p/app.o', 'out/opt/p/liba.a'],
+                          'implicit': [], 'tool': 'g++', 'linkflags': '',
+                          'libs': ''},
+                         self.builds['out/opt/p/app'])
+        self.assertEqual('-shared -Wl,-soname=libb.so',
+                         self.builds['out/dbg/q/libb.so']['linkflags'])
+        build = self.builds['out/dbg/q/bp']
+        self.assertEqual(['out/dbg/q/libb.so'], build['implicit'])
+        self.assertEqual('out/dbg/q/libb.so', build['libs'])
+        self.assertEqual('-Wl,-rpath=\\$$ORIGIN', build['linkflags'])
+
+    def test_variants(self):
+        self.assertEqual(['out/opt/p/liba.a'], self.builds['#p$:a']['inputs'])
+        self.assertEqual(['out/dbg/q/bp'], self.builds['#q$:bp']['inputs'])
+        build = self.builds['build.ninja']
+        self.assertEqual('regen', build['rule'])
+        self.assertEqual(['SConstruct.ninja', 'p/SConscript', 'q/SConscript'],
+                         build['implicit'])
+
+    @unittest.skipUnless(
+        all(find_executable(name, os.environ.get('PATH', os.defpath))
+            for name in ('ninja', 'gcc', 'g++')),
+        'requires ninja and gcc')
+    def test_build(self):
+        for args in (['ninja'], ['out/opt/p/app'], ['out/dbg/q/bp']):
+            proc = subprocess.Popen(args,
+                                    cwd=self.topdir,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            output = proc.communicate()[0].decode('utf-8', 'replace')
+            self.assertEqual(0, proc.returncode, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 import unittest
 
 from scons_package.label import PackageName
-from scons_package.package_registry import PackageTrie
+from scons_package.package_registry import PackageAttributes, PackageTrie
 
 
 class TestPackageTrie(unittest.TestCase):
@@ -43,6 +43,50 @@ class TestPackageTrie(unittest.TestCase):
         self.assertEqual(b, trie.search(b))
         self.assertEqual(c, trie.search(c))
 
+    def test_package_trie_remove(self):
+        a = PackageName.make_package_name('a')
+        b = PackageName.make_package_name('a/b')
+        c = PackageName.make_package_name('a/b/c')
+
+        trie = PackageTrie()
+        trie.add(a)
+        trie.add(b)
+        trie.add(c)
+
+        trie.remove(b)
+        self.assertEqual(a, trie.search(b))
+        self.assertEqual(c, trie.search(c))
+        self.assertRaises(KeyError, trie.remove, b)
+
+        trie.remove(a)
+        self.assertEqual(None, trie.search(b))
+        self.assertEqual(c, trie.search(c))
+
+        trie.add(b)
+        self.assertEqual(b, trie.search(b))
+
+
+class TestPackageAttributes(unittest.TestCase):
+
+    def test_remove_owner(self):
+        a = PackageName.make_package_name('a')
+        b = PackageName.make_package_name('a/b')
+        c = PackageName.make_package_name('a/b/c')
+
+        attrs = PackageAttributes(str)
+        attrs.default = 'default'
+        attrs.add(a, 'a', owner=a)
+        attrs.add(b, 'b', owner=b)
+        attrs.add(c, 'c', owner=b)
+        self.assertEqual('c', attrs.search(c))
+
+        attrs.remove_owner(b)
+        self.assertEqual('a', attrs.search(c))
+        self.assertEqual('a', attrs.search(b))
+
+        attrs.add(b, 'b2', owner=b)
+        self.assertEqual('b2', attrs.search(c))
+
 
 if __name__ == '__main__':
     unittest.main()
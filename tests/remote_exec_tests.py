@@ -0,0 +1,145 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from scons_package.remote_exec import *
+
+
+# A fake tool copying its input to the -o output
+COPY_TOOL = '''
+import shutil, sys
+shutil.copy(sys.argv[3], sys.argv[2])
+'''
+
+# A fake linker copying the library of -lin to the -o output
+LINK_TOOL = '''
+import shutil, sys
+shutil.copy('libin.a', sys.argv[2])
+'''
+
+
+class TestRemoteExec(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cwd)
+        shutil.rmtree(self.root)
+
+    def write(self, path, contents):
+        with open(os.path.join(self.cwd, path), 'w') as file_obj:
+            file_obj.write(contents)
+
+    def read(self, path):
+        with open(os.path.join(self.cwd, path)) as file_obj:
+            return file_obj.read()
+
+    def test_unescape(self):
+        self.assertEqual('a.c', unescape('a.c'))
+        self.assertEqual('a.c', unescape('"a.c"'))
+        self.assertEqual('a b/$x"', unescape('"a b/\\$x\\""'))
+
+    def test_parse_depfile(self):
+        self.assertEqual(['a.c', 'a.h', 'b.h'],
+                         parse_depfile('a.o: a.c a.h \\\n b.h\n'))
+        self.assertEqual([], parse_depfile(''))
+
+    def test_make_action(self):
+        self.write('a.c', '')
+        action = make_action(['cc', '-o', 'a.o', '-c', 'a.c', 'missing.c'],
+                             self.cwd, {'PATH': ''})
+        self.assertEqual(['a.c'], action.inputs)
+        self.assertEqual(['a.o'], action.outputs)
+        self.assertEqual(None, make_action(['cc', 'a.c'], self.cwd, {}))
+
+    def test_make_link_action(self):
+        os.mkdir(os.path.join(self.cwd, 'lib'))
+        for path in ('a.o', 'cc', 'lib/liba.a', 'lib/libb.so', 'lib/libb.a',
+                     'lib/c.a'):
+            self.write(path, '')
+        os.chmod(os.path.join(self.cwd, 'cc'), 0o755)
+        args = ['cc', '-o', 'p', 'a.o', '-Llib', '-la', '-l', 'b', '-l:c.a',
+                '-lm']
+        action = make_action(args, self.cwd, {'PATH': self.cwd})
+        self.assertEqual(['a.o', 'lib/liba.a', 'lib/libb.so', 'lib/c.a',
+                          os.path.join(self.cwd, 'cc')], action.inputs)
+        action = make_action(['./cc', '-static', '-o', 'p', '-L', 'lib',
+                              '-lb'], self.cwd, {})
+        self.assertEqual(['lib/libb.a', './cc'], action.inputs)
+
+    def test_local_executor(self):
+        self.write('tool.py', COPY_TOOL)
+        self.write('in', 'hello')
+        action = make_action([sys.executable, 'tool.py', '-o', 'out', 'in'],
+                             self.cwd, {})
+        executor = LocalExecutor(self.root, 1)
+        try:
+            result = executor.execute(action)
+            self.assertEqual(0, result['exit_code'])
+            self.assertFalse(result['cached'])
+            self.assertEqual('hello', self.read('out'))
+
+            os.remove(os.path.join(self.cwd, 'out'))
+            result = executor.execute(action)
+            self.assertTrue(result['cached'])
+            self.assertEqual('hello', self.read('out'))
+
+            self.write('in', 'world')
+            result = executor.execute(action)
+            self.assertFalse(result['cached'])
+            self.assertEqual('world', self.read('out'))
+        finally:
+            executor.close()
+
+    def test_link_library(self):
+        # A changed library of -l is linked again
+        self.write('link.py', LINK_TOOL)
+        self.write('libin.a', 'hello')
+        args = [sys.executable, 'link.py', '-o', 'out', '-L.', '-lin']
+        executor = LocalExecutor(self.root, 1)
+        try:
+            action = make_action(args, self.cwd, {})
+            self.assertFalse(executor.execute(action)['cached'])
+            self.write('libin.a', 'world')
+            action = make_action(args, self.cwd, {})
+            self.assertFalse(executor.execute(action)['cached'])
+            self.assertEqual('world', self.read('out'))
+        finally:
+            executor.close()
+
+    @unittest.skipUnless(find_executable('ar',
+                                         os.environ.get('PATH', os.defpath)),
+                         'requires ar')
+    def test_thin_archive(self):
+        # A link depends on the members of a thin archive, which keeps the
+        # same contents when a member changes but keeps its size
+        os.mkdir(os.path.join(self.cwd, 'lib'))
+        self.write('a.o', 'hello')
+        self.write('b.a', 'not an archive')
+        environ = {'PATH': os.environ.get('PATH', os.defpath)}
+        subprocess.check_call(['ar', 'rcT', 'lib/liba.a', 'a.o'],
+                              cwd=self.cwd)
+        args = ['cc', '-o', 'p', 'b.a', '-Llib', '-la']
+        action = make_action(args, self.cwd, environ)
+        self.assertEqual(['b.a', 'lib/liba.a', 'a.o'], action.inputs[:3])
+        self.assertEqual([], get_thin_archive_members('b.a', self.cwd,
+                                                      environ))
+        self.assertEqual(None, make_action(args, self.cwd, {'PATH': ''}))
+
+    def test_serve_without_authkey(self):
+        self.assertRaises(ValueError, serve, ('localhost', 0), None)
+        os.chmod(self.root, 0o755)
+        self.assertRaises(ValueError, serve,
+                          os.path.join(self.root, 'sock'), None)
+        sock_dir = os.path.join(self.root, 'private')
+        make_private_dir(sock_dir)
+        self.assertEqual(0o700, os.stat(sock_dir).st_mode & 0o777)
+
+
+if __name__ == '__main__':
+    unittest.main()
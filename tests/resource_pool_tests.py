@@ -0,0 +1,224 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from scons_package.genrule_cache import find_executable
+from scons_package.resource_pool import ResourcePoolRegistry
+
+
+class TestResourcePoolRegistry(unittest.TestCase):
+
+    def test_get_pool(self):
+        rpreg = ResourcePoolRegistry()
+        rpreg.add_pool('link', 4)
+        rpreg.add_pool('lto', 2)
+        rpreg.set_builder_type_pool('Program', 'link')
+
+        self.assertEqual('link', rpreg.get_pool('Program').name)
+        self.assertEqual('lto', rpreg.get_pool('Program', 'lto').name)
+        self.assertEqual(None, rpreg.get_pool('StaticLibrary'))
+        self.assertEqual(2, rpreg.get_pool('StaticLibrary', 'lto').size)
+        self.assertRaises(KeyError, rpreg.get_pool, 'Program', 'x')
+
+    def test_invalid_pool(self):
+        rpreg = ResourcePoolRegistry()
+        rpreg.add_pool('link', 4)
+        self.assertRaises(KeyError, rpreg.add_pool, 'link', 2)
+        self.assertRaises(ValueError, rpreg.add_pool, 'lto', 0)
+        self.assertRaises(KeyError,
+                          rpreg.set_builder_type_pool, 'Program', 'x')
+
+    def test_pool(self):
+        rpreg = ResourcePoolRegistry()
+        rpreg.add_pool('lto', 2)
+        pool = rpreg.get_pool('Program', 'lto')
+        lock = threading.Lock()
+        running = [0, 0]  # Current and maximum number of running calls
+
+        def action(seconds):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(seconds)
+            with lock:
+                running[0] -= 1
+            if seconds > 0.05:
+                raise RuntimeError('failed action')
+            return seconds
+
+        pooled_action = pool.wrap(action)
+
+        def run(seconds):
+            try:
+                pooled_action(seconds)
+            except RuntimeError:
+                pass
+
+        threads = [threading.Thread(target=run, args=(0.01 * i,))
+                   for i in range(7)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2, running[1])
+        # A failed action releases its slot
+        self.assertEqual(0.01, pool.call(action, 0.01))
+
+
+def can_build():
+    if not find_executable('cc', os.environ.get('PATH', os.defpath)):
+        return False
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['scons', '--version'],
+                                   stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(can_build(), 'requires scons and a C compiler')
+class TestPoolBuild(unittest.TestCase):
+
+    SCONSTRUCT = '''
+import sys
+sys.path.insert(0, %r)
+import scons_package as sp
+sp.default_environment(Environment())
+sp.resource_pool('link', 1, [sp.builder_maker.PROGRAM])
+sp.resource_pool('test', 1)
+sp.load_packages()
+sp.make_builders()
+'''
+
+    SCONSCRIPT = '''
+import scons_package as sp
+sp.program('ok', ['ok.c'])
+sp.program('bad', ['bad.c'])
+sp.test('bad_test', ['bad.c'])
+sp.test('t', ['t.c'], shards=2)
+'''
+
+    def setUp(self):
+        self.topdir = tempfile.mkdtemp()
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        sources = {'SConstruct': self.SCONSTRUCT % tests_dir,
+                   'p/SConscript': self.SCONSCRIPT,
+                   'p/ok.c': 'int main(void) { return 0; }\n',
+                   'p/bad.c': 'int f(void);\n'
+                              'int main(void) { return f(); }\n',
+                   'p/t.c': 'int main(void) { return 1; }\n'}
+        os.mkdir(os.path.join(self.topdir, 'p'))
+        for path, contents in sources.items():
+            with open(os.path.join(self.topdir, path), 'w') as src_file:
+                src_file.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.topdir)
+
+    def scons(self, *args):
+        proc = subprocess.Popen(['scons', '-Q'] + list(args),
+                                cwd=self.topdir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        self.assertNotEqual(0, proc.returncode, output)
+        self.assertNotIn('Internal Error', output)
+        self.assertNotIn('dependency cycle', output)
+        return output
+
+    def test_failed_action(self):
+        # Pooled links fail while the other links of the pool are pending
+        self.scons('-j4', '.')
+        output = self.scons('-k', '-j4', '.')
+        self.assertIn('FAIL: p/t (shard 1 of 2)', output)
+        self.assertIn('FAIL: p/t (shard 2 of 2)', output)
+        self.assertTrue(os.path.exists(os.path.join(self.topdir, 'p/ok')),
+                        output)
+        self.assertFalse(os.path.exists(os.path.join(self.topdir, 'p/bad')),
+                         output)
+
+
+
+# A fake compiler and linker sleeping and logging its run time
+TOOL = '''
+import os, sys, time
+kind, seconds, args = sys.argv[1], float(sys.argv[2]), sys.argv[3:]
+start = time.time()
+time.sleep(seconds)
+output = args[args.index('-o') + 1]
+with open(output, 'w') as output_file:
+    output_file.write(kind)
+with open(os.environ['TOOL_LOG'], 'a') as log:
+    log.write('%s %s %f %f\\n' % (kind, output, start, time.time()))
+'''
+
+
+@unittest.skipUnless(can_build(), 'requires scons and a C compiler')
+class TestPoolScheduling(unittest.TestCase):
+
+    SCONSTRUCT = '''
+import os
+import sys
+sys.path.insert(0, %r)
+import scons_package as sp
+tool = '%%s %%s' %% (sys.executable, os.path.abspath('tool.py'))
+sp.default_environment(Environment(
+    CC=tool + ' cc 0.2', LINK=tool + ' link 0.5',
+    ENV={'TOOL_LOG': os.path.abspath('log.txt')}))
+sp.resource_pool('link', 1, [sp.builder_maker.PROGRAM])
+sp.load_packages()
+sp.make_builders()
+'''
+
+    SCONSCRIPT = '''
+import scons_package as sp
+for name in 'abc':
+    sp.program(name, [name + '.c'])
+sp.library('lib', ['l%d.c' % i for i in range(8)])
+'''
+
+    def setUp(self):
+        self.topdir = tempfile.mkdtemp()
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        sources = {'SConstruct': self.SCONSTRUCT % tests_dir,
+                   'tool.py': TOOL,
+                   'p/SConscript': self.SCONSCRIPT}
+        for name in ['a', 'b', 'c'] + ['l%d' % i for i in range(8)]:
+            sources['p/%s.c' % name] = ''
+        os.mkdir(os.path.join(self.topdir, 'p'))
+        for path, contents in sources.items():
+            with open(os.path.join(self.topdir, path), 'w') as src_file:
+                src_file.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.topdir)
+
+    def test_compile_while_linking(self):
+        proc = subprocess.Popen(['scons', '-Q', '-j3', '.'],
+                                cwd=self.topdir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        self.assertEqual(0, proc.returncode, output)
+        with open(os.path.join(self.topdir, 'log.txt')) as log:
+            actions = [(kind, float(start), float(end))
+                       for kind, _, start, end in
+                       (line.split() for line in log)]
+        links = sorted(action for action in actions if action[0] == 'link')
+        self.assertEqual(3, len(links))
+        for link, next_link in zip(links, links[1:]):
+            self.assertLessEqual(link[2], next_link[1])
+        # Links waiting for the pool do not hold jobs, so the other two
+        # jobs keep compiling while the first link runs
+        _, start, end = min(links, key=lambda link: link[1])
+        compiles = [action for action in actions if action[0] == 'cc' and
+                    action[1] < end and action[2] > start]
+        self.assertGreaterEqual(len(compiles), 2, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
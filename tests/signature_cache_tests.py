@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from scons_package import signature_cache
+from scons_package.remote_exec import find_executable
+from scons_package.signature_cache import SignatureCache
+
+
+class TestSignatureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.root, 'signatures.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, contents, mtime=1000000000):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as file_obj:
+            file_obj.write(contents)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_prefetch(self):
+        a = self.write('a.h', b'int a();\n')
+        b = self.write('b.h', b'')
+        missing = os.path.join(self.root, 'missing.h')
+        cache = SignatureCache(jobs=2)
+        self.assertEqual({a: hashlib.md5(b'int a();\n').hexdigest(),
+                          b: hashlib.md5(b'').hexdigest()},
+                         cache.prefetch([a, b, missing, self.root, a]))
+        self.assertEqual([a, b], cache.get_paths())
+
+    def test_mmap(self):
+        contents = b'x' * (signature_cache.MMAP_THRESHOLD + 1)
+        path = self.write('big.cc', contents)
+        self.assertEqual(hashlib.sha256(contents).hexdigest(),
+                         signature_cache.digest_file(path, len(contents),
+                                                     'sha256'))
+
+    def test_cache(self):
+        a = self.write('a.h', b'int a();\n')
+        cache = SignatureCache()
+        cache.prefetch([a])
+        cache.save_cache(self.cache_path)
+
+        # Signatures are reused while sizes and mtimes are unchanged
+        cache = SignatureCache()
+        cache.load_cache(self.cache_path)
+        cache.signatures[a].digest = 'stale'
+        self.assertEqual({a: 'stale'}, cache.prefetch([a]))
+        self.write('a.h', b'int b();\n', mtime=1000000001)
+        self.assertEqual({a: hashlib.md5(b'int b();\n').hexdigest()},
+                         cache.prefetch([a]))
+
+        # Signatures of another hash are not used
+        cache = SignatureCache('sha1')
+        cache.load_cache(self.cache_path)
+        self.assertEqual([], cache.get_paths())
+
+    def test_racy_files(self):
+        old = self.write('old.h', b'old')
+        new = self.write('new.h', b'new')
+        os.utime(new, None)  # Now
+        cache = SignatureCache()
+        cache.prefetch([old, new])
+        cache.update('other.h', 1, 1000000000, 'digest')
+        cache.save_cache(self.cache_path)
+        cache = SignatureCache()
+        cache.load_cache(self.cache_path)
+        self.assertEqual(sorted([old, 'other.h']), cache.get_paths())
+
+
+def can_build():
+    if not find_executable('cc', os.environ.get('PATH', os.defpath)):
+        return False
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['scons', '--version'],
+                                   stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+
+@unittest.skipUnless(can_build(), 'requires scons and a C compiler')
+class TestPrefetchSignatures(unittest.TestCase):
+
+    SCONSTRUCT = '''
+import sys
+sys.path.insert(0, %r)
+import scons_package as sp
+sp.default_environment(Environment())
+sp.load_packages(skip_dirs=['out'])
+sp.make_builders(sconscript='build.scons', build_root='out')
+sp.prefetch_signatures()
+for path in ('out/p/foo.c', 'out/p/foo.h'):
+    print('CSIG %%s %%s' %% (path, getattr(File('#' + path).get_ninfo(),
+                                        'csig', None)))
+'''
+
+    SOURCES = {
+        'build.scons': 'import scons_package as sp\n'
+                       'Import("variant")\n'
+                       'sp.make_variant_builders(variant)\n',
+        'p/SConscript': 'import scons_package as sp\n'
+                        'sp.library("foo", ["foo.c"])\n',
+        'p/foo.c': '#include "foo.h"\n'
+                   'int foo(void) { return FOO; }\n',
+        'p/foo.h': '#define FOO 1\n',
+    }
+
+    def setUp(self):
+        self.topdir = tempfile.mkdtemp()
+        tests_dir = os.path.dirname(os.path.abspath(__file__))
+        sources = dict(self.SOURCES, SConstruct=self.SCONSTRUCT % tests_dir)
+        os.mkdir(os.path.join(self.topdir, 'p'))
+        for path, contents in sources.items():
+            path = os.path.join(self.topdir, path)
+            with open(path, 'w') as src_file:
+                src_file.write(contents)
+            # Signatures of files modified just now are not kept
+            os.utime(path, (1000000000, 1000000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.topdir)
+
+    def build(self):
+        proc = subprocess.Popen(['scons', '-Q', '.'], cwd=self.topdir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        self.assertEqual(0, proc.returncode, output)
+        csigs = {}
+        for line in output.splitlines():
+            if line.startswith('CSIG '):
+                _, path, csig = line.split()
+                csigs[path] = csig
+        cache_path = os.path.join(self.topdir,
+                                  '.scons_package/signatures.json')
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+        return csigs, cache
+
+    def digest(self, cache, path):
+        with open(os.path.join(self.topdir, path), 'rb') as src_file:
+            return hashlib.new(cache['hash'], src_file.read()).hexdigest()
+
+    def test_variant_dir(self):
+        csigs, cache = self.build()
+        # The copy of the source is seeded with the signature of the source
+        self.assertEqual(self.digest(cache, 'p/foo.c'), csigs['out/p/foo.c'])
+        self.assertEqual('None', csigs['out/p/foo.h'])
+        # The copy of the header, which SCons hashes, is recorded as the
+        # header and seeds the copy in the next build
+        self.assertEqual(self.digest(cache, 'p/foo.h'),
+                         cache['files']['p/foo.h'][2])
+        self.assertNotIn('out/p/foo.h', cache['files'])
+        csigs, cache = self.build()
+        self.assertEqual(self.digest(cache, 'p/foo.h'), csigs['out/p/foo.h'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import sys
+import unittest
+
+from scons_package.test_runner import *
+
+
+class TestTestRunner(unittest.TestCase):
+
+    def test_test_options(self):
+        options = TestOptions()
+        self.assertEqual([], options.data)
+        self.assertEqual(1, options.shards)
+        self.assertEqual(None, options.timeout)
+        self.assertRaises(ValueError, TestOptions, shards=0)
+        self.assertRaises(ValueError, TestOptions, timeout=0)
+
+    def test_get_shard_environ(self):
+        environ = {'PATH': '/bin'}
+        self.assertEqual(environ, get_shard_environ(environ, 0, 1))
+        shard_environ = get_shard_environ(environ, 1, 4)
+        self.assertEqual('4', shard_environ['TEST_TOTAL_SHARDS'])
+        self.assertEqual('1', shard_environ['TEST_SHARD_INDEX'])
+        self.assertEqual('4', shard_environ['GTEST_TOTAL_SHARDS'])
+        self.assertEqual('1', shard_environ['GTEST_SHARD_INDEX'])
+        self.assertEqual({'PATH': '/bin'}, environ)
+
+    def test_get_result_path(self):
+        self.assertEqual('a/t.test_result', get_result_path('a/t', 0, 1))
+        self.assertEqual('a/t.test_result-2-of-3',
+                         get_result_path('a/t', 1, 3))
+
+    def test_run_process(self):
+        argv = [sys.executable, '-c', 'print("ok")']
+        status, output, timed_out = run_process(argv, None, None)
+        self.assertEqual(0, status)
+        self.assertEqual('ok', output.strip())
+        self.assertFalse(timed_out)
+
+        argv = [sys.executable, '-c', 'import sys; sys.exit(3)']
+        status, _, timed_out = run_process(argv, None, 10)
+        self.assertEqual(3, status)
+        self.assertFalse(timed_out)
+
+        argv = [sys.executable, '-c', 'import time; time.sleep(10)']
+        status, _, timed_out = run_process(argv, None, 0.1)
+        self.assertNotEqual(0, status)
+        self.assertTrue(timed_out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
+import random
 import unittest
 
-from scons_package.utils import topology_sort
+from scons_package.utils import IncrementalTopologicalOrder, topology_sort
 
 
 class TestTopologySort(unittest.TestCase):
@@ -47,5 +48,74 @@ class TestTopologySort(unittest.TestCase):
         self.assertRaises(ValueError, topology_sort, nodes, lambda n: graph[n])
 
 
+class TestIncrementalTopologicalOrder(unittest.TestCase):
+
+    def assertOrder(self, order):
+        nodes = list(order)
+        self.assertEqual(len(order), len(nodes))
+        positions = dict((node, i) for i, node in enumerate(nodes))
+        for node in nodes:
+            for neighbor in order.neighbors[node]:
+                self.assertLess(positions[neighbor], positions[node])
+
+    def test_add_edge(self):
+        order = IncrementalTopologicalOrder()
+        for node in (1, 2, 3, 4):
+            order.add_node(node)
+        order.add_edge(1, 2)
+        order.add_edge(2, 3)
+        order.add_edge(3, 4)
+        self.assertEqual([4, 3, 2, 1], list(order))
+        order.add_edge(1, 1)  # Self-reference
+        self.assertEqual([4, 3, 2, 1], list(order))
+
+    def test_reorder_region_only(self):
+        order = IncrementalTopologicalOrder()
+        for node in (1, 2, 3, 4, 5):
+            order.add_node(node)
+        order.add_edge(2, 4)
+        self.assertEqual([1, 4, 3, 2, 5], list(order))
+
+    def test_invalid_topology(self):
+        order = IncrementalTopologicalOrder()
+        for node in (1, 2, 3):
+            order.add_node(node)
+        order.add_edge(1, 2)
+        order.add_edge(2, 3)
+        self.assertRaises(ValueError, order.add_edge, 3, 1)
+        self.assertEqual(set(), order.neighbors[3])
+        self.assertOrder(order)
+
+    def test_remove(self):
+        order = IncrementalTopologicalOrder()
+        for node in (1, 2, 3, 4):
+            order.add_node(node)
+        order.set_neighbors(1, [2, 3])
+        order.set_neighbors(4, [1])
+        order.remove_node(2)
+        order.remove_node(3)
+        self.assertEqual([1, 4], list(order))
+        self.assertEqual(set(), order.neighbors[1])
+        order.set_neighbors(4, [])
+        order.add_edge(1, 4)
+        self.assertEqual([4, 1], list(order))
+
+    def test_random_graph(self):
+        rand = random.Random(7)
+        order = IncrementalTopologicalOrder()
+        for node in range(50):
+            order.add_node(node)
+        for _ in range(300):
+            node, neighbor = rand.sample(range(50), 2)
+            # Only edges from larger to smaller nodes, so it is acyclic
+            order.add_edge(max(node, neighbor), min(node, neighbor))
+            self.assertOrder(order)
+        for node in range(0, 50, 3):
+            order.remove_node(node)
+        self.assertOrder(order)
+        self.assertEqual(sorted(set(range(50)) - set(range(0, 50, 3))),
+                         sorted(order))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -48,3 +48,107 @@ def topology_sort(nodes, get_neighbors):
         raise ValueError('incorrect topology')
 
     return output
+
+
+class IncrementalTopologicalOrder(object):
+    '''Topological order maintained under node and edge updates.
+
+    Like topology_sort, a node comes after its neighbors.  Adding an edge
+    that violates the order reorders only the nodes positioned between
+    its endpoints (Pearce and Kelly's algorithm); removing nodes or edges
+    never reorders.
+    '''
+
+    def __init__(self):
+        self.index = {}  # Node -> position
+        self.slots = []  # Position -> node, or None after removal
+        self.neighbors = defaultdict(set)
+        self.reverse_neighbors = defaultdict(set)
+        self.num_holes = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def __iter__(self):
+        return (node for node in self.slots if node is not None)
+
+    def add_node(self, node):
+        if node not in self.index:
+            self.index[node] = len(self.slots)
+            self.slots.append(node)
+
+    def remove_node(self, node):
+        for neighbor in self.neighbors.pop(node, ()):
+            self.reverse_neighbors[neighbor].discard(node)
+        for reverse_neighbor in self.reverse_neighbors.pop(node, ()):
+            self.neighbors[reverse_neighbor].discard(node)
+        self.slots[self.index.pop(node)] = None
+        self.num_holes += 1
+        if self.num_holes > len(self.slots) // 2:
+            self._compact()
+
+    def set_neighbors(self, node, neighbors):
+        neighbors = set(neighbors)
+        neighbors.discard(node)  # Remove self-reference
+        for neighbor in self.neighbors[node] - neighbors:
+            self.remove_edge(node, neighbor)
+        for neighbor in neighbors - self.neighbors[node]:
+            self.add_edge(node, neighbor)
+
+    def remove_edge(self, node, neighbor):
+        self.neighbors[node].discard(neighbor)
+        self.reverse_neighbors[neighbor].discard(node)
+
+    def add_edge(self, node, neighbor):
+        '''Add an edge that node comes after neighbor.'''
+        assert node in self.index and neighbor in self.index
+        if node == neighbor:
+            return
+        lower = self.index[node]
+        upper = self.index[neighbor]
+        if lower > upper:
+            self.neighbors[node].add(neighbor)
+            self.reverse_neighbors[neighbor].add(node)
+            return
+        # Nodes in [lower, upper] that must come after node
+        forward = self._search(node, self.reverse_neighbors,
+                               lambda index: index <= upper)
+        if neighbor in forward:
+            raise ValueError('incorrect topology')
+        # Nodes in [lower, upper] that neighbor must come after
+        backward = self._search(neighbor, self.neighbors,
+                                lambda index: index >= lower)
+        self.neighbors[node].add(neighbor)
+        self.reverse_neighbors[neighbor].add(node)
+        self._reorder(backward, forward)
+
+    def _search(self, start, graph, in_region):
+        visited = set([start])
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for next_node in graph[node]:
+                if (next_node in visited or
+                        not in_region(self.index[next_node])):
+                    continue
+                visited.add(next_node)
+                stack.append(next_node)
+        return visited
+
+    def _reorder(self, backward, forward):
+        def by_index(node):
+            return self.index[node]
+        nodes = sorted(backward, key=by_index) + sorted(forward, key=by_index)
+        positions = sorted(self.index[node] for node in nodes)
+        for node, index in zip(nodes, positions):
+            self.index[node] = index
+            self.slots[index] = node
+
+    def _compact(self):
+        self.slots = [node for node in self.slots if node is not None]
+        for index, node in enumerate(self.slots):
+            self.index[node] = index
+        self.num_holes = 0